@@ -1,91 +1,64 @@
 import streamlit as st
-import requests
-import base64
+import os
 import json
-import boto3
-import mimetypes
-from io import BytesIO
-from PIL import Image
-from rapidfuzz import fuzz, process
-
-
-# Load AWS credentials from access_key.json
-with open('access_key2.json', 'r') as f:
-    credentials = json.load(f)
-    AWS_ACCESS_KEY_ID = credentials['Access_key_ID']
-    AWS_SECRET_ACCESS_KEY = credentials['Secret_access_key']
-
-# Initialize Bedrock client with credentials
-bedrock = boto3.client(
-    "bedrock-runtime",
-    region_name="us-east-1",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-)
-
-# Load the pharma_images_dict.json
-with open('pharma_images_dict.json', 'r') as f:
-    pharma_images_dict = json.load(f)
-
-def encode_image_to_base64(image_bytes, file_extension):
-    media_type = f"image/{file_extension}" if file_extension else "image/jpeg"
-    return base64.b64encode(image_bytes).decode('utf-8'), media_type
-
-def fetch_image_from_url(image_url):
-    try:
-        response = requests.get(image_url, timeout=5)
-        response.raise_for_status()
-        image_bytes = response.content
-        content_type = response.headers.get('Content-Type', '')
-        file_extension = mimetypes.guess_extension(content_type).lstrip('.') if content_type else 'jpg'
-        return image_bytes, file_extension
-    except requests.exceptions.RequestException as e:
-        return None, str(e)
-
-def query_bedrock_llm_images(image_base64, prompt):
-    # Prepare the input for the multimodal model
-    body = json.dumps({
-        "anthropic_version": "bedrock-2023-05-31",
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    image_base64,
-                    {
-                        "type": "text",
-                        "text": prompt
-                    }
-                ]
-            }
-        ],
-        "max_tokens": 1700,
-        "temperature": 0.1
-    })
-    accept = 'application/json'
-    contentType = 'application/json'
-    # Invoke the model
-    response = bedrock.invoke_model(
-        modelId='anthropic.claude-3-sonnet-20240229-v1:0',  # Use Claude 3 Sonnet
-        body=body, accept=accept, contentType=contentType
-    )
-    return response['body'].read().decode('utf-8')
-
+import time
+from llm_client import as_llm_client, create_bedrock_client
+
+
+# Heavy modules (boto3, numpy, rapidfuzz, PIL, bs4) and data files are loaded on
+# first use and kept for the life of the process, not on every rerun
+
+@st.cache_resource
+def load_bedrock_client():
+    return create_bedrock_client('access_key2.json', region_name="us-east-1")
+
+@st.cache_resource
+def load_image_index():
+    # Indexed form of pharma_images_dict.json, built on first use (see image_index.py)
+    from image_index import ImageIndex
+    return ImageIndex.open('pharma_images.db', 'pharma_images_dict.json')
+
+@st.cache_resource
+def load_banned_index():
+    # Built once per process instead of re-reading the list on every rerun
+    from banned_index import BannedDrugIndex
+    return BannedDrugIndex.from_file('banned_drug.json')
+
+@st.cache_resource
+def load_cascade():
+    from cascade import DecisionCascade
+    return DecisionCascade(load_banned_index())
+
+@st.cache_resource
+def load_classification_cache():
+    from classification_cache import ClassificationCache
+    return ClassificationCache('classification_cache.db')
+
+@st.cache_resource
+def load_search_cache():
+    from search_cache import SearchCache
+    return SearchCache('search_cache.db')
+
+@st.cache_resource
+def load_source_corpus():
+    from corpus import SourceCorpus
+    return SourceCorpus('corpus')
+
+@st.cache_resource
+def load_results_store():
+    from results_store import ResultsStore
+    return ResultsStore('results.db', flush_every=1)
+
+@st.cache_resource
+def load_image_analyzer():
+    from image_analysis import ImageAnalyzer
+    return ImageAnalyzer(load_bedrock_client(), cache_dir='image_cache', max_concurrency=4)
 
 def query_bedrock_llm(prompt):
-    body = json.dumps({
-        "anthropic_version": "bedrock-2023-05-31",
-        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
-        "max_tokens": 1700,
-        "temperature": 0.1
-    })
     try:
-        response = bedrock.invoke_model(
-            modelId='anthropic.claude-3-sonnet-20240229-v1:0',
-            body=body,
-            accept='application/json',
-            contentType='application/json'
-        )
-        return response['body'].read().decode('utf-8')
+        llm = as_llm_client(load_bedrock_client())
+        response = llm.complete('anthropic.claude-3-sonnet-20240229-v1:0', prompt, max_tokens=1700, temperature=0.1)
+        return json.dumps(response)
     except Exception as e:
         return json.dumps({"error": str(e)})
 
@@ -109,98 +82,60 @@ def main():
             json_data = json.loads(json_input)
         except json.JSONDecodeError:
             st.error("Invalid JSON input. Please provide valid JSON data.")
-    image_bytes = None
-    file_extension = None
-    image_urls = []
+    images = []
+    remote_urls = []
 
     if option == "Upload Image":
         uploaded_files = st.file_uploader("Upload pharmaceutical product images", type=["png", "jpg", "jpeg", "webp"], accept_multiple_files=True)
         if uploaded_files:
             for uploaded_file in uploaded_files:
                 file_extension = uploaded_file.type.split('/')[-1]
-                image_bytes = uploaded_file.read()
-                image_base64, media_type = encode_image_to_base64(image_bytes, file_extension)
-                image_urls.append({"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_base64}})
+                images.append((uploaded_file.read(), file_extension))
 
     elif option == "Image URL":
         image_url_input = st.text_area("Enter multiple image URLs (comma-separated)")
         if st.button("Fetch Images"):
-            urls = [url.strip() for url in image_url_input.split(',') if url.strip()]
-            for url in urls:
-                image_bytes, error_or_ext = fetch_image_from_url(url)
-                if image_bytes:
-                    file_extension = error_or_ext
-                    image_base64, media_type = encode_image_to_base64(image_bytes, file_extension)
-                    image_urls.append({"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_base64}})
-                else:
-                    st.error(f"Failed to fetch image: {error_or_ext}")
-            st.info("Images fetched successfully!")
+            remote_urls = [url.strip() for url in image_url_input.split(',') if url.strip()]
 
-    if not image_urls and json_data.get('pc_item_id'):
-        product_id = json_data['pc_item_id']
-        if product_id in pharma_images_dict:
-            urls = pharma_images_dict[product_id]
-            for url in urls:
-                image_bytes, error_or_ext = fetch_image_from_url(url)
-                if image_bytes:
-                    file_extension = error_or_ext
-                    image_base64, media_type = encode_image_to_base64(image_bytes, file_extension)
-                    image_urls.append({"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_base64}})
-            st.info("Images fetched successfully!")
+    if not images and not remote_urls and json_data.get('pc_item_id'):
+        image_index = load_image_index()
+        if image_index is not None:
+            remote_urls = image_index.get(json_data['pc_item_id'], [])
 
-    if json_data or image_urls:
+    service_url = os.environ.get('CLASSIFIER_SERVICE_URL')
+    if service_url and json_data.get('pname') and not images:
+        # Thin client: the service keeps the clients warm and does the work
+        if st.button("Analyze Product"):
+            from service import classify_remote
+            st.info("Sending the product to the classification service...")
+            row = classify_remote(service_url, dict(json_data, image_urls=remote_urls))
+            st.info(f"Decided by {row.get('source')}: {row.get('reason')}")
+            st.json(row)
+        return
+
+    if json_data or images or remote_urls:
+        import prediction as pred
+        from cascade import salts_from_image_details
+        from image_analysis import IMAGE_EXTRACTION_PROMPT
+        bedrock = load_bedrock_client()
         # Step 2: Prepare the prompt for the LLM
-        with open('banned_drugs.json', 'r') as f:
-            bannedDrugs = json.load(f)
-
-        # Fuzzy match function
-        def find_best_match(pname, banned_drugs, threshold=80):
-            best_match = None
-            best_score = 0
-
-            for drug in banned_drugs:
-                drug_name = drug["drug_name"]
-                score = fuzz.ratio(pname.lower(), drug_name.lower())  # Compute similarity
-
-                if score > best_score and score >= threshold:
-                    best_match = drug
-                    best_score = score
-
-            return best_match, best_score
-      
-        prompt = """
-        You are an expert in pharmaceutical regulations and drug classification. Given an image of a pharmaceutical product label, perform the following tasks:
-
-        1. **Extract and structure the following pharmaceutical information:**
-           - **Product Name**
-           - **Salt Composition**
-           - **Dosage Strength**
-           - **Formulation Type** (e.g., Tablet, Capsule, Syrup)
-           - **Quantity** (e.g., 10 Tablets, 100 Capsules)
-           - **Prescription Status** (Rx Only, OTC, Controlled Drug)
-           - **Manufacturer**    
-        2. **Return the structured JSON output with these details:**
-        ```json
-        {
-            "Product Name": "<Extracted Product Name>",
-            "Salt Composition": "<Extracted Salt Composition>",
-            "Dosage Strength": "<Extracted Dosage Strength>",
-            "Formulation Type": "<Extracted Formulation>",
-            "Quantity": "<Extracted Quantity>",
-            "Prescription Status": "<Rx Only / OTC / Controlled Drug / NA>",
-            "Manufacturer": "<Extracted Manufacturer>"
-        }
-        ```
-        """ 
-        if image_urls:
+        banned_index = load_banned_index()
+
+        prompt = IMAGE_EXTRACTION_PROMPT
+        if images or remote_urls:
             st.info("Analyzing each image for information...")
 
-        prd_image_details= []
-        for image_url in image_urls:
-            result = query_bedrock_llm_images(image_url, prompt)
-            prd_image_details.append(result)
+        # Identical images are analysed once and results are cached by content hash
+        analyzer = load_image_analyzer()
+        prd_image_details = analyzer.analyze(images, prompt)
+        if remote_urls:
+            url_details, errors = analyzer.fetch_and_analyze(remote_urls, prompt)
+            for url, error in errors:
+                st.error(f"Failed to fetch image: {error}")
+            prd_image_details.extend(url_details)
+            st.info("Images fetched successfully!")
 
-        if image_urls:
+        if images or remote_urls:
             st.info("Image analysis completed!")
             
         combined_prompt = {
@@ -208,35 +143,45 @@ def main():
             "prd_description": json_data.get('description', ''),
             "prd_isq": json_data.get('isq', ''),
             "prd_img_details": prd_image_details,
-            "banned_drug_list": bannedDrugs["banned_drugs"]
+            "banned_drug_list": banned_index.entries
         }
 
         
         if st.button("Analyze Product"):
             st.info("Processing product details with AWS Bedrock LLM...")
-              # Run matching
-            best_match, score = find_best_match(json_data["pname"], bannedDrugs["banned_drugs"])
+            started = time.perf_counter()
+            row = {"pc_item_id": json_data.get('pc_item_id'), "pname": json_data.get('pname', '')}
+              # Try the cheap tiers (banned list, banned FDC salts, known molecules, small model) first
+            decision = load_cascade().decide(bedrock, json_data.get('pname', ''),
+                                             salts=lambda: salts_from_image_details(prd_image_details))
 
             # Print result
-            if best_match and score >= 60:
-                response = {
-                                "classification": "Banned",
-                                "detailed_classification": "Banned, not for sale",
-                                "confidence_level": f"Similarity Score: {score}%",
-                                "justification": "Found in banned_drug_list",
-                                "matched_drug": best_match["drug_name"],
-                                "notification_no": best_match["notification_no"],
-                                "date": best_match["date"]
-                            }
-                st.json(response)
+            if decision:
+                st.info(f"Decided by the {decision['source']} tier: {decision['reason']}")
+                st.json(decision)
+                row.update(decision)
             else:
-                st.info(f"No exact match found in the banned drug list. Similarity is {score}%. Proceeding with further analysis.")
+                st.info("No conclusive match in the banned list or the known molecules. Proceeding with further analysis.")
             # Call the LLM with the combined prompt
-                import prediction as pred
-                classifier = pred.DrugBanClassifier()
+                classifier = pred.DrugBanClassifier(cache=load_classification_cache(), corpus=load_source_corpus(),
+                                                    search_cache=load_search_cache())
                 st.info("\nSearching for information about the drug's banned status in India...")
-                result = classifier.classify_drug(bedrock,json_data.get('pname', ''),combined_prompt)
-                st.json(pred.parse_classification_response(result['classification_result']))
+                # Show the answer while it is generated instead of after the whole justification
+                answer = st.empty()
+                streamed = []
+
+                def show_text(delta):
+                    streamed.append(delta)
+                    answer.code("".join(streamed), language="xml")
+
+                result = classifier.classify_drug(bedrock,json_data.get('pname', ''),combined_prompt, on_text=show_text)
+                answer.empty()
+                parsed = pred.parse_classification_response(result['classification_result'])
+                st.json(parsed)
+                row.update(parsed or {"error": "Unable to parse classification response"})
+                row.update(source="llm", sources_analyzed=result["sources_analyzed"])
+            # Every verdict is kept for later queries (see results_store.py)
+            load_results_store().add(row, duration_ms=(time.perf_counter() - started) * 1000)
 
             if st.button("Restart Analysis"):
                 st.experimental_rerun()
@@ -0,0 +1,134 @@
+"""
+Precompiled index over the banned drug list.
+
+The list is loaded and normalized once; queries are answered by rapidfuzz's
+C++ scorers instead of a Python loop over every entry. Single lookups try an
+exact name hit first and are then narrowed to the entries whose length can
+still reach the threshold; batches are scored in one vectorized
+process.cdist call.
+"""
+import re
+import json
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_name(text):
+    """Lowercase, strip punctuation and collapse whitespace."""
+    text = _PUNCT_RE.sub(' ', (text or '').lower())
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+class BannedDrugIndex:
+    def __init__(self, banned_drugs):
+        """
+        Build the index from banned drug entries.
+
+        Parameters:
+        - banned_drugs: list of dict, entries with drug_name, notification_no, date
+        """
+        self.entries = list(banned_drugs)
+        self.names = [normalize_name(drug["drug_name"]) for drug in self.entries]
+
+        # Exact normalized name -> first entry index
+        self._exact = {}
+        for idx, name in enumerate(self.names):
+            self._exact.setdefault(name, idx)
+
+        # Entries sorted by name length for the length window prefilter
+        self._order = np.array(sorted(range(len(self.names)), key=lambda i: len(self.names[i])), dtype=np.int64)
+        self._sorted_names = [self.names[i] for i in self._order]
+        self._sorted_lengths = [len(name) for name in self._sorted_names]
+
+    @classmethod
+    def from_file(cls, path='banned_drug.json'):
+        """Load the index from a banned drug JSON file."""
+        with open(path, 'r') as f:
+            return cls(json.load(f)["banned_drugs"])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _length_window(self, qlen, threshold):
+        """
+        Return the [lo, hi) slice of length-sorted entries that can reach
+        `threshold` with fuzz.ratio.
+
+        The filter is lossless: ratio = 2 * LCS / (len(a) + len(b)), so a
+        ratio of t% needs 2 * min(len) >= t% * (len(a) + len(b)).
+        """
+        if threshold <= 0:
+            return 0, len(self._sorted_names)
+        if threshold >= 200:
+            return 0, 0
+        min_len = threshold * qlen / (200 - threshold)
+        max_len = (200 - threshold) * qlen / threshold
+        lo = bisect_left(self._sorted_lengths, min_len - 1e-9)
+        hi = bisect_right(self._sorted_lengths, max_len + 1e-9)
+        return lo, hi
+
+    def match(self, pname, threshold=80):
+        """
+        Find the banned entry most similar to a product name.
+
+        Parameters:
+        - pname: str, product name to match
+        - threshold: int, minimum similarity score for a match
+
+        Returns:
+        - tuple of (matched entry or None, best score)
+        """
+        query = normalize_name(pname)
+        if not query:
+            return None, 0
+        exact = self._exact.get(query)
+        if exact is not None and threshold <= 100:
+            return self.entries[exact], 100.0
+        lo, hi = self._length_window(len(query), threshold)
+        if lo >= hi:
+            return None, 0
+        scores = process.cdist(
+            [query], self._sorted_names[lo:hi], scorer=fuzz.ratio,
+            processor=None, score_cutoff=threshold
+        )[0]
+        best_score = scores.max()
+        if best_score <= 0 or best_score < threshold:
+            return None, 0
+        # Ties resolve to the earliest entry of the list, as the linear scan did
+        best = self._order[lo:hi][scores == best_score].min()
+        return self.entries[best], round(float(best_score), 2)
+
+    def match_many(self, pnames, threshold=80, chunk_size=4096):
+        """
+        Match a batch of product names in vectorized calls.
+
+        Parameters:
+        - pnames: list of str, product names to match
+        - threshold: int, minimum similarity score for a match
+        - chunk_size: int, rows scored per cdist call, bounds the score matrix
+
+        Returns:
+        - list of (matched entry or None, best score), one per product name
+        """
+        queries = [normalize_name(pname) for pname in pnames]
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            chunk = queries[start:start + chunk_size]
+            scores = process.cdist(
+                chunk, self.names, scorer=fuzz.ratio, processor=None,
+                score_cutoff=threshold, workers=-1
+            )
+            best_idx = scores.argmax(axis=1)
+            best_scores = scores[np.arange(len(chunk)), best_idx]
+            for query, idx, score in zip(chunk, best_idx, best_scores):
+                if query and score > 0 and score >= threshold:
+                    results.append((self.entries[idx], round(float(score), 2)))
+                else:
+                    results.append((None, 0))
+        return results
@@ -0,0 +1,552 @@
+"""
+Headless batch classification of JSONL product catalogs.
+
+Each input line is a product record with pc_item_id, pname, description and
+isq, plus optional image_urls and salt_composition. Records first go through
+the cheap cascade tiers (banned list, banned FDC salts, known molecules, a
+small model call) and only the undecided ones through DrugBanClassifier and
+parse_classification_response. Results are appended to the output JSONL as
+soon as they finish. The output file doubles as the checkpoint: on restart,
+records that already have a successful result are skipped.
+
+Usage:
+    python batch.py catalog.jsonl results.jsonl --workers 4
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import prediction as pred
+from banned_index import BannedDrugIndex
+from classification_cache import ClassificationCache
+from cascade import DecisionCascade, TIERS, salts_from_image_details
+from corpus import SourceCorpus
+from dedup import ListingClusters
+from fdc_matcher import parse_salts
+from image_analysis import ImageAnalyzer, IMAGE_EXTRACTION_PROMPT
+from ledger import DependencyLedger, file_version
+from llm_client import create_llm_client
+from rate_limit import get_default_limiter
+from results_store import ResultsStore, new_run_id
+from search_cache import SearchCache, molecule_vocabulary
+from tracing import Tracer, JsonlTraceExporter, start_metrics_server
+
+
+# Tiers every clustered listing runs itself before a cluster verdict is copied to it
+MEMBER_TIERS = ('banned_list', 'fdc_components')
+
+
+def iter_records(input_path):
+    """
+    Stream product records from a JSONL file.
+
+    Blank lines are ignored and malformed lines are reported on stderr and
+    skipped, so one bad line does not abort a catalog run.
+
+    Yields:
+    - dict, one product record per line
+    """
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_no}: {e}", file=sys.stderr)
+                continue
+            if record.get('pc_item_id') is None:
+                print(f"Skipping line {line_no}: missing pc_item_id", file=sys.stderr)
+                continue
+            yield record
+
+
+def load_checkpoint(output_path):
+    """
+    Collect the ids of records already classified in a previous run.
+
+    Records whose result carries an "error" are not counted as done, so they
+    are retried. A partially written last line (crash mid-write) is ignored.
+
+    Returns:
+    - set of str, pc_item_id values that are done
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if row.get('pc_item_id') is not None and not row.get('error'):
+                done.add(str(row['pc_item_id']))
+    return done
+
+
+class ResultWriter:
+    """Thread-safe, crash-safe appender for the output JSONL."""
+
+    def __init__(self, output_path):
+        # Terminate a partially written last line so new rows stay parseable
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            with open(output_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+            if needs_newline:
+                with open(output_path, 'a', encoding='utf-8') as f:
+                    f.write('\n')
+        self._file = open(output_path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def write(self, row):
+        line = json.dumps(row, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def build_drug_info(record, banned_drugs, image_details=None):
+    """Build the additional information passed to the classifier, as the app does."""
+    return {
+        "prd_name": record.get('pname', ''),
+        "prd_description": record.get('description', ''),
+        "prd_isq": record.get('isq', ''),
+        "prd_img_details": image_details or [],
+        "banned_drug_list": banned_drugs
+    }
+
+
+class RecordContext:
+    """Image analysis and salts of one record, computed at most once and only when needed."""
+
+    def __init__(self, record, banned_index, image_analyzer=None):
+        self.record = record
+        self.banned_index = banned_index
+        self.image_analyzer = image_analyzer
+        self._image_details = None
+
+    def image_details(self):
+        if self._image_details is None:
+            self._image_details = []
+            if self.image_analyzer is not None and self.record.get('image_urls'):
+                self._image_details, _ = self.image_analyzer.fetch_and_analyze(self.record['image_urls'],
+                                                                               IMAGE_EXTRACTION_PROMPT)
+        return self._image_details
+
+    def salts(self):
+        """Salt composition from the record itself, else from its product images."""
+        return self.record.get('salt_composition') or salts_from_image_details(self.image_details())
+
+    def known_salts(self):
+        """Salts found so far, without analysing images that were not needed."""
+        if self.record.get('salt_composition') or self._image_details is None:
+            return parse_salts(self.record.get('salt_composition'))
+        return self.salts()
+
+    def drug_info(self):
+        return build_drug_info(self.record, self.banned_index.entries, self.image_details())
+
+
+def cascade_row(record, cascade, bedrock, context, match=None):
+    """
+    Run the cheap cascade tiers for a record.
+
+    Returns:
+    - tuple of (dict output row, bool True when a tier decided it)
+    """
+    pname = record.get('pname', '')
+    row = {"pc_item_id": record['pc_item_id'], "pname": pname}
+    decision = cascade.decide(bedrock, pname, salts=context.salts, match=match)
+    if decision is None:
+        return row, False
+    row.update(decision)
+    return row, True
+
+
+def llm_row(row, result):
+    """Fill an output row from a classifier result."""
+    parsed = pred.parse_classification_response(result['classification_result'])
+    if not parsed:
+        row["error"] = "Unable to parse classification response"
+        return row
+    row.update(parsed)
+    row["source"] = "llm"
+    row["reason"] = "Classified from web sources by the full pipeline"
+    row["sources_analyzed"] = result["sources_analyzed"]
+    row["source_hashes"] = result.get("source_hashes", [])
+    return row
+
+
+def classify_record(record, classifier, bedrock, banned_index, match=None, image_analyzer=None, cascade=None,
+                    context=None):
+    """
+    Classify a single product record.
+
+    Parameters:
+    - record: dict, product record (pc_item_id, pname, description, isq)
+    - classifier: DrugBanClassifier instance
+    - bedrock: LLMClient (or a boto3 bedrock-runtime client)
+    - banned_index: BannedDrugIndex over the banned drug list
+    - match: tuple of (entry, score) when already matched in bulk (optional)
+    - image_analyzer: ImageAnalyzer, analyses the record's image_urls if any (optional)
+    - cascade: DecisionCascade, cheap tiers tried before the full pipeline
+      (optional, banned list only otherwise)
+    - context: RecordContext of the record, to read its salts afterwards (optional)
+
+    Returns:
+    - dict, output row for the results file
+    """
+    cascade = cascade or DecisionCascade(banned_index, tiers=('banned_list',))
+    context = context or RecordContext(record, banned_index, image_analyzer)
+    row, decided = cascade_row(record, cascade, bedrock, context, match)
+    if decided:
+        return row
+    return llm_row(row, classifier.classify_drug(bedrock, record.get('pname', ''), context.drug_info()))
+
+
+def classify_records(records, classifier, bedrock, banned_index, matches, image_analyzer=None,
+                     batch_token_budget=80000, cascade=None, contexts=None):
+    """
+    Classify a group of records, sharing batched Bedrock calls.
+
+    Records decided by a cascade tier are answered directly; the others go
+    through DrugBanClassifier.classify_drugs together.
+
+    Parameters:
+    - contexts: list of RecordContext aligned with `records`, to read their
+      salts afterwards (optional)
+
+    Returns:
+    - list of dict, output rows aligned with `records`
+    """
+    cascade = cascade or DecisionCascade(banned_index, tiers=('banned_list',))
+    contexts = contexts or [RecordContext(record, banned_index, image_analyzer) for record in records]
+    rows, llm_indices, products = [], [], []
+    for record, match, context in zip(records, matches, contexts):
+        row, decided = cascade_row(record, cascade, bedrock, context, match)
+        rows.append(row)
+        if not decided:
+            llm_indices.append(len(rows) - 1)
+            products.append((record.get('pname', ''), context.drug_info()))
+    if products:
+        results = classifier.classify_drugs(bedrock, products, batch_token_budget=batch_token_budget,
+                                            max_batch_size=len(products))
+        for i, result in zip(llm_indices, results):
+            rows[i] = llm_row(rows[i], result)
+    return rows
+
+
+def iter_pending(input_path, done, chunk_size, stats=None):
+    """
+    Group records not yet in `done` into chunks for bulk matching.
+
+    Parameters:
+    - stats: dict, its "skipped" count is raised for every record of the
+      input already in `done` (optional)
+
+    Yields:
+    - list of dict, up to chunk_size pending records
+    """
+    chunk = []
+    for record in iter_records(input_path):
+        item_id = str(record['pc_item_id'])
+        if item_id in done:
+            if stats is not None:
+                stats["skipped"] += 1
+            continue
+        # Guard against duplicate ids within the same run
+        done.add(item_id)
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_batch(input_path, output_path, bedrock, banned_path='banned_drug.json', workers=4, match_chunk_size=1024,
+              cache=None, corpus=None, tracer=None, image_analyzer=None, llm_batch_size=1,
+              batch_token_budget=80000, tiers=TIERS, search_cache=None, clusters=None, ledger=None,
+              verdict_only=False, results_store=None):
+    """
+    Classify every pending record of a JSONL catalog.
+
+    Pending records are fuzzy matched against the banned list a chunk at a
+    time, and at most 2 * workers records are queued for classification, so
+    memory stays bounded no matter how large the catalog is.
+
+    Parameters:
+    - cache: ClassificationCache, shared across runs to skip repeat drugs (optional)
+    - corpus: SourceCorpus, offline copy of the reliable sources (optional)
+    - tracer: Tracer, records per-stage spans for every record (optional)
+    - image_analyzer: ImageAnalyzer, shared across records so reused images
+      are analysed once (optional)
+    - llm_batch_size: int, records sent to Bedrock in one batched call; 1
+      classifies every record on its own
+    - batch_token_budget: int, approximate prompt tokens per batched call
+    - tiers: sequence of cascade tiers tried before the full pipeline
+    - search_cache: SearchCache, URLs found per normalized search query,
+      shared across runs (optional)
+    - clusters: ListingClusters, groups near-duplicate listings so only the
+      first listing of a cluster is classified and the others reuse its
+      verdict (optional)
+    - ledger: DependencyLedger, records what each verdict depends on so a
+      banned list change only re-classifies the affected products (optional)
+    - verdict_only: bool, stream single-product LLM calls and stop them once
+      the verdict tags are closed; rows then carry no justification
+    - results_store: ResultsStore, every row written is also added to it,
+      under the run id returned in the stats (optional)
+
+    Returns:
+    - dict, counts of processed, skipped and failed records, cache counters
+      and per-stage latency percentiles
+    """
+    tracer = tracer or Tracer()
+    banned_index = BannedDrugIndex.from_file(banned_path)
+    classifier = pred.DrugBanClassifier(cache=cache, corpus=corpus, tracer=tracer, search_cache=search_cache,
+                                        verdict_only=verdict_only)
+    cascade = DecisionCascade(banned_index, tiers=tiers, tracer=tracer, verdict_only=verdict_only)
+    done = load_checkpoint(output_path)
+    writer = ResultWriter(output_path)
+    stats = {"processed": 0, "skipped": 0, "failed": 0}
+    if results_store is not None:
+        stats["run_id"] = new_run_id()
+
+    def track(record, row, salts, match=None):
+        if ledger is not None:
+            ledger.record(record, row, salts, match, cascade.fdc_matcher)
+
+    def work(record, match):
+        timings = {}
+        with tracer.trace(record['pc_item_id'], timings=timings):
+            try:
+                with tracer.span('record') as span:
+                    context = RecordContext(record, banned_index, image_analyzer)
+                    row = classify_record(record, classifier, bedrock, banned_index, match, image_analyzer, cascade,
+                                          context)
+                    span.set(decided_by=row.get('source'))
+                row["timings_ms"] = {stage: round(ms, 1) for stage, ms in timings.items()}
+                track(record, row, context.known_salts(), match)
+                return row
+            except Exception as e:
+                return {"pc_item_id": record['pc_item_id'], "pname": record.get('pname', ''), "error": str(e)}
+
+    def work_group(records, matches):
+        timings = {}
+        with tracer.trace(records[0]['pc_item_id'], timings=timings):
+            try:
+                contexts = [RecordContext(record, banned_index, image_analyzer) for record in records]
+                with tracer.span('record_group', records=len(records)):
+                    rows = classify_records(records, classifier, bedrock, banned_index, matches, image_analyzer,
+                                            batch_token_budget=batch_token_budget, cascade=cascade,
+                                            contexts=contexts)
+                # Stages are timed for the group as a whole; every record of it waited for all of them
+                group_timings = {stage: round(ms, 1) for stage, ms in timings.items()}
+                group_timings["record"] = group_timings["record_group"]
+                for record, row, match, context in zip(records, rows, matches, contexts):
+                    row["timings_ms"] = dict(group_timings)
+                    track(record, row, context.known_salts(), match)
+                return rows
+            except Exception as e:
+                return [{"pc_item_id": record['pc_item_id'], "pname": record.get('pname', ''), "error": str(e)}
+                        for record in records]
+
+    # Clustered listings of this run: pc_item_id -> (cluster id, similarity to its representative)
+    cluster_of = {}
+    # Clusters with a listing being classified, and the listings waiting for its verdict
+    leaders = set()
+    waiting = defaultdict(list)
+
+    def emit(row, record=None):
+        """Write a row; rows copied from a cluster's verdict are also entered in the ledger."""
+        if record is not None:
+            track(record, row, parse_salts(record.get('salt_composition')))
+        writer.write(row)
+        if results_store is not None:
+            results_store.add(row, stats["run_id"])
+        stats["failed" if row.get('error') else "processed"] += 1
+
+    def member_decided(record, match):
+        """True when the listing's own name or salts decide it, so no cluster verdict may be copied to it."""
+        tiers = [tier for tier in MEMBER_TIERS if tier in cascade.tiers]
+        return bool(tiers) and cascade.decide(bedrock, record.get('pname', ''), record.get('salt_composition'),
+                                              match, tiers=tiers) is not None
+
+    def plan(chunk, matches):
+        """Answer listings whose cluster has a verdict, hold back those whose cluster is being classified."""
+        if clusters is None:
+            return list(zip(chunk, matches))
+        pending = []
+        with tracer.span('cluster', records=len(chunk)) as span:
+            for record, match in zip(chunk, matches):
+                # A banned list hit decides a listing on its own
+                cluster_id = None
+                if match[0] is None:
+                    cluster_id, _, similarity = clusters.assign(record)
+                if cluster_id is None or member_decided(record, match):
+                    pending.append((record, match))
+                    continue
+                row = clusters.member_row(record, cluster_id, similarity)
+                if row is not None:
+                    emit(row, record)
+                    continue
+                cluster_of[str(record['pc_item_id'])] = (cluster_id, similarity)
+                if cluster_id in leaders:
+                    waiting[cluster_id].append(record)
+                else:
+                    leaders.add(cluster_id)
+                    pending.append((record, match))
+            span.set(clustered=len(chunk) - len(pending))
+        return pending
+
+    def collect(finished, executor):
+        """Write finished rows; return futures for listings that have to be classified after all."""
+        retries = set()
+        for future in finished:
+            result = future.result()
+            for row in (result if isinstance(result, list) else [result]):
+                clustered = cluster_of.pop(str(row['pc_item_id']), None)
+                if clustered is not None:
+                    cluster_id = clustered[0]
+                    row["cluster_id"] = cluster_id
+                    if not row.get('error'):
+                        clusters.set_verdict(cluster_id, row)
+                        for record in waiting.pop(cluster_id, []):
+                            similarity = cluster_of.pop(str(record['pc_item_id']))[1]
+                            emit(clusters.member_row(record, cluster_id, similarity), record)
+                    elif waiting.get(cluster_id):
+                        # The next listing of the cluster takes over
+                        record = waiting[cluster_id].pop(0)
+                        retries.add(executor.submit(work, record, (None, 0)))
+                    else:
+                        leaders.discard(cluster_id)
+                emit(row)
+        return retries
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = set()
+            for chunk in iter_pending(input_path, done, match_chunk_size, stats):
+                with tracer.span('banned_match', records=len(chunk)):
+                    matches = banned_index.match_many([record.get('pname', '') for record in chunk])
+                pending = plan(chunk, matches)
+                if llm_batch_size > 1:
+                    units = [
+                        (work_group, [record for record, _ in pending[i:i + llm_batch_size]],
+                         [match for _, match in pending[i:i + llm_batch_size]])
+                        for i in range(0, len(pending), llm_batch_size)
+                    ]
+                else:
+                    units = [(work, record, match) for record, match in pending]
+                for fn, records, unit_matches in units:
+                    in_flight.add(executor.submit(fn, records, unit_matches))
+                    if len(in_flight) >= workers * 2:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        in_flight |= collect(finished, executor)
+            while in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                in_flight |= collect(finished, executor)
+    finally:
+        writer.close()
+        if results_store is not None:
+            results_store.flush()
+    if cache is not None:
+        stats["cache"] = cache.stats()
+    if search_cache is not None:
+        stats["search_cache"] = search_cache.stats()
+    if clusters is not None:
+        stats["clusters"] = clusters.stats()
+    stats["latency"] = tracer.summary()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch classify a JSONL product catalog.")
+    parser.add_argument("input", help="input JSONL with pc_item_id, pname, description, isq")
+    parser.add_argument("output", help="output JSONL; also used as the resume checkpoint")
+    parser.add_argument("--workers", type=int, default=4, help="number of records classified concurrently")
+    parser.add_argument("--banned", default="banned_drug.json", help="banned drug list")
+    parser.add_argument("--credentials", default="access_key.json", help="AWS credentials JSON")
+    parser.add_argument("--region", default="us-east-1", help="AWS region for Bedrock")
+    parser.add_argument("--cache", default="classification_cache.db", help="classification cache database")
+    parser.add_argument("--search-cache", default="search_cache.db", help="cache of search result URLs")
+    parser.add_argument("--no-cache", action="store_true", help="always classify and search from scratch")
+    parser.add_argument("--corpus", default="corpus", help="offline corpus of reliable sources")
+    parser.add_argument("--clusters", default="listing_clusters.npz",
+                        help="near-duplicate listing clusters and their verdicts, kept across runs")
+    parser.add_argument("--cluster-threshold", type=float, default=0.8,
+                        help="similarity a listing needs to join a cluster (a new index only)")
+    parser.add_argument("--no-clusters", action="store_true", help="classify every listing on its own")
+    parser.add_argument("--ledger", default="ledger.db",
+                        help="what each verdict depends on, for re-classifying after a banned list change")
+    parser.add_argument("--no-ledger", action="store_true", help="do not record verdict dependencies")
+    parser.add_argument("--results-db", default="results.db",
+                        help="results store every row is also added to (see results_store.py)")
+    parser.add_argument("--no-results-db", action="store_true", help="only write the output JSONL")
+    parser.add_argument("--image-cache", default="image_cache", help="cache of image extraction results")
+    parser.add_argument("--image-concurrency", type=int, default=4, help="Bedrock vision calls in flight")
+    parser.add_argument("--llm-batch-size", type=int, default=1,
+                        help="records classified together in one Bedrock call")
+    parser.add_argument("--batch-token-budget", type=int, default=80000,
+                        help="approximate prompt tokens per batched Bedrock call")
+    parser.add_argument("--tiers", default=",".join(TIERS),
+                        help="comma-separated cascade tiers tried before web search and Sonnet")
+    parser.add_argument("--verdict-only", action="store_true",
+                        help="stop each LLM answer once its verdict is in, without the justification")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="LLM calls in flight across all workers")
+    parser.add_argument("--llm-record", help="append every Bedrock response to this JSONL file")
+    parser.add_argument("--llm-stub", nargs="?", const="",
+                        help="replay responses recorded with --llm-record instead of calling Bedrock "
+                             "(canned answers without a file)")
+    parser.add_argument("--llm-stub-latency-ms", type=float, default=0, help="simulated latency of stubbed calls")
+    parser.add_argument("--trace", help="write per-stage spans to this JSONL file")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="interface the metrics are served on (0.0.0.0 for every interface)")
+    args = parser.parse_args()
+
+    tracer = Tracer(JsonlTraceExporter(args.trace) if args.trace else None)
+    tracer.add_collector(get_default_limiter().prometheus_text)
+    if args.metrics_port:
+        start_metrics_server(tracer, args.metrics_port, args.metrics_host)
+    bedrock = create_llm_client(args.credentials, args.region, max_concurrency=args.llm_concurrency,
+                                stub=args.llm_stub, stub_latency_ms=args.llm_stub_latency_ms,
+                                record_path=args.llm_record)
+    cache = None if args.no_cache else ClassificationCache(args.cache)
+    search_cache = None if args.no_cache else SearchCache(args.search_cache)
+    ledger = None if args.no_ledger else DependencyLedger(args.ledger, banned_version=file_version(args.banned))
+    results_store = None if args.no_results_db else ResultsStore(args.results_db)
+    clusters = None
+    if not args.no_clusters:
+        clusters = ListingClusters.load(args.clusters, threshold=args.cluster_threshold,
+                                        vocabulary=molecule_vocabulary(args.banned))
+    try:
+        stats = run_batch(args.input, args.output, bedrock, banned_path=args.banned, workers=args.workers,
+                          cache=cache, corpus=SourceCorpus(args.corpus), tracer=tracer,
+                          image_analyzer=ImageAnalyzer(bedrock, args.image_cache, args.image_concurrency,
+                                                       tracer=tracer),
+                          llm_batch_size=args.llm_batch_size, batch_token_budget=args.batch_token_budget,
+                          tiers=[tier.strip() for tier in args.tiers.split(',') if tier.strip()],
+                          search_cache=search_cache, clusters=clusters, ledger=ledger,
+                          verdict_only=args.verdict_only, results_store=results_store)
+    finally:
+        if clusters is not None:
+            clusters.save(args.clusters)
+        if results_store is not None:
+            results_store.close()
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
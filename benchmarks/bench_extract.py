@@ -0,0 +1,90 @@
+"""
+Benchmark the HTML-to-text extractor backends.
+
+Runs every installed backend over the saved pages in fixtures/pages,
+reports throughput and checks that each backend's output matches the
+reference BeautifulSoup path.
+
+Usage:
+    python benchmarks/bench_extract.py --iterations 20
+    python benchmarks/bench_extract.py --json
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+
+from rapidfuzz import fuzz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from extractors import EXTRACTORS  # noqa: E402
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'pages')
+
+
+def load_pages(fixtures_dir=FIXTURES_DIR):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, '*.html'))):
+        with open(path, 'rb') as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+
+def run(pages, iterations):
+    """
+    Time every backend and compare its output with the bs4 reference.
+
+    Returns:
+    - dict, backend -> metrics
+    """
+    reference = {name: EXTRACTORS['bs4'](html) for name, html in pages.items()}
+    total_bytes = sum(len(html) for html in pages.values())
+    results = {}
+    for backend, extract in EXTRACTORS.items():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            outputs = {name: extract(html) for name, html in pages.items()}
+        elapsed = time.perf_counter() - start
+        per_page = {
+            name: {
+                "identical": outputs[name] == reference[name],
+                "similarity": round(fuzz.ratio(outputs[name], reference[name]), 2),
+                "chars": len(outputs[name]),
+            }
+            for name in pages
+        }
+        results[backend] = {
+            "pages_per_sec": round(len(pages) * iterations / elapsed, 1),
+            "mb_per_sec": round(total_bytes * iterations / elapsed / 1e6, 2),
+            "ms_per_page": round(elapsed * 1000 / (len(pages) * iterations), 3),
+            "min_similarity": min(page["similarity"] for page in per_page.values()),
+            "pages": per_page,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML extractor backends.")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    pages = load_pages(args.fixtures)
+    results = run(pages, args.iterations)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{len(pages)} pages, {args.iterations} iterations")
+    print(f"{'backend':<12}{'ms/page':>10}{'pages/s':>10}{'MB/s':>8}{'min sim':>10}")
+    for backend, metrics in results.items():
+        print(f"{backend:<12}{metrics['ms_per_page']:>10}{metrics['pages_per_sec']:>10}"
+              f"{metrics['mb_per_sec']:>8}{metrics['min_similarity']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Benchmark image preprocessing before Bedrock vision calls.
+
+Builds seeded synthetic product photos (or reads a directory of real ones),
+runs them through preprocess_image and reports the base64 payload sent to
+Bedrock before and after, the preprocessing time and the resulting
+end-to-end request latency. Upload time is modelled from the payload size and
+an assumed upload bandwidth; the Bedrock inference time is a fixed term so the
+numbers can be reproduced offline.
+
+Usage:
+    python benchmarks/bench_images.py
+    python benchmarks/bench_images.py --images ./photos --upload-mbps 5 --json
+"""
+import os
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from image_preprocess import preprocess_image, DEFAULT_MAX_EDGE  # noqa: E402
+
+
+# (name, width, height, format, EXIF orientation)
+SYNTHETIC_IMAGES = [
+    ("phone_photo_12mp.jpg", 4000, 3000, "JPEG", 1),
+    ("phone_photo_rotated.jpg", 4032, 3024, "JPEG", 6),
+    ("packshot_padded.png", 2400, 2400, "PNG", 1),
+    ("seller_thumbnail.jpg", 800, 800, "JPEG", 1),
+]
+
+
+def synthetic_image(width, height, image_format, orientation, seed=0):
+    """Draw a label-like photo: textured background, a white box with text lines."""
+    rng = random.Random(seed)
+    image = Image.effect_noise((width // 8, height // 8), 40).resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    if image_format == 'PNG':
+        # Packshot on a flat white canvas, which the border trim removes
+        image.paste((255, 255, 255), (0, 0, width, height))
+        draw.rectangle((width // 5, height // 5, width * 4 // 5, height * 4 // 5), fill=(30, 90, 160))
+    left, top = width // 4, height // 3
+    draw.rectangle((left, top, width * 3 // 4, height * 2 // 3), fill=(250, 250, 245))
+    for line in range(8):
+        y = top + 20 + line * (height // 30)
+        draw.rectangle((left + 20, y, left + 20 + rng.randint(width // 8, width // 3), y + height // 80),
+                       fill=(rng.randint(0, 80),) * 3)
+    buffer = BytesIO()
+    extra = {}
+    if orientation != 1:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        extra['exif'] = exif.tobytes()
+    if image_format == 'JPEG':
+        extra['quality'] = 95
+    image.save(buffer, format=image_format, **extra)
+    return buffer.getvalue()
+
+
+def load_images(images_dir=None, seed=0):
+    if images_dir:
+        images = {}
+        for path in sorted(glob.glob(os.path.join(images_dir, '*'))):
+            if os.path.splitext(path)[1].lower() in ('.jpg', '.jpeg', '.png', '.webp', '.gif'):
+                with open(path, 'rb') as f:
+                    images[os.path.basename(path)] = f.read()
+        return images
+    return {
+        name: synthetic_image(width, height, image_format, orientation, seed=seed + i)
+        for i, (name, width, height, image_format, orientation) in enumerate(SYNTHETIC_IMAGES)
+    }
+
+
+def base64_size(n_bytes):
+    return 4 * ((n_bytes + 2) // 3)
+
+
+def run(images, iterations, upload_mbps, inference_ms, max_edge, quality):
+    """
+    Preprocess every image and model the request latency before and after.
+
+    Returns:
+    - dict, image name -> metrics, plus a "total" entry
+    """
+    upload_bytes_per_ms = upload_mbps * 1e6 / 8 / 1000
+    results = {}
+    for name, data in images.items():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            processed, _ = preprocess_image(data, os.path.splitext(name)[1].lstrip('.'),
+                                            max_edge=max_edge, quality=quality)
+        preprocess_ms = (time.perf_counter() - start) * 1000 / iterations
+        with Image.open(BytesIO(data)) as before, Image.open(BytesIO(processed)) as after:
+            size_before, size_after = before.size, after.size
+        payload_before, payload_after = base64_size(len(data)), base64_size(len(processed))
+        latency_before = payload_before / upload_bytes_per_ms + inference_ms
+        latency_after = preprocess_ms + payload_after / upload_bytes_per_ms + inference_ms
+        results[name] = {
+            "size_before": list(size_before),
+            "size_after": list(size_after),
+            "payload_bytes_before": payload_before,
+            "payload_bytes_after": payload_after,
+            "payload_reduction": round(1 - payload_after / payload_before, 3),
+            "preprocess_ms": round(preprocess_ms, 2),
+            "latency_ms_before": round(latency_before, 1),
+            "latency_ms_after": round(latency_after, 1),
+            "passthrough": processed is data,
+        }
+    metrics = list(results.values())
+    results["total"] = {
+        "payload_bytes_before": sum(m["payload_bytes_before"] for m in metrics),
+        "payload_bytes_after": sum(m["payload_bytes_after"] for m in metrics),
+        "latency_ms_before": round(sum(m["latency_ms_before"] for m in metrics), 1),
+        "latency_ms_after": round(sum(m["latency_ms_after"] for m in metrics), 1),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing for Bedrock vision calls.")
+    parser.add_argument("--images", help="directory of real images (default: seeded synthetic images)")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--upload-mbps", type=float, default=10.0, help="assumed upload bandwidth")
+    parser.add_argument("--inference-ms", type=float, default=4000.0, help="assumed Bedrock inference time")
+    parser.add_argument("--max-edge", type=int, default=DEFAULT_MAX_EDGE)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    images = load_images(args.images, seed=args.seed)
+    results = run(images, args.iterations, args.upload_mbps, args.inference_ms, args.max_edge, args.quality)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{len(images)} images, upload {args.upload_mbps} Mbit/s, inference {args.inference_ms:.0f} ms")
+    print(f"{'image':<26}{'KB before':>11}{'KB after':>10}{'prep ms':>9}{'ms before':>11}{'ms after':>10}")
+    for name, m in results.items():
+        if name == "total":
+            continue
+        print(f"{name:<26}{m['payload_bytes_before'] / 1024:>11.0f}{m['payload_bytes_after'] / 1024:>10.0f}"
+              f"{m['preprocess_ms']:>9}{m['latency_ms_before']:>11}{m['latency_ms_after']:>10}")
+    total = results["total"]
+    print(f"{'total':<26}{total['payload_bytes_before'] / 1024:>11.0f}{total['payload_bytes_after'] / 1024:>10.0f}"
+          f"{'':>9}{total['latency_ms_before']:>11}{total['latency_ms_after']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Profile cold-start import time of the pipeline's entry points.
+
+Imports each module in a fresh interpreter with `python -X importtime`,
+several times, and reports the median total import time together with the
+slowest third-party packages it pulled in. Heavy packages (boto3, bs4,
+streamlit, PIL, ...) should only show up where a module really needs them.
+
+Usage:
+    python benchmarks/bench_imports.py --runs 5
+    python benchmarks/bench_imports.py --modules prediction llm_client --top 10
+    python benchmarks/bench_imports.py --json
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+DEFAULT_MODULES = ['app', 'prediction', 'batch', 'service', 'cascade', 'image_analysis', 'llm_client',
+                   'image_index']
+
+# "import time: self [us] | cumulative | imported package"
+_LINE_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def _importtime(code):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPO_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    return result.stderr.splitlines()
+
+
+def startup_modules():
+    """Names the interpreter imports on its own before running any code."""
+    return {match.group(4) for match in map(_LINE_RE.match, _importtime('pass')) if match}
+
+
+def import_profile(module, startup=frozenset()):
+    """
+    Import a module in a fresh interpreter.
+
+    Parameters:
+    - module: str, module name
+    - startup: set of str, modules imported by interpreter startup, left out
+
+    Returns:
+    - dict, total_ms and the cumulative ms of every top-level package it imported
+    """
+    packages = {}
+    total = 0.0
+    for line in _importtime(f'import {module}'):
+        match = _LINE_RE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if name == module and indent == 1:
+            total = cumulative / 1000
+        # Submodules are already counted in their package's cumulative time
+        if name != module and '.' not in name and name not in startup:
+            packages[name] = max(packages.get(name, 0.0), cumulative / 1000)
+    return {"total_ms": total, "packages": packages}
+
+
+def run(modules, runs):
+    """
+    Profile every module runs times.
+
+    Returns:
+    - dict, module -> median total_ms and the median ms of its heaviest packages
+    """
+    results = {}
+    startup = startup_modules()
+    for module in modules:
+        profiles = [import_profile(module, startup) for _ in range(runs)]
+        packages = {}
+        for profile in profiles:
+            for name, ms in profile["packages"].items():
+                packages.setdefault(name, []).append(ms)
+        results[module] = {
+            "total_ms": round(statistics.median(p["total_ms"] for p in profiles), 1),
+            "packages": {name: round(statistics.median(values), 1) for name, values in
+                         sorted(packages.items(), key=lambda item: -statistics.median(item[1]))},
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile import time of the pipeline modules.")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=5, help="heaviest packages listed per module")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = run(args.modules, args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"median of {args.runs} runs")
+    print(f"{'module':<16}{'ms':>8}  heaviest imports")
+    for module, metrics in results.items():
+        heaviest = ', '.join(f"{name} {ms:g}" for name, ms in list(metrics["packages"].items())[:args.top])
+        print(f"{module:<16}{metrics['total_ms']:>8}  {heaviest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+Benchmark every CPU-bound stage of the classification path offline.
+
+Replays the recorded search result pages, source pages and Bedrock responses
+in fixtures/ against a seeded synthetic catalog and times each stage per
+product: search result parsing, page extraction (fetch_webpage_content),
+banned list matching, the decision cascade, prompt assembly, response
+parsing (whole and streamed) and image encoding. Network and Bedrock are
+never called. Each stage is then run again under tracemalloc to record its
+peak memory.
+
+Results can be written as JSON and compared with an earlier run; the script
+exits with status 1 when a stage's median got slower than the threshold.
+
+Usage:
+    python benchmarks/bench_pipeline.py --catalog-size 500
+    python benchmarks/bench_pipeline.py --output baseline.json
+    python benchmarks/bench_pipeline.py --compare baseline.json --threshold 0.2
+"""
+import os
+import sys
+import glob
+import json
+import time
+import random
+import platform
+import argparse
+import resource
+import subprocess
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import prediction as pred  # noqa: E402
+from banned_index import BannedDrugIndex  # noqa: E402
+from bench_images import load_images  # noqa: E402
+from cascade import DecisionCascade, salts_from_image_details  # noqa: E402
+from image_analysis import image_block  # noqa: E402
+from image_preprocess import preprocess_image  # noqa: E402
+from llm_client import LLMClient  # noqa: E402
+from rate_limit import HostLimiter  # noqa: E402
+from tracing import summarize  # noqa: E402
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+FORMS = ["Tablet", "Tablets", "Capsule", "Syrup", "Injection", "Oral Suspension", "Cream", "Tab", "SR Tablet"]
+PACKS = ["", "10x10", "1 x 15", "30 Tablets", "100ml", "Strip of 10", "15's"]
+MARKETING = ["", "", "Original", "Buy Online", "Genuine", "Best Price", "Imported"]
+BATCH_SIZE = 8
+
+
+def read_fixture(*parts, mode='r'):
+    with open(os.path.join(FIXTURES_DIR, *parts), mode) as f:
+        return f.read()
+
+
+def load_fixtures():
+    """Load the recorded search pages, source pages and Bedrock responses."""
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, 'pages', '*.html'))):
+        with open(path, 'rb') as f:
+            pages[os.path.basename(path)] = f.read()
+    return {
+        "bing": read_fixture('search', 'bing.html'),
+        "duckduckgo": read_fixture('search', 'duckduckgo.html'),
+        "pages": pages,
+        "classification": read_fixture('bedrock', 'classification.txt'),
+        "classification_batch": read_fixture('bedrock', 'classification_batch.txt'),
+        "image_response": read_fixture('bedrock', 'image_response.json'),
+    }
+
+
+def synthetic_catalog(size, banned_entries, seed=0):
+    """
+    Build product records resembling marketplace listings.
+
+    About one in ten names a banned list entry; the rest combine one or two
+    known molecules with strengths, dosage forms, pack sizes and marketing words.
+    """
+    rng = random.Random(seed)
+    with open(os.path.join(ROOT, 'known_molecules.json'), 'r', encoding='utf-8') as f:
+        known = json.load(f)
+    molecules = [name.title() for group in known.values() for name in group]
+    records = []
+    for i in range(size):
+        if rng.random() < 0.1:
+            pname = rng.choice(banned_entries)["drug_name"]
+            salts = pname
+        else:
+            chosen = rng.sample(molecules, rng.choice([1, 1, 1, 2]))
+            salts = " + ".join(f"{name} ({rng.choice([5, 10, 20, 250, 500, 650])}mg)" for name in chosen)
+            pname = " ".join(part for part in (
+                rng.choice(MARKETING), " + ".join(chosen), f"{rng.choice([5, 10, 20, 250, 500, 650])}mg",
+                rng.choice(FORMS), rng.choice(PACKS)) if part)
+        records.append({
+            "pc_item_id": str(i + 1),
+            "pname": pname,
+            "description": f"{pname} is used for the treatment of various conditions.",
+            "isq": {"Composition": salts},
+            "salt_composition": salts,
+        })
+    return records
+
+
+class FakeResponse:
+    """Stands in for requests.Response for the recorded HTML."""
+
+    def __init__(self, body, content_type='text/html; charset=utf-8'):
+        self.content = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.text = self.content.decode('utf-8', errors='replace')
+        self.headers = {'Content-Type': content_type}
+        self.status_code = 200
+        self.ok = True
+
+    def iter_content(self, chunk_size=16 * 1024):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    def __init__(self, pages_by_url):
+        self.pages_by_url = pages_by_url
+
+    def get(self, url, **kwargs):
+        return FakeResponse(self.pages_by_url[url])
+
+
+class ReplayLLMClient(LLMClient):
+    """Answers every call with a recorded response, without latency."""
+
+    def __init__(self, text):
+        super().__init__(max_concurrency=1)
+        self.text = text
+
+    def _complete(self, model_id, messages, max_tokens, temperature):
+        return {"content": [{"type": "text", "text": self.text}], "usage": {"input_tokens": 0, "output_tokens": 0}}
+
+    def _stream(self, model_id, messages, max_tokens, temperature, usage):
+        for i in range(0, len(self.text), 16):
+            yield self.text[i:i + 16]
+
+
+def build_stages(catalog, fixtures, images, banned_index):
+    """
+    Prepare the stages to time.
+
+    Returns:
+    - list of (stage name, list of zero-argument callables, one per measured call)
+    """
+    limiter = HostLimiter(rate=1e9, burst=10 ** 9, host_limits={})
+    classifier = pred.DrugBanClassifier(limiter=limiter)
+    cascade = DecisionCascade(banned_index, tiers=('banned_list', 'fdc_components', 'allowlist'))
+    user_agents = classifier.user_agents
+
+    page_names = list(fixtures["pages"])
+    pages_by_url = {f"https://fixtures.local/{name}": html for name, html in fixtures["pages"].items()}
+    page_urls = list(pages_by_url)
+    session = FakeSession(pages_by_url)
+    source_contents = [pred.DrugBanClassifier.fetch_webpage_content(url, user_agents, session=session)
+                       for url in page_urls]
+
+    def search(engine, pname):
+        html = fixtures[engine]
+        with mock.patch.object(pred.requests, 'get', lambda *args, **kwargs: FakeResponse(html)):
+            return getattr(classifier, f'search_{engine}')(pname)
+
+    def drug_info(record):
+        return {"prd_name": record["pname"], "prd_description": record["description"], "prd_isq": record["isq"],
+                "prd_img_details": [], "banned_drug_list": banned_index.entries}
+
+    single_client = ReplayLLMClient(fixtures["classification"])
+    batches = [catalog[i:i + BATCH_SIZE] for i in range(0, len(catalog), BATCH_SIZE)]
+    batch_ids = [str(i + 1) for i in range(BATCH_SIZE)]
+
+    def batch_prompt(records):
+        items = [{"item_id": str(i + 1), "drug_info": record["pname"], "additional_info": drug_info(record),
+                  "source_contents": source_contents} for i, record in enumerate(records)]
+        return classifier.build_batch_prompt(items)
+
+    def encode(data, name):
+        processed, extension = preprocess_image(data, os.path.splitext(name)[1].lstrip('.'))
+        return image_block(processed, extension)
+
+    return [
+        ("search_parse_bing", [lambda r=r: search('bing', r["pname"]) for r in catalog]),
+        ("search_parse_duckduckgo", [lambda r=r: search('duckduckgo', r["pname"]) for r in catalog]),
+        ("search_query_normalize", [lambda r=r: classifier.search_query(r["pname"]) for r in catalog]),
+        ("fetch_extract", [
+            lambda i=i: pred.DrugBanClassifier.fetch_webpage_content(page_urls[i % len(page_names)], user_agents,
+                                                                     session=session)
+            for i in range(len(catalog))
+        ]),
+        ("banned_match", [lambda r=r: banned_index.match(r["pname"]) for r in catalog]),
+        ("banned_match_many", [lambda: banned_index.match_many([r["pname"] for r in catalog])]),
+        ("cascade", [lambda r=r: cascade.decide(None, r["pname"], salts=r["salt_composition"]) for r in catalog]),
+        ("prompt_assembly", [
+            lambda r=r: classifier.analyze_sources(single_client, r["pname"], source_contents, drug_info(r))
+            for r in catalog
+        ]),
+        ("batch_prompt_assembly", [lambda b=b: batch_prompt(b) for b in batches]),
+        ("parse_response", [lambda: pred.parse_classification_response(fixtures["classification"])
+                            for _ in catalog]),
+        ("parse_stream_verdict", [
+            lambda: pred.stream_verdict(single_client, classifier.model_id, "", stop_at_verdict=False)
+            for _ in catalog
+        ]),
+        ("parse_batch_response", [
+            lambda: pred.parse_classification_response(fixtures["classification_batch"], batch_ids)
+            for _ in batches
+        ]),
+        ("image_encode", [lambda data=data, name=name: encode(data, name) for name, data in images.items()]),
+        ("image_response_parse", [lambda: salts_from_image_details([fixtures["image_response"]]) for _ in catalog]),
+    ]
+
+
+def run(stages, iterations=1, measure_memory=True):
+    """
+    Time every call of every stage, then record each stage's memory peak.
+
+    Returns:
+    - dict, stage -> latency summary (see tracing.summarize) plus total_ms and peak_kb
+    """
+    results = {}
+    for stage, calls in stages:
+        durations = []
+        # Warm up lazily built state (vocabularies, regex caches) outside the timings
+        if calls:
+            calls[0]()
+        for _ in range(iterations):
+            for call in calls:
+                start = time.perf_counter()
+                call()
+                durations.append((time.perf_counter() - start) * 1000)
+        results[stage] = summarize({stage: durations})[stage]
+        results[stage]["total_ms"] = round(sum(durations) / iterations, 3)
+        if measure_memory:
+            # A separate pass, so tracemalloc's overhead stays out of the timings
+            tracemalloc.start()
+            for call in calls:
+                call()
+            results[stage]["peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            tracemalloc.stop()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare median latencies with a baseline run.
+
+    Returns:
+    - list of (stage, baseline p50 ms, current p50 ms, relative change), and
+      the stages slower than threshold
+    """
+    rows, regressions = [], []
+    for stage, metrics in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before or not before["p50_ms"]:
+            continue
+        change = metrics["p50_ms"] / before["p50_ms"] - 1
+        rows.append((stage, before["p50_ms"], metrics["p50_ms"], change))
+        if change > threshold:
+            regressions.append(stage)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the classification path on recorded fixtures.")
+    parser.add_argument("--catalog-size", type=int, default=200, help="synthetic products to run through each stage")
+    parser.add_argument("--iterations", type=int, default=1, help="timed passes over the catalog")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--images", help="directory of product images (default: seeded synthetic images)")
+    parser.add_argument("--stages", help="comma-separated stages to run (default: all)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative p50 slowdown reported as a regression by --compare")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    banned_index = BannedDrugIndex.from_file(os.path.join(ROOT, 'banned_drug.json'))
+    catalog = synthetic_catalog(args.catalog_size, banned_index.entries, seed=args.seed)
+    stages = build_stages(catalog, load_fixtures(), load_images(args.images, seed=args.seed), banned_index)
+    if args.stages:
+        wanted = {stage.strip() for stage in args.stages.split(',')}
+        stages = [(stage, calls) for stage, calls in stages if stage in wanted]
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "catalog_size": args.catalog_size,
+            "iterations": args.iterations,
+            "seed": args.seed,
+        },
+        "stages": run(stages, args.iterations, measure_memory=not args.no_memory),
+    }
+    # ru_maxrss is in kilobytes on Linux
+    results["meta"]["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            rows, regressions = compare(results, json.load(f), args.threshold)
+        results["regressions"] = regressions
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.catalog_size} products, revision {results['meta']['revision']}, "
+              f"max RSS {results['meta']['max_rss_kb'] / 1024:.0f} MB")
+        print(f"{'stage':<26}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'total ms':>11}{'peak KB':>10}")
+        for stage, m in results["stages"].items():
+            print(f"{stage:<26}{m['count']:>7}{m['p50_ms']:>10}{m['p95_ms']:>10}{m['total_ms']:>11}"
+                  f"{m.get('peak_kb', ''):>10}")
+        if args.compare:
+            print(f"\n{'stage':<26}{'base p50':>10}{'p50':>10}{'change':>9}")
+            for stage, before, after, change in rows:
+                flag = "  REGRESSION" if stage in regressions else ""
+                print(f"{stage:<26}{before:>10}{after:>10}{change:>+9.1%}{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark results store queries over a large synthetic history.
+
+Fills a fresh results database with seeded random rows spread over the last
+90 days (the mix of verdicts, confidence levels and deciding tiers of a
+typical catalog run), then times the queries the CLI offers: counts, the
+first page of a filtered listing, one product's latest result, a per-verdict
+summary and a streamed export. Peak memory of the export is reported to
+show rows are not all loaded at once.
+
+Usage:
+    python benchmarks/bench_results_store.py --rows 1000000
+    python benchmarks/bench_results_store.py --db /tmp/results_bench.db --reuse
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from results_store import ResultsStore  # noqa: E402
+
+
+DAY = 86400
+
+VERDICTS = [
+    (("Not Banned", "PRESCRIPTION-BASED DRUG (Not Banned)"), 0.55),
+    (("Not Banned", "OPEN FOR SALE (Not Banned)"), 0.25),
+    (("Not Banned", "CONTROLLED DRUG (Not Banned)"), 0.1),
+    (("Banned", "BANNED"), 0.1),
+]
+CONFIDENCE = [("HIGH", 0.6), ("MEDIUM", 0.25), ("LOW", 0.15)]
+TIERS = [("llm", 0.3), ("allowlist", 0.3), ("cluster", 0.25), ("fdc_components", 0.1), ("banned_list", 0.05)]
+
+
+def pick(rng, weighted):
+    return rng.choices([value for value, _ in weighted], weights=[weight for _, weight in weighted])[0]
+
+
+def synthetic_rows(count, seed=0, now=None):
+    rng = random.Random(seed)
+    now = time.time() if now is None else now
+    for i in range(count):
+        classification, detailed = pick(rng, VERDICTS)
+        yield {
+            "pc_item_id": str(rng.randint(1, count // 3 + 1)),
+            "pname": f"Product {i % 5000} Tablet {rng.choice([5, 10, 20, 40])}mg",
+            "classification": classification,
+            "detailed_classification": detailed,
+            "confidence_level": pick(rng, CONFIDENCE),
+            "source": pick(rng, TIERS),
+            "justification": "Synthetic benchmark row",
+            "reason": "Synthetic benchmark row",
+            "classified_at": now - rng.uniform(0, 90 * DAY),
+            "timings_ms": {"record": round(rng.uniform(5, 30000), 1)},
+        }
+
+
+def fill(store, rows, batch_size=10000):
+    batch, added = [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            added += store.add_many(batch, run_id="bench")
+            batch = []
+    return added + store.add_many(batch, run_id="bench")
+
+
+def timed(fn, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(durations), 2), result
+
+
+def run(store, runs, now):
+    week = now - 7 * DAY
+    product = next(store.query(limit=1))["pc_item_id"]
+    queries = {
+        "count_banned_low_week": lambda: store.count(classification="banned", confidence_level="low", since=week),
+        "count_banned_all": lambda: store.count(classification="banned"),
+        "list_banned_low_week_100": lambda: len(list(store.query(classification="banned", confidence_level="low",
+                                                                 since=week, limit=100))),
+        "latest_of_product": lambda: len(list(store.query(pc_item_id=product, latest=True))),
+        "summary_week": lambda: len(store.summary(since=week)),
+        "summary_by_tier_all": lambda: len(store.summary(group_by=("decided_by",))),
+    }
+    results = {}
+    for name, fn in queries.items():
+        ms, value = timed(fn, runs)
+        results[name] = {"ms": ms, "result": value}
+
+    def export():
+        with open(os.devnull, 'w') as out:
+            return store.export(out, 'jsonl', classification="banned", since=week)
+
+    ms, exported = timed(export, runs)
+    # A separate pass, so tracemalloc's overhead stays out of the timing
+    tracemalloc.start()
+    export()
+    results["export_banned_week"] = {"ms": ms, "result": exported,
+                                     "peak_kb": round(tracemalloc.get_traced_memory()[1] / 1024, 1)}
+    tracemalloc.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark results store queries.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per query")
+    parser.add_argument("--db", help="database file (a temporary one otherwise)")
+    parser.add_argument("--reuse", action="store_true", help="query --db as it is instead of filling it")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    tmp = None
+    path = args.db
+    if path is None:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, "results.db")
+    now = time.time()
+    store = ResultsStore(path)
+    try:
+        if not args.reuse:
+            start = time.perf_counter()
+            added = fill(store, synthetic_rows(args.rows, args.seed, now))
+            print(f"inserted {added} rows in {time.perf_counter() - start:.1f}s "
+                  f"({os.path.getsize(path) / 2 ** 20:.0f} MiB)", file=sys.stderr)
+        results = run(store, args.runs, now)
+    finally:
+        store.close()
+        if tmp is not None:
+            tmp.cleanup()
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'query':<28}{'ms':>10}  result")
+    for name, metrics in results.items():
+        extra = f"  peak {metrics['peak_kb']} KiB" if "peak_kb" in metrics else ""
+        print(f"{name:<28}{metrics['ms']:>10}  {metrics['result']}{extra}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Compare search stage latency of sequential and concurrent engine queries.
+
+Simulated engines answer after a seeded random latency: usually fast, now and
+then slow or hanging until their timeout, and sometimes empty (a CAPTCHA page).
+The same queries are answered engine by engine, falling through to the next
+engine when too few URLs came back (how search_for_sources used to work), and
+by SearchOrchestrator, which queries every engine at once and returns as soon
+as enough unique URLs are in. No network is used.
+
+Usage:
+    python benchmarks/bench_search.py --queries 200
+    python benchmarks/bench_search.py --slow-rate 0.2 --empty-rate 0.1 --json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rate_limit import HostLimiter  # noqa: E402
+from searcher import SearchOrchestrator  # noqa: E402
+from tracing import Tracer, summarize  # noqa: E402
+
+
+class SimulatedEngine:
+    def __init__(self, name, median_ms, slow_rate, empty_rate, timeout_scale, seed):
+        self.name = name
+        self.median_ms = median_ms
+        self.slow_rate = slow_rate
+        self.empty_rate = empty_rate
+        self.timeout_scale = timeout_scale
+        self.seed = seed
+
+    def __call__(self, query, num_results=10, timeout=20):
+        rng = random.Random(f"{self.seed}:{self.name}:{query}")
+        if rng.random() < self.slow_rate:
+            # Hangs until the request times out
+            delay = timeout * self.timeout_scale
+        else:
+            delay = rng.lognormvariate(0, 0.5) * self.median_ms / 1000
+        time.sleep(delay)
+        if rng.random() < self.empty_rate:
+            return []
+        # Engines overlap on the most relevant pages
+        return [f"https://site{rng.randint(0, 15)}.example/{query}/{i}" for i in range(num_results)]
+
+
+def sequential_search(engines, query, num_results, timeout):
+    urls = []
+    for engine in engines.values():
+        urls.extend(url for url in engine(query, num_results, timeout=timeout) if url not in urls)
+        if len(urls) >= num_results // 2:
+            break
+    return urls
+
+
+def run(args):
+    engines = {
+        'bing': SimulatedEngine('bing', args.median_ms, args.slow_rate, args.empty_rate, args.timeout_scale, args.seed),
+        'duckduckgo': SimulatedEngine('duckduckgo', args.median_ms * 1.5, args.slow_rate, args.empty_rate,
+                                      args.timeout_scale, args.seed),
+    }
+    deadline = args.deadline_s
+    orchestrator = SearchOrchestrator(engines, deadlines={name: deadline for name in engines},
+                                      limiter=HostLimiter(rate=1e9, burst=10 ** 9, host_limits={}), tracer=Tracer(),
+                                      executor=ThreadPoolExecutor(max_workers=4 * args.concurrency))
+    queries = [f"query{i}" for i in range(args.queries)]
+    results = {}
+    for name, search in (
+        ("sequential", lambda q: sequential_search(engines, q, 10, deadline)),
+        ("concurrent", lambda q: orchestrator.search(q, 10, min_results=5)),
+    ):
+        durations, found = [], []
+
+        def timed(query):
+            start = time.perf_counter()
+            urls = search(query)
+            return (time.perf_counter() - start) * 1000, len(urls)
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for ms, count in pool.map(timed, queries):
+                durations.append(ms)
+                found.append(count)
+        results[name] = summarize({name: durations})[name]
+        results[name]["mean_urls"] = round(sum(found) / len(found), 2)
+        results[name]["under_5_urls"] = sum(1 for count in found if count < 5)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sequential and concurrent search.")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8, help="queries searched at once")
+    parser.add_argument("--median-ms", type=float, default=300, help="median latency of the fastest engine")
+    parser.add_argument("--slow-rate", type=float, default=0.1, help="share of calls that hang until the timeout")
+    parser.add_argument("--empty-rate", type=float, default=0.1, help="share of calls that return no results")
+    parser.add_argument("--deadline-s", type=float, default=2.0, help="per-engine deadline in seconds")
+    parser.add_argument("--timeout-scale", type=float, default=1.0,
+                        help="how long a hanging call takes, as a share of the deadline")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'urls':>8}{'<5 urls':>9}")
+    for name, metrics in results.items():
+        print(f"{name:<12}{metrics['p50_ms']:>10}{metrics['p95_ms']:>10}{metrics['p99_ms']:>10}"
+              f"{metrics['max_ms']:>10}{metrics['mean_urls']:>8}{metrics['under_5_urls']:>9}")
+
+
+if __name__ == "__main__":
+    main()
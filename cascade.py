@@ -0,0 +1,227 @@
+"""
+Tiered decision cascade in front of the full search + Sonnet pipeline.
+
+Cheap signals are tried in order and the first conclusive one decides:
+
+1. banned_list: the product name matches a banned list entry
+2. fdc_components: the product's salts fall under a banned fixed-dose
+   combination (see fdc_matcher)
+3. allowlist: the product is a single molecule from the local list of known
+   OTC / prescription molecules (known_molecules.json)
+4. small_model: a short call to a small model answers with enough confidence
+
+Products no tier decides fall through to DrugBanClassifier (web search,
+scraping and Sonnet). Every decision records the tier and the reason.
+"""
+import re
+import sys
+import json
+
+from fdc_matcher import FdcMatcher, normalize_salt, parse_salts
+from llm_client import as_llm_client, response_text
+from tracing import get_default_tracer
+
+
+TIERS = ('banned_list', 'fdc_components', 'allowlist', 'small_model')
+
+SMALL_MODEL_ID = 'anthropic.claude-3-haiku-20240307-v1:0'
+
+SMALL_MODEL_PROMPT = """You are a pharmaceutical regulatory expert specialized in Indian drug regulations.
+Classify the product below without any external sources. If you are not sure, say LOW confidence.
+
+PRODUCT NAME: {pname}
+SALT COMPOSITION: {salts}
+
+Answer only with:
+<output>
+<classification> Banned or Not Banned </classification>
+<detailed_classification> "BANNED" or "CONTROLLED DRUG (Not Banned)" or "PRESCRIPTION-BASED DRUG (Not Banned)" or "OPEN FOR SALE (Not Banned)"</detailed_classification>
+<confidence_level> LOW, MEDIUM, or HIGH </confidence_level>
+<justification> One sentence </justification>
+<alternative_status> If not banned, specify if it's restricted, prescription-only, or over-the-counter </alternative_status>
+<relevant_regulations> Any specific Indian regulatory acts or notifications, or NA </relevant_regulations>
+</output>"""
+
+
+def salts_from_image_details(image_details):
+    """
+    Collect the "Salt Composition" extracted from product images.
+
+    Parameters:
+    - image_details: list of str, raw Bedrock vision responses
+
+    Returns:
+    - list of str, normalized molecules (empty when no image named any)
+    """
+    for raw in image_details or []:
+        try:
+            text = json.loads(raw)['content'][0]['text']
+            match = re.search(r'\{.*\}', text, re.DOTALL)
+            details = json.loads(match.group(0)) if match else {}
+        except (ValueError, KeyError, IndexError, TypeError):
+            continue
+        salts = parse_salts(details.get('Salt Composition'))
+        if salts:
+            return salts
+    return []
+
+
+def load_allowlist(path='known_molecules.json'):
+    """
+    Load the known molecules list.
+
+    Returns:
+    - dict, normalized molecule -> "OTC" or "Rx"
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    allowlist = {normalize_salt(name): "Rx" for name in data.get('rx', [])}
+    allowlist.update({normalize_salt(name): "OTC" for name in data.get('otc', [])})
+    return allowlist
+
+
+class DecisionCascade:
+    def __init__(self, banned_index, allowlist=None, tiers=TIERS, banned_threshold=60,
+                 small_model_id=SMALL_MODEL_ID, small_model_confidence=('HIGH',), tracer=None, verdict_only=False):
+        """
+        Create the cascade.
+
+        Parameters:
+        - banned_index: BannedDrugIndex over the banned drug list
+        - allowlist: dict, molecule -> "OTC" or "Rx" (optional, loaded from
+          known_molecules.json otherwise)
+        - tiers: sequence of tier names from TIERS, tried in this order
+        - banned_threshold: int, name similarity that counts as a banned list match
+        - small_model_id: str, Bedrock model used by the small_model tier
+        - small_model_confidence: confidence levels accepted from the small model
+        - tracer: Tracer, records one span per tier tried (optional)
+        - verdict_only: bool, stream the small model's answer and stop it once
+          the verdict tags are closed, since the tier never reads the rest
+        """
+        unknown = set(tiers) - set(TIERS)
+        if unknown:
+            raise ValueError(f"Unknown cascade tiers: {', '.join(sorted(unknown))}")
+        self.banned_index = banned_index
+        if allowlist is None:
+            allowlist = load_allowlist() if 'allowlist' in tiers else {}
+        self.allowlist = allowlist
+        self.tiers = tuple(tiers)
+        self.banned_threshold = banned_threshold
+        self.small_model_id = small_model_id
+        self.small_model_confidence = set(small_model_confidence)
+        self.tracer = tracer or get_default_tracer()
+        self.verdict_only = verdict_only
+
+        self.fdc_matcher = FdcMatcher(banned_index.entries)
+
+    def decide(self, bedrock, pname, salts=None, match=None, tiers=None):
+        """
+        Run the cheap tiers for one product.
+
+        Parameters:
+        - bedrock: LLMClient or boto3 bedrock-runtime client, used by the small_model tier
+        - pname: str, product name
+        - salts: str or list of str, salt composition if known, or a callable
+          returning it, called only once a tier needs the salts (so image
+          analysis can be skipped for banned list hits) (optional)
+        - match: tuple of (entry, score) when already matched in bulk (optional)
+        - tiers: sequence of tier names, run instead of the cascade's own
+          tiers (optional)
+
+        Returns:
+        - dict with the classification fields, "source" (the deciding tier) and
+          "reason", or None when the product needs the full pipeline
+        """
+        resolved = []
+
+        def get_salts():
+            if not resolved:
+                resolved.append(parse_salts(salts() if callable(salts) else salts))
+            return resolved[0]
+
+        for tier in self.tiers if tiers is None else tiers:
+            with self.tracer.span(f'tier_{tier}') as span:
+                decision = getattr(self, f'_{tier}')(bedrock, pname, get_salts, match)
+                span.set(decided=decision is not None)
+            if decision is not None:
+                decision["source"] = tier
+                return decision
+        return None
+
+    def _banned_list(self, bedrock, pname, get_salts, match):
+        best_match, score = match if match is not None else self.banned_index.match(pname)
+        if not best_match or score < self.banned_threshold:
+            return None
+        return {
+            "classification": "Banned",
+            "detailed_classification": "Banned, not for sale",
+            "confidence_level": f"Similarity Score: {score}%",
+            "justification": "Found in banned_drug_list",
+            "matched_drug": best_match["drug_name"],
+            "notification_no": best_match["notification_no"],
+            "date": best_match["date"],
+            "reason": f"Product name matches banned list entry with similarity {score}%",
+        }
+
+    def _fdc_components(self, bedrock, pname, get_salts, match):
+        # Without a salt composition the name itself often lists the molecules ("Aceclofenac + Paracetamol")
+        salts = get_salts() or parse_salts(pname)
+        # Bans restricted to a form, route or population need the full pipeline, and so do rules
+        # the salts only reach through a drug class, which may be drawn wider than the notification
+        rules = [rule for rule in self.fdc_matcher.match(salts)
+                 if not rule["conditional"] and self.fdc_matcher.named(rule, salts)]
+        if not rules:
+            return None
+        rule = rules[0]
+        return {
+            "classification": "Banned",
+            "detailed_classification": "Banned, not for sale",
+            # Exact combinations and banned molecules are named outright, the other kinds leave room for reading
+            "confidence_level": "HIGH" if rule["kind"] in ("exact", "single") else "MEDIUM",
+            "justification": "Salt composition falls under a banned fixed dose combination",
+            "matched_drug": rule["drug_name"],
+            "notification_no": rule["notification_no"],
+            "date": rule["date"],
+            "reason": f"Salts {' + '.join(salts)} match the {rule['kind']} rule '{rule['drug_name']}'",
+        }
+
+    def _allowlist(self, bedrock, pname, get_salts, match):
+        salts = get_salts()
+        # Only single molecules: a combination of allowed molecules can still be a banned FDC
+        molecule = salts[0] if len(salts) == 1 else (normalize_salt(pname) if not salts else None)
+        status = self.allowlist.get(molecule) if molecule else None
+        # A molecule named by any ban, even a conditional one, is not waved through
+        if status is None or self.fdc_matcher.match([molecule]):
+            return None
+        otc = status == "OTC"
+        return {
+            "classification": "Not Banned",
+            "detailed_classification": "OPEN FOR SALE (Not Banned)" if otc else "PRESCRIPTION-BASED DRUG (Not Banned)",
+            "confidence_level": "HIGH",
+            "justification": f"{molecule} is a known {'over-the-counter' if otc else 'prescription'} molecule",
+            "alternative_status": "over-the-counter" if otc else "prescription-only",
+            "relevant_regulations": "NA",
+            "reason": f"Single molecule '{molecule}' is on the local {status} allowlist",
+        }
+
+    def _small_model(self, bedrock, pname, get_salts, match):
+        # Imported here: prediction pulls in the scraping stack the other tiers do not need
+        from prediction import parse_classification_response, stream_verdict
+
+        prompt = SMALL_MODEL_PROMPT.format(pname=pname, salts=', '.join(get_salts()) or 'unknown')
+        try:
+            if self.verdict_only:
+                text, _ = stream_verdict(as_llm_client(bedrock), self.small_model_id, prompt, max_tokens=500)
+            else:
+                text = response_text(as_llm_client(bedrock).complete(self.small_model_id, prompt, max_tokens=500))
+        except Exception as e:
+            print(f"Small model call failed, falling through: {e}", file=sys.stderr)
+            return None
+        parsed = parse_classification_response(text)
+        if not parsed or (parsed.get('confidence_level') or '').upper() not in self.small_model_confidence:
+            return None
+        # A ban needs cited evidence, so only the full pipeline may conclude BANNED
+        if (parsed.get('classification') or '').strip().lower() != 'not banned':
+            return None
+        parsed["reason"] = f"{self.small_model_id} answered with {parsed['confidence_level']} confidence"
+        return parsed
@@ -0,0 +1,276 @@
+"""
+Persistent cache of classify_drug results.
+
+Results are stored in a local SQLite file keyed by a normalized drug
+signature, so "Semaglutide Tablets 14mg" and "semaglutide tablet 3 mg" share
+one entry while a semaglutide injection or an SR tablet gets its own. Each entry expires after a TTL chosen from its verdict (BANNED
+verdicts live longer than LOW-confidence ones) and the table is kept under a
+maximum size by evicting the least recently used entries.
+"""
+import re
+import json
+import time
+import sqlite3
+import threading
+
+from banned_index import normalize_name
+
+
+DAY = 24 * 60 * 60
+
+# Time to live per verdict class, in seconds
+DEFAULT_TTLS = {
+    "BANNED": 30 * DAY,
+    "HIGH": 14 * DAY,
+    "MEDIUM": 7 * DAY,
+    "LOW": 1 * DAY,
+}
+
+_STRENGTH_RE = re.compile(r'\b\d+(?:\.\d+)?\s*(?:mg|mcg|µg|gm|g|ml|iu|%|w/w|w/v)?(?![a-z])')
+
+# Dosage forms, packaging and filler words, dropped from names; the forms
+# among them are put back in canonical spelling through VARIANT_WORDS
+FORM_WORDS = {
+    "tablet", "tablets", "tab", "tabs", "capsule", "capsules", "cap", "caps",
+    "syrup", "injection", "inj", "oral", "cream", "gel", "ointment", "suspension",
+    "drops", "drop", "solution", "strip", "strips", "box", "pack", "bottle", "vial",
+    "vials", "sachet", "powder", "ip", "bp", "usp", "sr", "er", "xr", "mg", "mcg",
+    "ml", "gm", "of", "and", "with", "the", "in", "for", "x", "release", "coated",
+}
+
+# Dosage form and release words, by their canonical spelling: a tablet and an SR
+# tablet, or a syrup and a drop of the same molecule, can fall under different bans
+VARIANT_WORDS = {
+    "tablet": "tablet", "tablets": "tablet", "tab": "tablet", "tabs": "tablet",
+    "capsule": "capsule", "capsules": "capsule", "cap": "capsule", "caps": "capsule",
+    "syrup": "syrup", "suspension": "suspension", "injection": "injection", "inj": "injection",
+    "vial": "injection", "vials": "injection", "drops": "drops", "drop": "drops", "cream": "cream",
+    "gel": "gel", "ointment": "ointment", "solution": "solution", "sachet": "sachet", "powder": "powder",
+    "lotion": "lotion", "spray": "spray", "inhaler": "inhaler", "oral": "oral", "dispersible": "dispersible",
+    "sr": "sr", "er": "er", "xr": "xr", "cr": "cr", "mr": "mr", "sustained": "sr", "extended": "er",
+    "prolonged": "er", "controlled": "cr", "modified": "mr", "enteric": "enteric", "ec": "enteric",
+    "kit": "kit", "combikit": "kit",
+}
+
+
+def variant_words(text):
+    """Canonical dosage form and release words of a product name, such as {"sr", "tablet"}."""
+    return {VARIANT_WORDS[word] for word in normalize_name(text).split() if word in VARIANT_WORDS}
+
+
+def drug_signature(drug_name, salts=None):
+    """
+    Reduce a product name (and optional salt list) to a normalized identity.
+
+    Strengths and packaging words are dropped, dosage form and release words
+    are reduced to their canonical spelling, and the remaining tokens are
+    sorted, so word order, spelling of the form and pack size do not matter
+    but an SR tablet, a syrup and an injection of the same drug differ.
+
+    Parameters:
+    - drug_name: str, product name or description
+    - salts: list of str, salt composition if known (optional)
+
+    Returns:
+    - str, signature used as the cache key
+    """
+    text = ' '.join([drug_name or ''] + list(salts or []))
+    stripped = normalize_name(_STRENGTH_RE.sub(' ', text.lower()))
+    tokens = {t for t in stripped.split() if t not in FORM_WORDS and t not in VARIANT_WORDS and not t.isdigit()}
+    tokens = sorted(tokens) + sorted(variant_words(stripped)) if tokens else []
+    return ' '.join(tokens) or normalize_name(text)
+
+
+def ttl_for(classification, confidence_level, ttls=None):
+    """
+    Pick the time to live for a parsed verdict.
+
+    Parameters:
+    - classification: str, "Banned" or "Not Banned"
+    - confidence_level: str, LOW, MEDIUM or HIGH
+    - ttls: dict, overrides for DEFAULT_TTLS (optional)
+
+    Returns:
+    - int, seconds the verdict stays valid
+    """
+    ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+    confidence = (confidence_level or '').strip().upper()
+    if confidence not in ("HIGH", "MEDIUM"):
+        return ttls["LOW"]
+    if (classification or '').strip().lower() == 'banned':
+        return ttls["BANNED"]
+    return ttls[confidence]
+
+
+class SqliteLRUCache:
+    """
+    SQLite table of entries with a per-entry expiry, kept under a size bound
+    by evicting the least recently used entries.
+
+    Subclasses give the table name, its key column and the columns stored
+    between the key and the timestamps. The number of entries is counted
+    when the file is opened and when the bound is reached, and tracked in
+    between, so a put usually costs a key lookup and an insert instead of a
+    full count of the table.
+    """
+
+    table = None
+    key_column = None
+
+    def __init__(self, path, max_entries, columns):
+        """
+        Open (or create) the cache database.
+
+        Parameters:
+        - path: str, SQLite file path, ':memory:' for a throwaway cache
+        - max_entries: int, size bound enforced by LRU eviction
+        - columns: str, SQL definitions of the value columns
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                {self.key_column} TEXT PRIMARY KEY,
+                {columns},
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{self.table}_last_access ON {self.table}(last_access)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def _lookup(self, key, fields):
+        """
+        Read the value columns of a live entry and mark it as used.
+
+        Returns:
+        - tuple of the requested fields, or None on a miss or expired entry
+        """
+        now = time.time()
+        where = f"WHERE {self.key_column} = ?"
+        with self._lock:
+            row = self._conn.execute(f"SELECT expires_at, {fields} FROM {self.table} {where}", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if row[0] <= now:
+                self._conn.execute(f"DELETE FROM {self.table} {where}", (key,))
+                self._conn.commit()
+                self._size -= 1
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET last_access = ? {where}", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return row[1:]
+
+    def _store(self, key, values, ttl):
+        """Insert or replace an entry living `ttl` seconds, evicting others if the table is full."""
+        now = time.time()
+        placeholders = ', '.join('?' * (len(values) + 4))
+        with self._lock:
+            exists = self._conn.execute(f"SELECT 1 FROM {self.table} WHERE {self.key_column} = ?",
+                                        (key,)).fetchone()
+            self._conn.execute(f"INSERT OR REPLACE INTO {self.table} VALUES ({placeholders})",
+                               (key, *values, now, now + ttl, now))
+            if exists is None:
+                self._size += 1
+            if self._size > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        Drop expired entries, then the least recently used ones down to 90%
+        of max_entries, so the table is only counted again after many puts.
+        """
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+        # Recounted here since other processes may share the file
+        self._size = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        excess = self._size - int(self.max_entries * 0.9)
+        if excess > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE {self.key_column} IN "
+                f"(SELECT {self.key_column} FROM {self.table} ORDER BY last_access LIMIT ?)", (excess,)
+            )
+            self._size -= excess
+            self.evictions += excess
+
+    def stats(self):
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            size = self._size
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "entries": size,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+class ClassificationCache(SqliteLRUCache):
+    table = "classifications"
+    key_column = "signature"
+
+    def __init__(self, path='classification_cache.db', max_entries=100000, ttls=None):
+        """
+        Open (or create) the cache database.
+
+        Parameters:
+        - path: str, SQLite file path, ':memory:' for a throwaway cache
+        - max_entries: int, size bound enforced by LRU eviction
+        - ttls: dict, overrides for DEFAULT_TTLS (optional)
+        """
+        super().__init__(path, max_entries, "result TEXT NOT NULL, classification TEXT, confidence_level TEXT")
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+
+    def get(self, drug_name, salts=None):
+        """
+        Look up a cached classify_drug result.
+
+        Returns:
+        - dict, the cached result, or None on a miss, an expired entry or a
+          product without a usable name
+        """
+        signature = drug_signature(drug_name, salts)
+        # An empty signature would make every nameless product share one entry
+        if not signature:
+            return None
+        row = self._lookup(signature, "result")
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, drug_name, result, classification=None, confidence_level=None, salts=None):
+        """
+        Store a classify_drug result.
+
+        Parameters:
+        - drug_name: str, product name the result belongs to
+        - result: dict, JSON-serializable classify_drug result
+        - classification: str, parsed verdict, drives the TTL
+        - confidence_level: str, parsed confidence, drives the TTL
+        - salts: list of str, salt composition if known (optional)
+
+        Products without a usable name are not stored.
+        """
+        signature = drug_signature(drug_name, salts)
+        if not signature:
+            return
+        self._store(signature, (json.dumps(result), classification, confidence_level),
+                    ttl_for(classification, confidence_level, self.ttls))
@@ -0,0 +1,199 @@
+"""
+Offline evidence corpus for the reliable regulator sources.
+
+The regulator pages in DrugBanClassifier.reliable_sources change rarely, so
+instead of downloading and parsing them for every drug they are crawled by a
+refresher job and their extracted text is kept on disk. Text is stored
+content-addressed (gzip, named by SHA-256), and refreshes use ETag /
+Last-Modified conditional requests so unchanged pages cost a 304.
+
+Usage:
+    python corpus.py refresh                 # one pass, e.g. from cron
+    python corpus.py refresh --loop 86400    # keep refreshing daily
+    python corpus.py status
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+
+import requests
+
+import prediction as pred
+
+
+class SourceCorpus:
+    def __init__(self, root='corpus'):
+        """
+        Open a corpus directory.
+
+        Parameters:
+        - root: str, directory holding index.json and the objects/ store
+        """
+        self.root = root
+        self.index_path = os.path.join(root, 'index.json')
+        self._index = {}
+        self._index_mtime = None
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], f"{digest}.txt.gz")
+
+    def _load_index(self):
+        """Reload index.json when the refresher has rewritten it."""
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            return self._index
+        if mtime != self._index_mtime:
+            with open(self.index_path, 'r') as f:
+                self._index = json.load(f)
+            self._index_mtime = mtime
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+        self._index_mtime = os.path.getmtime(self.index_path)
+
+    def _store(self, text):
+        """Write text to the object store and return its digest."""
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(data))
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, url):
+        """
+        Return the stored text of a source.
+
+        Returns:
+        - str, the extracted text, or None if the URL is not in the corpus
+        """
+        with self._lock:
+            entry = self._load_index().get(url)
+            if not entry:
+                return None
+            digest = entry['sha256']
+            if digest not in self._texts:
+                try:
+                    with gzip.open(self._object_path(digest), 'rb') as f:
+                        self._texts[digest] = f.read().decode('utf-8')
+                except OSError:
+                    return None
+            return self._texts[digest]
+
+    def refresh_source(self, url, session, user_agents, timeout=30):
+        """
+        Re-crawl one source with a conditional request.
+
+        Returns:
+        - str, one of "unchanged", "changed", "new" or "failed"
+        """
+        entry = self._index.get(url, {})
+        headers = {'User-Agent': random.choice(user_agents)}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        now = time.time()
+        try:
+            response = session.get(url, headers=headers, timeout=timeout)
+        except requests.exceptions.RequestException:
+            return "failed"
+        if response.status_code == 304 and entry:
+            entry['checked_at'] = now
+            return "unchanged"
+        if response.status_code != 200:
+            return "failed"
+
+        text = pred.DrugBanClassifier.extract_text(response.content)
+        if not text:
+            return "failed"
+        digest = self._store(text)
+        status = "new" if not entry else ("unchanged" if entry.get('sha256') == digest else "changed")
+        self._index[url] = {
+            'sha256': digest,
+            'length': len(text),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': now,
+            'checked_at': now,
+            'changed_at': now if status != "unchanged" else entry.get('changed_at', now),
+        }
+        return status
+
+    def refresh(self, urls, user_agents, timeout=30):
+        """
+        Re-crawl every source and save the updated index.
+
+        Returns:
+        - dict, url -> refresh status
+        """
+        statuses = {}
+        with requests.Session() as session:
+            with self._lock:
+                self._load_index()
+            for url in urls:
+                statuses[url] = self.refresh_source(url, session, user_agents, timeout)
+            with self._lock:
+                self._save_index()
+                self._prune()
+        return statuses
+
+    def _prune(self):
+        """Delete stored objects no longer referenced by the index."""
+        live = {entry['sha256'] for entry in self._index.values()}
+        objects_dir = os.path.join(self.root, 'objects')
+        for dirpath, _, filenames in os.walk(objects_dir):
+            for filename in filenames:
+                if filename.endswith('.txt.gz') and filename[:-len('.txt.gz')] not in live:
+                    os.remove(os.path.join(dirpath, filename))
+        self._texts = {digest: text for digest, text in self._texts.items() if digest in live}
+
+    def status(self):
+        """Return the index entries, one per stored source."""
+        with self._lock:
+            return dict(self._load_index())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the offline corpus of reliable sources.")
+    parser.add_argument("command", choices=["refresh", "status"])
+    parser.add_argument("--root", default="corpus", help="corpus directory")
+    parser.add_argument("--loop", type=int, default=0, help="repeat the refresh every N seconds")
+    args = parser.parse_args()
+
+    corpus = SourceCorpus(args.root)
+    if args.command == "status":
+        print(json.dumps(corpus.status(), indent=2))
+        return
+
+    classifier = pred.DrugBanClassifier()
+    while True:
+        statuses = corpus.refresh(classifier.reliable_sources, classifier.user_agents)
+        print(json.dumps(statuses))
+        sys.stdout.flush()
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Near-duplicate clustering of catalog listings.
+
+Many sellers list the same product with slightly different pname,
+description and isq text. Each listing's fields are normalized and cut into
+character shingles, summarized by a MinHash signature and indexed with
+locality sensitive hashing (LSH): signatures are split into bands, and
+listings that agree on any band are candidates. A candidate cluster is
+joined when the estimated Jaccard similarity with its representative reaches
+the threshold and the listing names the same molecules, strengths, dosage
+form and release profile; otherwise the listing starts a new cluster and
+becomes its representative.
+
+Listings are assigned one at a time, so new ones join existing clusters
+without rebuilding the index. The signatures, clusters and the verdict each
+cluster was given are saved to one .npz file, so the next run keeps
+propagating verdicts from the previous one.
+"""
+import os
+import re
+import json
+import time
+import zlib
+import threading
+
+import numpy as np
+
+from banned_index import normalize_name
+from classification_cache import DAY, ttl_for, variant_words
+from search_cache import find_molecules, query_tokens
+
+
+# Strengths with a unit; bare numbers are too often pack sizes or counts
+_STRENGTH_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(mg|mcg|µg|gm|g|ml|iu|%)(?![a-z])')
+_UNITS = {"gm": "g", "µg": "mcg"}
+
+
+# Permuted hashes are reduced modulo a Mersenne prime, then kept to 32 bits
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Characters of a listing's text that are shingled; long descriptions add noise, not identity
+MAX_TEXT_CHARS = 2000
+
+# Row fields that describe the listing itself rather than its verdict
+LISTING_FIELDS = ("pc_item_id", "pname", "source", "reason", "error", "cluster_id", "cluster_representative",
+                  "timings_ms")
+
+
+def listing_text(record):
+    """Normalized pname, description and isq of a record, joined."""
+    isq = record.get('isq') or ''
+    if isinstance(isq, dict):
+        isq = ' '.join(f"{key} {value}" for key, value in isq.items())
+    parts = [record.get('pname') or '', record.get('description') or '', str(isq)]
+    return normalize_name(' '.join(parts))[:MAX_TEXT_CHARS]
+
+
+def shingle_hashes(text, size=5):
+    """
+    32-bit hashes of the character shingles of a text.
+
+    Returns:
+    - numpy uint64 array of unique shingle hashes
+    """
+    if len(text) <= size:
+        shingles = {text} if text else set()
+    else:
+        shingles = {text[i:i + size] for i in range(len(text) - size + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def lsh_bands(num_perm, threshold, recall=0.95):
+    """
+    Pick the LSH banding for a similarity threshold.
+
+    Two listings with Jaccard similarity s share at least one band with
+    probability 1 - (1 - s**rows)**bands. Longer bands mean fewer false
+    candidates to verify, so the longest band is taken that still finds a
+    pair at the threshold with probability `recall`.
+
+    Returns:
+    - tuple of (bands, rows per band)
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands < recall:
+            break
+        best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    def __init__(self, num_perm=128, seed=1):
+        """
+        Parameters:
+        - num_perm: int, hash permutations per signature
+        - seed: int, seeds the permutations; signatures are only comparable
+          between hashers with the same num_perm and seed
+        """
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.seed = seed
+        # a * x + b stays below 2**64 for 32-bit a, b and x
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes):
+        """
+        MinHash signature of a set of shingle hashes.
+
+        Returns:
+        - numpy uint32 array of num_perm values, or None for an empty set
+        """
+        if len(hashes) == 0:
+            return None
+        permuted = (hashes[:, None] * self._a + self._b) % np.uint64(_MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class ListingClusters:
+    def __init__(self, threshold=0.8, num_perm=128, shingle_size=5, seed=1, vocabulary=None, verdict_ttl=7 * DAY):
+        """
+        Create an empty cluster index.
+
+        Parameters:
+        - threshold: float, estimated Jaccard similarity a listing needs with
+          a cluster's representative to join it
+        - num_perm: int, MinHash permutations per signature
+        - shingle_size: int, characters per shingle
+        - seed: int, MinHash seed
+        - vocabulary: set of str, known molecule names; listings only join a
+          cluster whose representative names the same molecules (optional).
+          Strengths, dosage form and release words must match either way
+        - verdict_ttl: int, longest time a cluster's verdict is reused for new
+          listings; LOW confidence verdicts expire sooner (see ttl_for)
+        """
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.vocabulary = vocabulary
+        self.verdict_ttl = verdict_ttl
+        self.hasher = MinHasher(num_perm, seed)
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        # Odd multipliers folding a band of signature values into one 64-bit bucket key
+        self._band_weights = np.random.RandomState(seed + 1).randint(1, 1 << 62, size=self.rows,
+                                                                     dtype=np.uint64) | np.uint64(1)
+        self._item_ids = []
+        self._cluster_of = []
+        self._index = {}
+        self._buckets = [{} for _ in range(self.bands)]
+        self._representatives = []
+        self._keys = []
+        # Band keys of every listing and the signature of every representative, grown by doubling
+        self._band_keys = np.zeros((64, self.bands), dtype=np.uint64)
+        self._rep_signatures = np.zeros((64, num_perm), dtype=np.uint32)
+        self._verdicts = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._item_ids)
+
+    def _bands_of(self, signature):
+        bands = signature[:self.bands * self.rows].astype(np.uint64).reshape(self.bands, self.rows)
+        return (bands * self._band_weights).sum(axis=1)
+
+    def _molecule_key(self, record):
+        salts = record.get('salt_composition') or []
+        text = ' '.join([record.get('pname') or ''] + ([salts] if isinstance(salts, str) else list(salts)))
+        # query_tokens drops forms and strengths, so they are collected separately
+        variant = variant_words(text)
+        variant |= {f"{float(amount):g}{_UNITS.get(unit, unit)}" for amount, unit in _STRENGTH_RE.findall(text.lower())}
+        molecules = find_molecules(query_tokens(text), self.vocabulary) if self.vocabulary else set()
+        return ' '.join(sorted(molecules)) + '|' + ' '.join(sorted(variant))
+
+    @staticmethod
+    def _set_row(matrix, i, row):
+        if i == len(matrix):
+            matrix = np.concatenate([matrix, np.zeros_like(matrix)])
+        matrix[i] = row
+        return matrix
+
+    def _add(self, item_id, band_keys, cluster_id):
+        self._band_keys = self._set_row(self._band_keys, len(self._item_ids), band_keys)
+        self._index[item_id] = cluster_id
+        self._item_ids.append(item_id)
+        self._cluster_of.append(cluster_id)
+        for bucket, key in zip(self._buckets, band_keys.tolist()):
+            bucket.setdefault(key, set()).add(cluster_id)
+
+    def _new_cluster(self, item_id, signature, key):
+        cluster_id = len(self._representatives)
+        self._rep_signatures = self._set_row(self._rep_signatures, cluster_id, signature)
+        self._representatives.append(item_id)
+        self._keys.append(key)
+        return cluster_id
+
+    def assign(self, record):
+        """
+        Put a listing into its cluster, creating one if no cluster is close enough.
+
+        Listings seen before keep their cluster. Listings without any text
+        are not clustered.
+
+        Parameters:
+        - record: dict, product record (pc_item_id, pname, description, isq)
+
+        Returns:
+        - tuple of (cluster id or None, representative pc_item_id, estimated similarity)
+        """
+        item_id = str(record['pc_item_id'])
+        with self._lock:
+            cluster_id = self._index.get(item_id)
+            if cluster_id is not None:
+                return cluster_id, self._representatives[cluster_id], 1.0
+        signature = self.hasher.signature(shingle_hashes(listing_text(record), self.shingle_size))
+        if signature is None:
+            return None, item_id, 0.0
+        key = self._molecule_key(record)
+        band_keys = self._bands_of(signature)
+        with self._lock:
+            candidates = set().union(*(bucket.get(band_key, ())
+                                       for bucket, band_key in zip(self._buckets, band_keys.tolist())))
+            candidates = [cluster_id for cluster_id in candidates if self._keys[cluster_id] == key]
+            best, best_similarity = None, 0.0
+            if candidates:
+                similarities = (self._rep_signatures[candidates] == signature).mean(axis=1)
+                i = int(similarities.argmax())
+                best, best_similarity = candidates[i], float(similarities[i])
+            if best is None or best_similarity < self.threshold:
+                best, best_similarity = self._new_cluster(item_id, signature, key), 1.0
+            self._add(item_id, band_keys, best)
+            return best, self._representatives[best], best_similarity
+
+    def verdict(self, cluster_id):
+        """
+        The verdict last recorded for a cluster.
+
+        Returns:
+        - tuple of (dict verdict fields, pc_item_id they came from), or None
+          when the cluster has no verdict or it has expired
+        """
+        with self._lock:
+            entry = self._verdicts.get(cluster_id)
+        if entry is None or entry["expires_at"] <= time.time():
+            return None
+        return entry["verdict"], entry["item_id"]
+
+    def set_verdict(self, cluster_id, row):
+        """Record the verdict a listing of the cluster was classified with."""
+        verdict = {key: value for key, value in row.items() if key not in LISTING_FIELDS}
+        ttl = min(self.verdict_ttl, ttl_for(row.get('classification'), row.get('confidence_level')))
+        with self._lock:
+            self._verdicts[cluster_id] = {"verdict": verdict, "item_id": str(row["pc_item_id"]),
+                                          "expires_at": time.time() + ttl}
+
+    def member_row(self, record, cluster_id, similarity):
+        """
+        Output row for a listing answered with its cluster's verdict.
+
+        Returns:
+        - dict, or None when the cluster has no usable verdict
+        """
+        found = self.verdict(cluster_id)
+        if found is None:
+            return None
+        verdict, source_id = found
+        row = {"pc_item_id": record['pc_item_id'], "pname": record.get('pname', '')}
+        row.update(verdict)
+        row["source"] = "cluster"
+        row["reason"] = f"Near-duplicate of listing {source_id} (similarity {similarity:.2f})"
+        row["cluster_id"] = cluster_id
+        row["cluster_representative"] = source_id
+        return row
+
+    def stats(self):
+        """Return the number of listings, clusters and the size of the largest cluster."""
+        with self._lock:
+            sizes = np.bincount(np.asarray(self._cluster_of, dtype=np.int64)) if self._cluster_of else np.zeros(1)
+            return {
+                "listings": len(self._item_ids),
+                "clusters": len(self._representatives),
+                "largest_cluster": int(sizes.max()),
+                "clusters_with_verdict": len(self._verdicts),
+            }
+
+    def save(self, path):
+        """Write the index to an .npz file, replacing it atomically."""
+        with self._lock:
+            meta = {
+                "threshold": self.threshold,
+                "num_perm": self.hasher.num_perm,
+                "seed": self.hasher.seed,
+                "shingle_size": self.shingle_size,
+                "keys": self._keys,
+                "verdicts": {str(cluster_id): entry for cluster_id, entry in self._verdicts.items()},
+            }
+            arrays = {
+                "item_ids": np.array(self._item_ids, dtype=str),
+                "cluster_of": np.array(self._cluster_of, dtype=np.int64),
+                "band_keys": self._band_keys[:len(self._item_ids)],
+                "representatives": np.array(self._representatives, dtype=str),
+                "rep_signatures": self._rep_signatures[:len(self._representatives)],
+                "meta": np.array(json.dumps(meta)),
+            }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, threshold=0.8, vocabulary=None, verdict_ttl=7 * DAY):
+        """
+        Open an index written by save, or an empty one if the file does not exist.
+
+        Parameters:
+        - path: str, .npz file
+        - threshold: float, similarity threshold of a new index; a saved
+          index keeps the one it was built with
+        - vocabulary: set of str, known molecule names (optional)
+        - verdict_ttl: int, seconds a cluster's verdict is reused
+
+        Returns:
+        - ListingClusters
+        """
+        if not os.path.exists(path):
+            return cls(threshold=threshold, vocabulary=vocabulary, verdict_ttl=verdict_ttl)
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            clusters = cls(threshold=meta["threshold"], num_perm=meta["num_perm"], shingle_size=meta["shingle_size"],
+                           seed=meta["seed"], vocabulary=vocabulary, verdict_ttl=verdict_ttl)
+            for item_id, signature, key in zip(data["representatives"].tolist(), data["rep_signatures"],
+                                               meta["keys"]):
+                clusters._new_cluster(item_id, signature, key)
+            for item_id, band_keys, cluster_id in zip(data["item_ids"].tolist(), data["band_keys"],
+                                                      data["cluster_of"].tolist()):
+                clusters._add(item_id, band_keys, cluster_id)
+        clusters._verdicts = {int(cluster_id): entry for cluster_id, entry in meta["verdicts"].items()}
+        return clusters
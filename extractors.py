@@ -0,0 +1,101 @@
+"""
+Pluggable HTML-to-text extractors.
+
+All backends follow the same rules as the original BeautifulSoup path: drop
+script/style/header/footer/nav/aside, take the first main/article/div/body
+element, join its stripped text nodes with spaces. BeautifulSoup with
+html.parser is pure Python; lxml and selectolax parse in C and are used when
+installed.
+"""
+try:
+    from lxml import html as lxml_html
+    from lxml.etree import ParserError
+except ImportError:
+    lxml_html = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+
+SKIP_TAGS = ["script", "style", "header", "footer", "nav", "aside"]
+CONTENT_TAGS = ['main', 'article', 'div', 'body']
+
+# Content types worth handing to an HTML extractor
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain', 'application/xml', 'text/xml')
+
+
+def _join_lines(text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return ' '.join(lines)
+
+
+def extract_bs4(html):
+    """Extract text with BeautifulSoup's pure Python html.parser."""
+    # Imported on first use: bs4 is slow to import and only a fallback backend
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(SKIP_TAGS):
+        element.extract()
+    main_content = soup.find(CONTENT_TAGS)
+    text_content = main_content.get_text(separator=' ', strip=True) if main_content else soup.get_text(separator=' ', strip=True)
+    return _join_lines(text_content)
+
+
+def extract_lxml(html):
+    """Extract text with lxml's libxml2 HTML parser."""
+    try:
+        doc = lxml_html.document_fromstring(html)
+    except (ParserError, ValueError):
+        return ""
+    for element in doc.xpath('|'.join(f'//{tag}' for tag in SKIP_TAGS)):
+        element.drop_tree()
+    found = doc.xpath('(' + '|'.join(f'//{tag}' for tag in CONTENT_TAGS) + ')[1]')
+    root = found[0] if found else doc
+    strings = (s.strip() for s in root.xpath('.//text()'))
+    return _join_lines(' '.join(s for s in strings if s))
+
+
+def extract_selectolax(html):
+    """Extract text with selectolax's lexbor-based parser."""
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(SKIP_TAGS)
+    root = tree.css_first(', '.join(CONTENT_TAGS)) or tree.root
+    if root is None:
+        return ""
+    return _join_lines(root.text(separator=' ', strip=True))
+
+
+EXTRACTORS = {'bs4': extract_bs4}
+if lxml_html is not None:
+    EXTRACTORS['lxml'] = extract_lxml
+if LexborHTMLParser is not None:
+    EXTRACTORS['selectolax'] = extract_selectolax
+
+# Preferred backend order for 'auto'
+AUTO_ORDER = ('lxml', 'selectolax', 'bs4')
+
+
+def get_extractor(name='auto'):
+    """
+    Return an extractor function by backend name.
+
+    Parameters:
+    - name: str, 'bs4', 'lxml', 'selectolax' or 'auto' (fastest installed)
+
+    Returns:
+    - callable taking HTML bytes or str and returning the text
+    """
+    if name == 'auto':
+        name = next(backend for backend in AUTO_ORDER if backend in EXTRACTORS)
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown or unavailable extractor backend: {name}")
+    return EXTRACTORS[name]
+
+
+def is_html_content_type(content_type):
+    """True when a Content-Type header (or its absence) may hold a web page."""
+    if not content_type:
+        return True
+    return content_type.split(';')[0].strip().lower() in HTML_CONTENT_TYPES
@@ -0,0 +1,437 @@
+"""
+Structured matching of salt compositions against banned fixed-dose combinations.
+
+Most banned_drug.json entries are free-text FDC descriptions ("Fixed dose
+combinations of Atropine in Analgesics and Antipyretics.") that a whole-string
+fuzzy ratio against a product name cannot match. Each entry is parsed once
+into ingredient slots (a molecule, alternatives such as "Oxyphenbutazone or
+Phenylbutazone", or a drug class such as analgesics) together with its
+notification number and date. An inverted index from ingredient and class to
+rules narrows a product's salts to a handful of candidate rules, which are
+then verified, so a lookup costs microseconds regardless of list size.
+
+Usage:
+    python fdc_matcher.py parse > banned_fdc.json
+    python fdc_matcher.py match "Paracetamol 500mg + Caffeine 30mg"
+"""
+import re
+import sys
+import json
+import argparse
+from collections import Counter, defaultdict
+from itertools import permutations
+
+from banned_index import normalize_name
+from classification_cache import FORM_WORDS, _STRENGTH_RE
+
+
+# Words naming the salt form or pharmacopoeia grade rather than the molecule
+SALT_SUFFIXES = {
+    "hydrochloride", "hcl", "sodium", "potassium", "calcium", "magnesium", "sulphate", "sulfate",
+    "phosphate", "maleate", "citrate", "succinate", "tartrate", "besylate", "besilate", "mesylate",
+    "acetate", "fumarate", "bromide", "anhydrous", "trihydrate", "dihydrate", "monohydrate", "ip", "bp", "usp",
+}
+
+# Drug classes named by the notifications, with the molecules they cover
+DRUG_CLASSES = {
+    "analgesics": {
+        "paracetamol", "acetaminophen", "aspirin", "ibuprofen", "diclofenac", "aceclofenac", "nimesulide",
+        "naproxen", "ketorolac", "mefenamic acid", "tramadol", "analgin", "metamizole", "lornoxicam",
+        "piroxicam", "etoricoxib", "dextropropoxyphene",
+    },
+    "antipyretics": {"paracetamol", "acetaminophen", "aspirin", "ibuprofen", "analgin", "metamizole", "nimesulide",
+                     "mefenamic acid"},
+    "nsaids": {
+        "ibuprofen", "diclofenac", "aceclofenac", "nimesulide", "naproxen", "ketorolac", "piroxicam", "lornoxicam",
+        "etoricoxib", "aspirin", "mefenamic acid", "oxyphenbutazone", "phenylbutazone", "serratiopeptidase",
+    },
+    "vitamins": {
+        "vitamin a", "vitamin b1", "vitamin b6", "vitamin b12", "vitamin c", "vitamin d3", "vitamin e",
+        "thiamine", "pyridoxine", "cyanocobalamin", "methylcobalamin", "ascorbic acid", "riboflavin",
+        "niacinamide", "folic acid", "cholecalciferol", "tocopherol",
+    },
+    "tranquilizers": {"diazepam", "alprazolam", "lorazepam", "chlordiazepoxide", "clonazepam", "nitrazepam",
+                      "phenobarbitone", "meprobamate"},
+    "antihistamines": {
+        "cetirizine", "levocetirizine", "chlorpheniramine", "loratadine", "desloratadine", "fexofenadine",
+        "diphenhydramine", "promethazine", "cyproheptadine", "pheniramine", "triprolidine", "astemizole",
+        "terfenadine", "terfinadine", "doxylamine",
+    },
+    "antidiarrhoeals": {"loperamide", "diphenoxylate", "racecadotril", "kaolin", "pectin", "attapulgite"},
+    "sulphonamides": {"sulfamethoxazole", "sulphamethoxazole", "sulfadiazine", "sulphadiazine", "sulphaguanidine",
+                      "phthalylsulphathiazole", "succinylsulphathiazole"},
+    "penicillins": {"penicillin", "amoxicillin", "ampicillin", "cloxacillin", "dicloxacillin", "benzathine penicillin"},
+    "tetracyclines": {"tetracycline", "doxycycline", "minocycline", "oxytetracycline", "demeclocycline"},
+    "corticosteroids": {"prednisolone", "dexamethasone", "betamethasone", "hydrocortisone", "methylprednisolone",
+                        "budesonide", "deflazacort", "clobetasol", "triamcinolone"},
+    "bronchodilators": {"salbutamol", "albuterol", "levosalbutamol", "terbutaline", "theophylline", "etofylline",
+                        "doxofylline"},
+    "antitussives": {"dextromethorphan", "codeine", "pholcodine", "noscapine"},
+    "anti tb drugs": {"isoniazid", "rifampicin", "pyrazinamide", "ethambutol"},
+    "antacids": {"aluminium hydroxide", "magnesium hydroxide", "magnesium trisilicate", "calcium carbonate",
+                 "sodium bicarbonate", "simethicone"},
+    "h2 receptor antagonists": {"ranitidine", "famotidine", "cimetidine", "nizatidine"},
+    "anticholinergics": {"propantheline", "dicyclomine", "hyoscine", "hyoscyamine", "atropine", "glycopyrrolate"},
+    "antiamoebics": {"metronidazole", "tinidazole", "ornidazole", "secnidazole"},
+    "antispasmodics": {"dicyclomine", "drotaverine", "hyoscine", "camylofin", "mebeverine"},
+    "anthelmintics": {"albendazole", "mebendazole", "piperazine", "pyrantel", "ivermectin"},
+    "laxatives": {"bisacodyl", "senna", "lactulose", "sodium picosulfate", "liquid paraffin", "isabgol"},
+    "electrolytes": {"sodium chloride", "potassium chloride", "sodium citrate", "oral rehydration salts"},
+    "anabolic steroids": {"nandrolone", "stanozolol", "oxandrolone", "methandienone", "oxymetholone"},
+}
+
+# Spellings used in the notifications -> DRUG_CLASSES key
+CLASS_ALIASES = {
+    "analgesic": "analgesics", "antipyretic": "antipyretics", "analgesics antipyretics": "analgesics",
+    "anti inflammatory": "nsaids", "non steriodal anti inflammatory": "nsaids", "nsaids": "nsaids",
+    "vitamin": "vitamins",
+    "tranquilizer": "tranquilizers", "sedatives": "tranquilizers", "hypnotics": "tranquilizers",
+    "anxiolytics": "tranquilizers",
+    "antihistaminic": "antihistamines", "antihistamine": "antihistamines",
+    "anti diarrhoeal": "antidiarrhoeals", "anti diarrhoeal s": "antidiarrhoeals", "antidiarrhoeal": "antidiarrhoeals",
+    "sulphonamide": "sulphonamides", "sulfonamides": "sulphonamides",
+    "penicillin": "penicillins", "tetracycline": "tetracyclines", "corticosteroid": "corticosteroids",
+    "bronchodilator": "bronchodilators",
+    "anti tussive": "antitussives", "antitussive": "antitussives",
+    "anti tb": "anti tb drugs", "antacid": "antacids",
+    "histamine h 2 receptor antagonists": "h2 receptor antagonists",
+    "anti cholinergic": "anticholinergics", "anticholinergic": "anticholinergics",
+    "anti amoebic": "antiamoebics", "antiamoebic": "antiamoebics",
+    "anti spasmodic": "antispasmodics", "anti spasmodics": "antispasmodics", "antispasmodic": "antispasmodics",
+    "anthelmintic": "anthelmintics", "laxative": "laxatives", "electrolyte": "electrolytes",
+}
+CLASS_ALIASES.update({name: name for name in DRUG_CLASSES})
+
+# Molecule -> classes it belongs to
+MOLECULE_CLASSES = defaultdict(set)
+for _class, _members in DRUG_CLASSES.items():
+    for _member in _members:
+        MOLECULE_CLASSES[_member].add(_class)
+
+# Qualifiers that restrict a ban to a route, population, form or strength; such
+# rules are reported but cannot be decided from the salts alone
+_CONDITION_RE = re.compile(
+    r'\b(?:except|other than|for animal use|children|pediatric|paediatric|liquid oral|ointment|exceeding|'
+    r'more than|claiming|for induction|diagnosis|for internal use|external use|parenteral|parenteal|'
+    r'injection|dosage form|per tablet|for use for|systemic use|toothpaste|ayurvedic|proof|'
+    r'conforming|dovers|tonic|suspension|syrup|drops|cream|gel|lotion|spray|inhaler|solution|kit|'
+    r'sr|er|xr|cr|mr|sustained release|extended release|prolonged release|modified release|controlled release|'
+    r'dispersible|enteric coated|film coated)s?\b'
+)
+_DOSE_RE = re.compile(r'\d\s*(?:mg|mcg|g|ml|iu|%)(?![a-z])', re.IGNORECASE)
+_NOTIFICATION_RE = re.compile(r'(?i)(?:substituted\s+vide\s+)?gsr\s*n\s*o\s*\.?\s*(\d+)\s*\(e\)\s*dated\s*((?:\d\s*){1,2}\.\s*\d{1,2}\s*\.\s*\d{1,4})')
+_LIST_NUMBER_RE = re.compile(r'^\s*\d+\.\s+')
+_PREFIX_RE = re.compile(
+    r'^(?:the\s+)?(?:patent and proprietary medicines of\s+)?(?:parenteal preparations\s+)?'
+    r'(?:all pharmaceutical preparations containing\s+|antidiarrhoeal formulations containing\s+|'
+    r'preparations claiming to combat cough associated with asthma containing\s+|'
+    r'combikit of\s+|(?:fixed (?:dose\s+)?)?combinations?\s+(?:of|containing)\s+)'
+)
+_ANY_OTHER_RE = re.compile(r'\bwith\s+(?:any\s+other|other|any)\s+(?:drugs?|enzymes?)\b|\bwith\s+other\s+drugs\b')
+_TRAILER_RE = re.compile(
+    r'\b(?:substituted\s+vide|and\s+(?:it\s*s|all)\s+formulations|formulations?\s+for|its salts|'
+    r'including their|as a drug|for human use|for the treatment).*$'
+)
+_CONTAINING_RE = re.compile(r'\bcontaining\b.*?(?=\bwith\b|$)')
+_INCLUDING_RE = re.compile(r'\s*\bincluding\b.*$')
+_ANY_FORM_RE = re.compile(r'\bin any (?:dosage )?form\b')
+_SLOT_SPLIT_RE = re.compile(r'\s*(?:\+|,|\bwith\b|\bin\b|\band\b)\s*')
+_ALTERNATIVE_SPLIT_RE = re.compile(r'\s*(?:\bor\b|/)\s*')
+_GENERIC_WORDS = {"any", "other", "group", "drugs", "drug", "agents", "agent", "preparations", "preparation",
+                  "crude", "centrally", "acting", "a", "the", "tablet", "tablets", "formulations", "formulation",
+                  "liquid", "oral", "activated", "all", "inner", "hpmc"}
+# Release and coating words; the rule is conditional on them, they name no ingredient
+_QUALIFIER_WORDS = {"sr", "er", "xr", "cr", "mr", "sustained", "extended", "prolonged", "modified", "controlled",
+                    "release", "dispersible", "enteric", "coated", "film"}
+_SALT_SPLIT_RE = re.compile(r'\s*(?:\+|,|/|;|&|\band\b|\bwith\b)\s*', re.IGNORECASE)
+_PARENS_RE = re.compile(r'\([^)]*\)')
+
+
+def normalize_salt(salt):
+    """
+    Reduce one salt to its molecule name.
+
+    "Paracetamol IP (500 mg)" gives "paracetamol" and "Metformin Hydrochloride"
+    gives "metformin". Salt suffixes are only dropped after the first word, so
+    "Sodium Chloride" stays whole.
+    """
+    text = _STRENGTH_RE.sub(' ', _PARENS_RE.sub(' ', (salt or '').lower()))
+    tokens = [t for t in normalize_name(text).split() if t not in FORM_WORDS and not t.isdigit()]
+    return ' '.join(tokens[:1] + [t for t in tokens[1:] if t not in SALT_SUFFIXES])
+
+
+def parse_salts(salt_composition):
+    """
+    Split a salt composition into normalized molecule names.
+
+    Parameters:
+    - salt_composition: str ("Paracetamol (500mg) + Caffeine (30mg)") or list of str
+
+    Returns:
+    - list of str, distinct molecules in order of appearance
+    """
+    if not salt_composition:
+        return []
+    parts = salt_composition if isinstance(salt_composition, list) else _SALT_SPLIT_RE.split(salt_composition)
+    salts = [normalize_salt(part) for part in parts]
+    return list(dict.fromkeys(s for s in salts if s and s not in ('na', 'n a', 'none')))
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [str(v).strip() for v in value] if isinstance(value, list) else [str(value).strip()]
+
+
+def _clean(text):
+    """Lowercase, spell out & and drop punctuation except the separators + , and /."""
+    text = re.sub(r'[^\w\s+,/]', ' ', (text or '').lower().replace('&', ' and '))
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _repair_words(text, vocabulary):
+    """Rejoin words broken by the PDF extraction ("Yohim bine", "Pa ncrelipase")."""
+    words = text.split()
+    repaired = []
+    for word in words:
+        if repaired:
+            previous = repaired[-1]
+            joined = previous + word
+            both_rare = vocabulary[previous] <= 1 and vocabulary[word] <= 1 and min(len(previous), len(word)) <= 4
+            # Known filler words ("inner hpmc capsule") are whole words, not fragments
+            whole = previous in _GENERIC_WORDS or word in _GENERIC_WORDS
+            if previous.isalpha() and word.isalpha() and not whole and (vocabulary[joined] > 0 or both_rare):
+                repaired[-1] = joined
+                continue
+        repaired.append(word)
+    return ' '.join(repaired)
+
+
+def _slot(text):
+    """Turn one ingredient description into its set of acceptable keys."""
+    keys = set()
+    for alternative in _ALTERNATIVE_SPLIT_RE.split(_INCLUDING_RE.sub('', text)):
+        name = normalize_salt(alternative)
+        words = [w for w in name.split() if w not in _GENERIC_WORDS and w not in _QUALIFIER_WORDS]
+        name = ' '.join(words)
+        if not name:
+            continue
+        # A named molecule ("Tetracycline") stays that molecule, only class names cover their members
+        class_name = None if name in MOLECULE_CLASSES else CLASS_ALIASES.get(name)
+        keys.add(f"class:{class_name}" if class_name else name)
+    return frozenset(keys)
+
+
+def _split_notifications(entry):
+    """
+    Split an entry into (drug text, notification_no, date) pieces.
+
+    A few entries of the list carry several bans run together, each followed
+    by its own "GSR NO. 191(E) Dated 05.03.2003"; the last piece belongs to the
+    entry's own notification.
+    """
+    raw = re.sub(r'\s+', ' ', entry["drug_name"]).strip()
+    pieces, start = [], 0
+    for match in _NOTIFICATION_RE.finditer(raw):
+        pieces.append((raw[start:match.start()], [f"{match.group(1)}(E)"], [re.sub(r'\s', '', match.group(2))]))
+        start = match.end()
+    pieces.append((raw[start:], _as_list(entry.get("notification_no")), _as_list(entry.get("date"))))
+    return [(_LIST_NUMBER_RE.sub('', piece).strip(' .*'), notification_no, date)
+            for piece, notification_no, date in pieces]
+
+
+def parse_entry(entry, vocabulary=None):
+    """
+    Parse one banned list entry into structured rules.
+
+    Parameters:
+    - entry: dict, banned list entry with drug_name, notification_no, date
+    - vocabulary: Counter of words over the whole list, used to repair broken words
+
+    Returns:
+    - list of dict rules with drug_name, slots (list of sets of molecule /
+      "class:..." keys), kind ("single", "exact", "combination" or
+      "any_other"), conditional, notification_no, date and the entry's sr_no
+    """
+    vocabulary = vocabulary or Counter()
+    rules = []
+    for drug_name, notification_no, date in _split_notifications(entry):
+        if not drug_name:
+            continue
+        text = _repair_words(_clean(drug_name), vocabulary)
+        # Checked before the word repair, which can glue a qualifier to its neighbour ("ear drops")
+        # Bans of a specific strength ("Glipizide 2.5mg + Metformin 400mg") are conditional too
+        conditional = bool(_CONDITION_RE.search(_clean(drug_name)) or _CONDITION_RE.search(text)
+                           or _DOSE_RE.search(drug_name))
+        any_other = bool(_ANY_OTHER_RE.search(text))
+        # Parenthesised remarks qualify the ban ("(SR)", "(Ear Drops)") and are left out of the slots,
+        # except a parenthesised list of ingredients ("Capsule (Streptococcus Faecalis + ...)")
+        body = _PARENS_RE.sub(lambda m: ' + ' + m.group(0)[1:-1] if '+' in m.group(0) else ' ', drug_name)
+        body = _repair_words(_clean(body), vocabulary)
+        body = _PREFIX_RE.sub('', body)
+        body = _CONTAINING_RE.sub('', body) if ' with ' in body else body
+        body = _ANY_OTHER_RE.sub('', body)
+        body = _TRAILER_RE.sub('', body)
+        body = _ANY_FORM_RE.sub('', body)
+        body = re.sub(r'\band\s*/?\s*or\b', ' or ', body)
+        slots = list(dict.fromkeys(slot for slot in (_slot(part) for part in _SLOT_SPLIT_RE.split(body)) if slot))
+        if not slots:
+            continue
+        if any_other:
+            kind = "any_other"
+        elif len(slots) == 1:
+            kind = "single"
+        elif '+' in text or text.startswith('combikit'):
+            kind = "exact"
+        else:
+            kind = "combination"
+        rules.append({
+            "drug_name": drug_name,
+            "slots": slots,
+            "kind": kind,
+            "conditional": conditional,
+            "notification_no": notification_no,
+            "date": date,
+            "sr_no": entry.get("sr_no"),
+        })
+    return rules
+
+
+def _salt_keys(salt):
+    return {salt} | {f"class:{name}" for name in MOLECULE_CLASSES.get(salt, ())}
+
+
+def _covers_exactly(slots, salt_keys):
+    """True when the salts fill the slots one to one."""
+    if len(slots) != len(salt_keys):
+        return False
+    if len(slots) > 7:
+        # Greedy fallback for very long combinations
+        remaining = list(salt_keys)
+        for slot in slots:
+            hit = next((keys for keys in remaining if slot & keys), None)
+            if hit is None:
+                return False
+            remaining.remove(hit)
+        return True
+    return any(all(slot & keys for slot, keys in zip(slots, order)) for order in permutations(salt_keys))
+
+
+class FdcMatcher:
+    # Order in which matches are reported, most specific first
+    KIND_ORDER = {"exact": 0, "combination": 1, "any_other": 2, "single": 3}
+
+    def __init__(self, banned_drugs):
+        """
+        Parse the banned list and build the inverted index.
+
+        Parameters:
+        - banned_drugs: list of dict, entries with drug_name, notification_no, date
+        """
+        vocabulary = Counter(word for entry in banned_drugs
+                             for word in normalize_name(entry["drug_name"]).split())
+        vocabulary.update(word for members in DRUG_CLASSES.values() for member in members for word in member.split())
+        self.rules = [rule for entry in banned_drugs for rule in parse_entry(entry, vocabulary)]
+
+        # Ingredient or "class:..." key -> ids of the rules that mention it
+        self._index = defaultdict(set)
+        for rule_id, rule in enumerate(self.rules):
+            for slot in rule["slots"]:
+                for key in slot:
+                    self._index[key].add(rule_id)
+
+    @classmethod
+    def from_file(cls, path='banned_drug.json'):
+        """Build the matcher from a banned drug JSON file."""
+        with open(path, 'r') as f:
+            return cls(json.load(f)["banned_drugs"])
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _matches_rule(self, rule, salt_keys):
+        slots = rule["slots"]
+        if rule["kind"] == "exact":
+            return _covers_exactly(slots, salt_keys)
+        covering = [
+            [i for i, keys in enumerate(salt_keys) if slot & keys]
+            for slot in slots
+        ]
+        if not all(covering):
+            return False
+        if rule["kind"] == "single":
+            return True
+        used = {i for hits in covering for i in hits}
+        if rule["kind"] == "any_other":
+            # The named ingredients combined with at least one other drug
+            return len(used) < len(salt_keys)
+        return len(used) >= 2
+
+    def match(self, salts):
+        """
+        Find the banned rules a salt composition falls under.
+
+        Parameters:
+        - salts: str or list of str, salt composition
+
+        Returns:
+        - list of dict, matching rules (most specific and unconditional first)
+        """
+        salts = parse_salts(salts)
+        if not salts:
+            return []
+        salt_keys = [_salt_keys(salt) for salt in salts]
+        candidates = set()
+        for keys in salt_keys:
+            for key in keys:
+                candidates |= self._index.get(key, set())
+        matches = [self.rules[rule_id] for rule_id in candidates if self._matches_rule(self.rules[rule_id], salt_keys)]
+        return sorted(matches, key=lambda rule: (rule["conditional"], self.KIND_ORDER[rule["kind"]],
+                                                 rule["drug_name"]))
+
+    def named(self, rule, salts):
+        """
+        True when the salts fill a matching rule under their own names.
+
+        A rule matched only because a salt belongs to a drug class it names
+        ("any other bronchodilator") is an inference from DRUG_CLASSES, not
+        a ban that names the product.
+        """
+        return self._matches_rule(rule, [{salt} for salt in parse_salts(salts)])
+
+    def related(self, salts):
+        """
+        Rules that name any of the salts or their drug classes, whether or not they match.
+
+        Returns:
+        - list of dict rules
+        """
+        rule_ids = set()
+        for salt in parse_salts(salts):
+            for key in _salt_keys(salt):
+                rule_ids |= self._index.get(key, set())
+        return [self.rules[rule_id] for rule_id in sorted(rule_ids)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse the banned list into FDC rules and match salts against it.")
+    parser.add_argument("command", choices=["parse", "match"])
+    parser.add_argument("salts", nargs="?", help="salt composition for match, e.g. 'Paracetamol + Caffeine'")
+    parser.add_argument("--banned", default="banned_drug.json", help="banned drug list")
+    args = parser.parse_args()
+
+    matcher = FdcMatcher.from_file(args.banned)
+    if args.command == "parse":
+        rules = [dict(rule, slots=[sorted(slot) for slot in rule["slots"]]) for rule in matcher.rules]
+        json.dump(rules, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+        return
+    if not args.salts:
+        parser.error("match needs a salt composition")
+    for rule in matcher.match(args.salts):
+        note = " (conditional)" if rule["conditional"] else ""
+        print(f"{rule['kind']:<12}{', '.join(rule['notification_no']):<18}{rule['drug_name']}{note}")
+
+
+if __name__ == "__main__":
+    main()
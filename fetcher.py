@@ -0,0 +1,180 @@
+"""
+Pooled, long-lived fetch engine for source pages.
+
+Page fetching is I/O bound, so a single thread pool and a shared
+requests.Session (keep-alive connection pool) are reused for every
+classification instead of spawning a process pool per call. Concurrency per
+host is capped, the whole fan-out runs under a global deadline, and the
+remaining fetches are cancelled as soon as enough good sources are in.
+Requests are also paced per host and skipped while a host's circuit breaker
+is open (see rate_limit).
+"""
+import time
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeout
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limit import get_default_limiter
+
+
+# Bytes read from one page before the rest of the body is dropped
+DEFAULT_MAX_BYTES = 512 * 1024
+
+
+def read_capped(response, max_bytes=DEFAULT_MAX_BYTES, chunk_size=16 * 1024):
+    """
+    Read a streamed response body, stopping after max_bytes.
+
+    Parameters:
+    - response: requests.Response opened with stream=True
+    - max_bytes: int, maximum number of bytes kept
+    - chunk_size: int, bytes read per iteration
+
+    Returns:
+    - bytes, at most max_bytes of the (decompressed) body
+    """
+    buffer = bytearray()
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        buffer += chunk[:max_bytes - len(buffer)]
+        if len(buffer) >= max_bytes:
+            break
+    return bytes(buffer)
+
+
+class ByteMeter:
+    """Bytes held by one classification's sources, with the high-water mark."""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        with self._lock:
+            self.current += n
+            self.peak = max(self.peak, self.current)
+
+    def release(self, n):
+        with self._lock:
+            self.current -= n
+
+
+class SourceFetcher:
+    def __init__(self, max_workers=16, per_host_limit=2, request_timeout=15, total_timeout=30, pool_size=32,
+                 limiter=None):
+        """
+        Create the shared session and worker pool.
+
+        Parameters:
+        - max_workers: int, concurrent fetches across all hosts
+        - per_host_limit: int, concurrent fetches against one host
+        - request_timeout: int, seconds allowed for a single request
+        - total_timeout: int, seconds allowed for one fetch_sources call
+        - pool_size: int, keep-alive connections kept per host
+        - limiter: HostLimiter, per-host rate limits and circuit breakers
+          (optional, process default otherwise)
+        """
+        self.limiter = limiter or get_default_limiter()
+        self.per_host_limit = per_host_limit
+        self.request_timeout = request_timeout
+        self.total_timeout = total_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetcher')
+        self._host_slots = defaultdict(lambda: threading.BoundedSemaphore(self.per_host_limit))
+        self._host_lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._host_lock:
+            return self._host_slots[host]
+
+    def _fetch_one(self, url, fetch_fn, cancelled, deadline):
+        if cancelled.is_set():
+            return ""
+        slot = self._host_slot(url)
+        if not slot.acquire(timeout=max(0, deadline - time.monotonic())):
+            return ""
+        try:
+            remaining = deadline - time.monotonic()
+            if cancelled.is_set() or remaining <= 0 or not self.limiter.acquire(url, timeout=remaining):
+                return ""
+            timeout = max(0.1, min(self.request_timeout, deadline - time.monotonic()))
+            content = fetch_fn(url, session=self.session, timeout=timeout) or ""
+            # The host answered; a PDF or a page without text is not a host failure
+            self.limiter.record(url, True)
+            return content
+        except Exception:
+            self.limiter.record(url, False)
+            return ""
+        finally:
+            slot.release()
+
+    def fetch_sources(self, urls, fetch_fn, min_sources=None, min_length=500, timeout=None):
+        """
+        Fetch several URLs concurrently.
+
+        Parameters:
+        - urls: list of str, URLs to fetch
+        - fetch_fn: callable(url, session=, timeout=) returning the page text;
+          it raises on request errors and HTTP error statuses, the only
+          outcomes counted against the host's circuit breaker
+        - min_sources: int, stop once this many pages longer than min_length
+          have arrived; None waits for every URL
+        - min_length: int, length a page needs to count as a good source
+        - timeout: int, overall deadline in seconds (defaults to total_timeout)
+
+        Returns:
+        - list of str, page text aligned with `urls`; pages that failed, were
+          cancelled or missed the deadline are empty strings
+        """
+        deadline = time.monotonic() + (self.total_timeout if timeout is None else timeout)
+        cancelled = threading.Event()
+        futures = {
+            self._executor.submit(self._fetch_one, url, fetch_fn, cancelled, deadline): i
+            for i, url in enumerate(urls)
+        }
+        contents = [""] * len(urls)
+        good = 0
+        try:
+            for future in as_completed(futures, timeout=max(0, deadline - time.monotonic())):
+                content = future.result()
+                contents[futures[future]] = content
+                if content and len(content) > min_length:
+                    good += 1
+                    if min_sources and good >= min_sources:
+                        break
+        except FuturesTimeout:
+            pass
+        finally:
+            # Queued fetches never start, running ones are discarded
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+        return contents
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+_default_fetcher = None
+_default_lock = threading.Lock()
+
+
+def get_default_fetcher():
+    """Return the process-wide SourceFetcher, creating it on first use."""
+    global _default_fetcher
+    with _default_lock:
+        if _default_fetcher is None:
+            _default_fetcher = SourceFetcher()
+        return _default_fetcher
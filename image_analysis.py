@@ -0,0 +1,250 @@
+"""
+Concurrent, deduplicated product image analysis.
+
+Product images are keyed by the SHA-256 of their bytes. Identical images
+(sellers reuse the same packshots across listings) are analysed once, the
+Bedrock vision result is cached on disk per image and prompt, and the
+remaining images fan out to Bedrock concurrently under a configurable limit.
+Downloaded URLs are remembered in memory so a rerun does not fetch them again.
+Images are downscaled and re-encoded (see image_preprocess) before upload.
+"""
+import os
+import json
+import base64
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from llm_client import as_llm_client
+from tracing import get_default_tracer
+from image_preprocess import preprocess_image, DEFAULT_MAX_EDGE
+
+
+IMAGE_MODEL_ID = 'anthropic.claude-3-sonnet-20240229-v1:0'
+
+# Prompt used to extract structured label details from a product image
+IMAGE_EXTRACTION_PROMPT = """
+        You are an expert in pharmaceutical regulations and drug classification. Given an image of a pharmaceutical product label, perform the following tasks:
+
+        1. **Extract and structure the following pharmaceutical information:**
+           - **Product Name**
+           - **Salt Composition**
+           - **Dosage Strength**
+           - **Formulation Type** (e.g., Tablet, Capsule, Syrup)
+           - **Quantity** (e.g., 10 Tablets, 100 Capsules)
+           - **Prescription Status** (Rx Only, OTC, Controlled Drug)
+           - **Manufacturer**    
+        2. **Return the structured JSON output with these details:**
+        ```json
+        {
+            "Product Name": "<Extracted Product Name>",
+            "Salt Composition": "<Extracted Salt Composition>",
+            "Dosage Strength": "<Extracted Dosage Strength>",
+            "Formulation Type": "<Extracted Formulation>",
+            "Quantity": "<Extracted Quantity>",
+            "Prescription Status": "<Rx Only / OTC / Controlled Drug / NA>",
+            "Manufacturer": "<Extracted Manufacturer>"
+        }
+        ```
+        """
+
+
+def encode_image_to_base64(image_bytes, file_extension):
+    media_type = f"image/{file_extension}" if file_extension else "image/jpeg"
+    return base64.b64encode(image_bytes).decode('utf-8'), media_type
+
+
+def fetch_image_from_url(image_url, session=None):
+    try:
+        response = (session or requests).get(image_url, timeout=5)
+        response.raise_for_status()
+        image_bytes = response.content
+        content_type = response.headers.get('Content-Type', '')
+        file_extension = mimetypes.guess_extension(content_type).lstrip('.') if content_type else 'jpg'
+        return image_bytes, file_extension
+    except requests.exceptions.RequestException as e:
+        return None, str(e)
+
+
+def image_block(image_bytes, file_extension):
+    """Build the Bedrock message content block for an image."""
+    image_base64, media_type = encode_image_to_base64(image_bytes, file_extension)
+    return {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_base64}}
+
+
+def query_bedrock_llm_images(bedrock, image_base64, prompt, model_id=IMAGE_MODEL_ID, tracer=None):
+    """
+    Ask the vision model about one image.
+
+    Parameters:
+    - bedrock: LLMClient (or a boto3 bedrock-runtime client)
+    - image_base64: dict, image content block (see image_block)
+    - prompt: str, instructions sent after the image
+
+    Returns:
+    - str, the raw JSON response
+    """
+    content = [image_base64, {"type": "text", "text": prompt}]
+    with (tracer or get_default_tracer()).span('image_analysis') as span:
+        response = as_llm_client(bedrock).complete(model_id, content, max_tokens=1700, temperature=0.1)
+        usage = response.get('usage', {})
+        span.set(tokens_in=usage.get('input_tokens', 0), tokens_out=usage.get('output_tokens', 0))
+        result = json.dumps(response)
+    return result
+
+
+class ImageAnalyzer:
+    def __init__(self, bedrock, cache_dir='image_cache', max_concurrency=4, max_remembered_urls=10000,
+                 model_id=IMAGE_MODEL_ID, tracer=None, preprocess=True, max_edge=DEFAULT_MAX_EDGE, quality=85):
+        """
+        Create an analyzer sharing one worker pool and one on-disk cache.
+
+        Parameters:
+        - bedrock: LLMClient (or a boto3 bedrock-runtime client)
+        - cache_dir: str, directory for cached extraction results
+        - max_concurrency: int, Bedrock vision calls in flight at once
+        - max_remembered_urls: int, downloaded URLs remembered in memory
+        - model_id: str, Bedrock vision model
+        - tracer: Tracer, records image spans (optional)
+        - preprocess: bool, downscale and re-encode images before upload
+        - max_edge: int, longest image edge in pixels sent to Bedrock
+        - quality: int, JPEG quality used when re-encoding
+        """
+        self.bedrock = bedrock
+        self.cache_dir = cache_dir
+        self.model_id = model_id
+        self.tracer = tracer or get_default_tracer()
+        self.max_remembered_urls = max_remembered_urls
+        self.preprocess = preprocess
+        self.max_edge = max_edge
+        self.quality = quality
+        self.session = requests.Session()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='images')
+        self._urls = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _cache_path(self, digest, prompt):
+        # Results depend on what was actually sent, so the preprocessing settings are part of the key
+        settings = f"{self.max_edge}:{self.quality}" if self.preprocess else "raw"
+        prompt_digest = hashlib.sha256(f"{self.model_id}\n{settings}\n{prompt}".encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}-{prompt_digest}.json")
+
+    def _load(self, digest, prompt):
+        try:
+            with open(self._cache_path(digest, prompt), 'r', encoding='utf-8') as f:
+                return json.load(f)["result"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _store(self, digest, prompt, result):
+        path = self._cache_path(digest, prompt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"sha256": digest, "result": result}, f)
+        os.replace(tmp_path, path)
+
+    def _analyze_one(self, digest, image_bytes, file_extension, prompt):
+        cached = self._load(digest, prompt)
+        if cached is not None:
+            with self.tracer.span('image_cache', cache_hit=True):
+                return cached
+        if self.preprocess:
+            with self.tracer.span('image_preprocess', bytes_in=len(image_bytes)) as span:
+                image_bytes, file_extension = preprocess_image(image_bytes, file_extension,
+                                                               max_edge=self.max_edge, quality=self.quality)
+                span.set(bytes_out=len(image_bytes))
+        result = query_bedrock_llm_images(self.bedrock, image_block(image_bytes, file_extension), prompt,
+                                          model_id=self.model_id, tracer=self.tracer)
+        # Failed calls are not cached so they are retried next time
+        if 'error' not in json.loads(result):
+            self._store(digest, prompt, result)
+        return result
+
+    def _submit(self, digest, image_bytes, file_extension, prompt):
+        """Start (or join) the analysis of one distinct image."""
+        key = (digest, prompt)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._executor.submit(self._analyze_one, digest, image_bytes, file_extension, prompt)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+        return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def analyze(self, images, prompt):
+        """
+        Analyse product images, each distinct image once.
+
+        Parameters:
+        - images: list of (image_bytes, file_extension)
+        - prompt: str, extraction prompt sent with each image
+
+        Returns:
+        - list of str, raw Bedrock responses aligned with `images`
+        """
+        futures = [
+            self._submit(hashlib.sha256(image_bytes).hexdigest(), image_bytes, file_extension, prompt)
+            for image_bytes, file_extension in images
+        ]
+        return [future.result() for future in futures]
+
+    def _remember(self, url, digest):
+        with self._lock:
+            self._urls[url] = digest
+            self._urls.move_to_end(url)
+            while len(self._urls) > self.max_remembered_urls:
+                self._urls.popitem(last=False)
+
+    def _known_result(self, url, prompt):
+        """Cached result for a URL downloaded before, without downloading it again."""
+        with self._lock:
+            digest = self._urls.get(url)
+        if digest is None:
+            return None
+        return self._load(digest, prompt)
+
+    def fetch_and_analyze(self, urls, prompt):
+        """
+        Download and analyse the images behind several URLs.
+
+        URLs seen before whose result is cached are answered without a
+        download; the others are fetched concurrently and analysed once per
+        distinct image.
+
+        Returns:
+        - tuple of (list of str results for the usable images, list of
+          (url, error) for failed downloads)
+        """
+        results = {}
+        pending = []
+        for url in dict.fromkeys(urls):
+            cached = self._known_result(url, prompt)
+            if cached is not None:
+                with self.tracer.span('image_cache', cache_hit=True):
+                    results[url] = cached
+            else:
+                pending.append(url)
+
+        errors = []
+        downloads = self._executor.map(lambda url: fetch_image_from_url(url, self.session), pending)
+        futures = {}
+        for url, (image_bytes, error_or_ext) in zip(pending, downloads):
+            if not image_bytes:
+                errors.append((url, error_or_ext))
+                continue
+            digest = hashlib.sha256(image_bytes).hexdigest()
+            self._remember(url, digest)
+            futures[url] = self._submit(digest, image_bytes, error_or_ext, prompt)
+        for url, future in futures.items():
+            results[url] = future.result()
+        return [results[url] for url in dict.fromkeys(urls) if url in results], errors
@@ -0,0 +1,138 @@
+"""
+Indexed lookup of product image URLs.
+
+pharma_images_dict.json maps pc_item_id to a list of image URLs and is too big
+to parse on every app start. It is converted once into a read-only SQLite file
+keyed by pc_item_id; a lookup then reads a few memory-mapped pages instead of
+the whole dictionary:
+
+    python image_index.py build pharma_images_dict.json pharma_images.db
+"""
+import os
+import json
+import sqlite3
+import argparse
+import tempfile
+import threading
+from itertools import islice
+
+
+# Bytes of the database file SQLite may memory-map
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def build_image_index(json_path, db_path, batch_size=10000):
+    """
+    Convert the image dictionary JSON into an indexed SQLite file.
+
+    The file is written next to db_path and renamed into place, so readers
+    never see a half-built index.
+
+    Parameters:
+    - json_path: str, JSON object mapping pc_item_id to a list of image URLs
+    - db_path: str, output SQLite file
+    - batch_size: int, rows inserted per executemany call
+
+    Returns:
+    - int, number of products indexed
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        images = json.load(f)
+
+    # A name of its own, so processes building the index at the same time do not write over each other
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(db_path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(os.path.abspath(db_path)))
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE product_images (pc_item_id TEXT PRIMARY KEY, urls TEXT NOT NULL) WITHOUT ROWID")
+        items = iter(images.items())
+        while True:
+            rows = [(str(key), json.dumps(urls)) for key, urls in islice(items, batch_size)]
+            if not rows:
+                break
+            conn.executemany("INSERT OR REPLACE INTO product_images VALUES (?, ?)", rows)
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(images)
+
+
+class ImageIndex:
+    def __init__(self, path='pharma_images.db'):
+        """
+        Open an index built by build_image_index, read-only.
+
+        Parameters:
+        - path: str, SQLite file path
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+
+    @classmethod
+    def open(cls, path='pharma_images.db', json_path='pharma_images_dict.json'):
+        """
+        Open the index, building it first when only the JSON file exists or
+        the JSON file is newer.
+
+        Returns:
+        - ImageIndex, or None when neither file exists
+        """
+        if os.path.exists(json_path) and (not os.path.exists(path)
+                                          or os.path.getmtime(json_path) > os.path.getmtime(path)):
+            build_image_index(json_path, path)
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def get(self, pc_item_id, default=None):
+        """
+        Image URLs of a product.
+
+        Returns:
+        - list of str, or default when the product has no images
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT urls FROM product_images WHERE pc_item_id = ?",
+                                     (str(pc_item_id),)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def __contains__(self, pc_item_id):
+        return self.get(pc_item_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM product_images").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the product image index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="convert the image dictionary JSON into an index")
+    build.add_argument("json_path", nargs="?", default="pharma_images_dict.json")
+    build.add_argument("db_path", nargs="?", default="pharma_images.db")
+    get = sub.add_parser("get", help="print the image URLs of a product")
+    get.add_argument("pc_item_id")
+    get.add_argument("--db", default="pharma_images.db")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build_image_index(args.json_path, args.db_path)
+        print(f"Indexed {count} products into {args.db_path}")
+    else:
+        print(json.dumps(ImageIndex(args.db).get(args.pc_item_id, [])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Image preprocessing before Bedrock vision calls.
+
+Phone photos of several megabytes inflate request size, upload time and
+vision token cost. Images are decoded once (JPEG at a reduced scale when
+possible), auto-oriented from EXIF, trimmed of uniform borders, downscaled to
+a maximum edge and re-encoded (JPEG, or PNG when that is smaller for a PNG
+source) under a byte budget. Images that are
+already small, upright and in a supported format are passed through
+untouched.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageOps
+
+
+# Longest edge Claude vision uses without resizing on its side
+DEFAULT_MAX_EDGE = 1568
+
+# Stay under Bedrock's per-image payload limit
+DEFAULT_MAX_BYTES = 3_750_000
+
+# Formats Bedrock accepts as-is, mapped to their media type extension
+SUPPORTED_FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+_EXIF_ORIENTATION = 0x0112
+
+
+def _needs_rotation(image):
+    try:
+        return image.getexif().get(_EXIF_ORIENTATION, 1) != 1
+    except Exception:
+        return False
+
+
+def _trim_borders(image, tolerance=12):
+    """Crop uniform borders (scanner margins, white packshot padding)."""
+    rgb = image.convert('RGB')
+    background = Image.new('RGB', rgb.size, rgb.getpixel((0, 0)))
+    diff = ImageChops.difference(rgb, background).convert('L').point(lambda p: 255 if p > tolerance else 0)
+    bbox = diff.getbbox()
+    if bbox and bbox != (0, 0) + image.size:
+        return image.crop(bbox)
+    return image
+
+
+def _flatten(image):
+    """Convert to RGB, compositing transparency on white."""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def preprocess_image(image_bytes, file_extension=None, max_edge=DEFAULT_MAX_EDGE, quality=85,
+                     max_bytes=DEFAULT_MAX_BYTES, passthrough_bytes=300_000, trim=True):
+    """
+    Prepare an image for a Bedrock vision call.
+
+    Parameters:
+    - image_bytes: bytes, the raw uploaded or fetched image
+    - file_extension: str, extension reported by the upload/URL (fallback only)
+    - max_edge: int, longest edge in pixels after resizing
+    - quality: int, starting JPEG quality
+    - max_bytes: int, byte budget for the encoded image
+    - passthrough_bytes: int, images at most this large that need no
+      rotation or resizing are returned unchanged
+    - trim: bool, crop uniform borders
+
+    Returns:
+    - tuple of (image bytes, file extension for the media type)
+    """
+    try:
+        image = Image.open(BytesIO(image_bytes))
+    except Exception:
+        # Not decodable here; let Bedrock report on the original
+        return image_bytes, file_extension
+
+    image_format = SUPPORTED_FORMATS.get(image.format)
+    original_edge = max(image.size)
+    rotated = _needs_rotation(image)
+    if image_format and len(image_bytes) <= passthrough_bytes and original_edge <= max_edge and not rotated:
+        # Zero-copy path: the header was read, the pixels never decoded
+        return image_bytes, image_format
+
+    if image.format == 'JPEG':
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when that still covers max_edge
+        scale = max_edge / original_edge
+        image.draft('RGB', (int(image.size[0] * scale) + 1, int(image.size[1] * scale) + 1))
+
+    image = ImageOps.exif_transpose(image)
+    if trim:
+        image = _trim_borders(image)
+    image = _flatten(image)
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=3.0)
+
+    for q in (quality, quality - 10, quality - 20, quality - 30):
+        buffer = BytesIO()
+        image.save(buffer, format='JPEG', quality=q, optimize=True, progressive=True)
+        if buffer.tell() <= max_bytes:
+            break
+    encoded, encoded_format = buffer.getvalue(), 'jpeg'
+    if image_format == 'png':
+        # Flat graphics and screenshots often stay smaller as PNG
+        buffer = BytesIO()
+        image.save(buffer, format='PNG', optimize=True)
+        if buffer.tell() < len(encoded):
+            encoded, encoded_format = buffer.getvalue(), 'png'
+
+    if image_format and not rotated and original_edge <= max_edge and len(image_bytes) <= min(len(encoded), max_bytes):
+        # Re-encoding did not help; keep the original
+        return image_bytes, image_format
+    return encoded, encoded_format
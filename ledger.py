@@ -0,0 +1,413 @@
+"""
+Dependency ledger of classified products, and selection of the products a
+banned list change affects.
+
+For every classified product the ledger stores what its verdict rests on:
+- the banned list entries it matched, and those whose every ingredient
+  slot its molecules or their drug classes fill
+- its normalized salts and the molecule names in its product name
+- the sources the model read, with a hash of each text
+- the listing it copied its verdict from, for near-duplicate clusters
+
+When a new version of banned_drug.json arrives, its entries are compared
+with the previous version by sr_no and notification_no. Only the products
+touched by added, removed or edited entries are selected for
+re-classification: those that depended on the old entry, whose salts or
+name fill every ingredient slot of the new one, or whose name is similar
+to either. The rest of the catalog keeps its verdicts.
+
+Usage:
+    python ledger.py diff banned_drug_old.json banned_drug.json
+    python ledger.py select banned_drug_old.json banned_drug.json catalog.jsonl recheck.jsonl
+    python batch.py recheck.jsonl results_recheck.jsonl --no-cache --no-clusters
+"""
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+from rapidfuzz import fuzz, process
+
+from banned_index import normalize_name
+from fdc_matcher import FdcMatcher, MOLECULE_CLASSES, parse_salts, _salt_keys
+from search_cache import query_tokens, _MAX_NAME_WORDS
+
+
+# Name similarity at which a product could match a changed entry; the
+# cascade's banned list tier decides from 60 upwards
+NAME_THRESHOLD = 60
+
+
+def file_version(path):
+    """Content hash identifying a version of the banned list file."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def entry_key(entry):
+    """Identifier of a banned list entry in the ledger."""
+    return str(entry.get("sr_no") if entry.get("sr_no") is not None else normalize_name(entry.get("drug_name")))
+
+
+def _entry_content(entry):
+    notifications = entry.get("notification_no") or []
+    if not isinstance(notifications, list):
+        notifications = [notifications]
+    return normalize_name(entry.get("drug_name")), tuple(str(n).strip() for n in notifications)
+
+
+def diff_banned_lists(old_entries, new_entries):
+    """
+    Compare two versions of the banned list.
+
+    Entries with the same name and notification numbers are unchanged even
+    if they were renumbered. The rest are paired by sr_no: a pair is an
+    edit, an unpaired new entry was added and an unpaired old one removed.
+
+    Parameters:
+    - old_entries: list of dict, previous banned_drugs
+    - new_entries: list of dict, current banned_drugs
+
+    Returns:
+    - dict with added and removed (lists of entries), edited (list of
+      (old, new) pairs) and unchanged (int)
+    """
+    old_by_content = {}
+    for entry in old_entries:
+        old_by_content.setdefault(_entry_content(entry), []).append(entry)
+    unchanged, remaining_new = 0, []
+    for entry in new_entries:
+        same = old_by_content.get(_entry_content(entry))
+        if same:
+            same.pop()
+            unchanged += 1
+        else:
+            remaining_new.append(entry)
+    remaining_old = {entry_key(entry): entry for entries in old_by_content.values() for entry in entries}
+    added, edited = [], []
+    for entry in remaining_new:
+        old = remaining_old.pop(entry_key(entry), None)
+        if old is None:
+            added.append(entry)
+        else:
+            edited.append((old, entry))
+    return {"added": added, "removed": list(remaining_old.values()), "edited": edited, "unchanged": unchanged}
+
+
+def entry_slots(entries):
+    """
+    Ingredient slots of the rules parsed from banned list entries.
+
+    A product falls under a rule only when its terms fill every slot, so
+    "Aceclofenac (SR) + Paracetamol" needs both molecules and a plain
+    paracetamol listing is left alone.
+
+    Returns:
+    - list of list of set of str, the slots of each rule; a slot holds
+      molecule names and "class:..." keys
+    """
+    return [rule["slots"] for rule in FdcMatcher(entries).rules if rule["slots"]]
+
+
+def product_terms(pname, salts):
+    """
+    Keys a changed entry has to name to affect a product.
+
+    The salts with their drug classes, and every run of up to three words of
+    the product name, so a molecule that is new to the list still finds the
+    products named after it.
+
+    Returns:
+    - set of str
+    """
+    terms = set()
+    for salt in parse_salts(salts):
+        terms |= _salt_keys(salt)
+    tokens = query_tokens(pname)
+    for size in range(1, _MAX_NAME_WORDS + 1):
+        for i in range(len(tokens) - size + 1):
+            name = ' '.join(tokens[i:i + size])
+            terms.add(name)
+            terms.update(f"class:{drug_class}" for drug_class in MOLECULE_CLASSES.get(name, ()))
+    return terms
+
+
+def dependencies(record, row, salts=None, match=None, fdc_matcher=None):
+    """
+    Banned list entries and terms a product's verdict depends on.
+
+    Parameters:
+    - record: dict, product record
+    - row: dict, its output row
+    - salts: list of str, salts used for the decision (optional)
+    - match: tuple of (entry, score), its banned list match (optional)
+    - fdc_matcher: FdcMatcher over the banned list in use (optional)
+
+    Returns:
+    - tuple of (set of entry keys, set of terms)
+    """
+    entries = set()
+    if match is not None and match[0] is not None:
+        entries.add(entry_key(match[0]))
+    if fdc_matcher is not None and salts:
+        # Rules that only share one ingredient with the product cannot decide it
+        keys = set().union(*(_salt_keys(salt) for salt in parse_salts(salts)))
+        entries.update(str(rule["sr_no"]) for rule in fdc_matcher.related(salts)
+                       if rule["sr_no"] is not None and all(slot & keys for slot in rule["slots"]))
+    if row.get("cluster_representative") is not None:
+        entries.add(f"listing:{row['cluster_representative']}")
+    return entries, product_terms(record.get('pname', ''), salts)
+
+
+class DependencyLedger:
+    def __init__(self, path='ledger.db', banned_version=None):
+        """
+        Open (or create) the ledger database.
+
+        Parameters:
+        - path: str, SQLite file path
+        - banned_version: str, version of the banned list verdicts are
+          recorded against (see file_version)
+        """
+        self.banned_version = banned_version
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS products (
+                pc_item_id TEXT PRIMARY KEY,
+                pname TEXT NOT NULL,
+                salts TEXT NOT NULL,
+                decided_by TEXT,
+                classification TEXT,
+                sources TEXT NOT NULL,
+                banned_version TEXT,
+                classified_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS product_entries (
+                entry_key TEXT NOT NULL,
+                pc_item_id TEXT NOT NULL,
+                PRIMARY KEY (entry_key, pc_item_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS product_terms (
+                term TEXT NOT NULL,
+                pc_item_id TEXT NOT NULL,
+                PRIMARY KEY (term, pc_item_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS product_sources (
+                url TEXT NOT NULL,
+                pc_item_id TEXT NOT NULL,
+                PRIMARY KEY (url, pc_item_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_product_entries_item ON product_entries(pc_item_id);
+            CREATE INDEX IF NOT EXISTS idx_product_terms_item ON product_terms(pc_item_id);
+            CREATE INDEX IF NOT EXISTS idx_product_sources_item ON product_sources(pc_item_id);
+        """)
+        self._conn.commit()
+
+    def record(self, record, row, salts=None, match=None, fdc_matcher=None):
+        """
+        Store the dependencies of a classified product, replacing earlier ones.
+
+        Rows with an error are not recorded.
+        """
+        if row.get('error'):
+            return
+        item_id = str(record['pc_item_id'])
+        salts = parse_salts(salts)
+        entries, terms = dependencies(record, row, salts, match, fdc_matcher)
+        urls = row.get('sources_analyzed') or []
+        sources = dict(zip(urls, row.get('source_hashes') or [None] * len(urls)))
+        with self._lock:
+            for table in ("product_entries", "product_terms", "product_sources"):
+                self._conn.execute(f"DELETE FROM {table} WHERE pc_item_id = ?", (item_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (item_id, record.get('pname', ''), json.dumps(salts), row.get('source'), row.get('classification'),
+                 json.dumps(sources), self.banned_version, time.time())
+            )
+            self._conn.executemany("INSERT OR IGNORE INTO product_entries VALUES (?, ?)",
+                                   [(key, item_id) for key in entries])
+            self._conn.executemany("INSERT OR IGNORE INTO product_terms VALUES (?, ?)",
+                                   [(term, item_id) for term in terms])
+            self._conn.executemany("INSERT OR IGNORE INTO product_sources VALUES (?, ?)",
+                                   [(url, item_id) for url in sources])
+            self._conn.commit()
+
+    def _ids_where(self, table, column, values):
+        ids = set()
+        values = list(values)
+        with self._lock:
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(values), 500):
+                chunk = values[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                ids.update(item_id for (item_id,) in self._conn.execute(
+                    f"SELECT pc_item_id FROM {table} WHERE {column} IN ({placeholders})", chunk))
+        return ids
+
+    def products_depending_on(self, entry_keys):
+        """Products whose recorded dependencies include any of the entries."""
+        return self._ids_where("product_entries", "entry_key", entry_keys)
+
+    def products_naming(self, terms):
+        """Products whose salts or name mention any of the terms."""
+        return self._ids_where("product_terms", "term", terms)
+
+    def products_covering(self, slots):
+        """Products whose salts or name mention a term of every slot."""
+        ids = None
+        # The rarest slot first keeps the intersections small
+        for slot in sorted(slots, key=len):
+            found = self.products_naming(slot)
+            ids = found if ids is None else ids & found
+            if not ids:
+                return set()
+        return ids or set()
+
+    def products_matching_names(self, names, threshold=NAME_THRESHOLD, chunk_size=50000):
+        """Products whose name is similar to any of the given banned list names."""
+        queries = [normalize_name(name) for name in names if normalize_name(name)]
+        if not queries:
+            return set()
+        ids = set()
+        with self._lock:
+            rows = self._conn.execute("SELECT pc_item_id, pname FROM products").fetchall()
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            scores = process.cdist(queries, [normalize_name(pname) for _, pname in chunk], scorer=fuzz.ratio,
+                                   processor=None, score_cutoff=threshold, workers=-1)
+            for column in scores.max(axis=0).nonzero()[0]:
+                ids.add(chunk[column][0])
+        return ids
+
+    def products_using_sources(self, changed_since):
+        """
+        Products that read a source which changed after they were classified.
+
+        Parameters:
+        - changed_since: dict, url -> time the source's content last changed
+        """
+        ids = set()
+        with self._lock:
+            for url, changed_at in changed_since.items():
+                ids.update(item_id for (item_id,) in self._conn.execute(
+                    "SELECT s.pc_item_id FROM product_sources s JOIN products p ON p.pc_item_id = s.pc_item_id "
+                    "WHERE s.url = ? AND p.classified_at < ?", (url, changed_at)))
+        return ids
+
+    def with_cluster_members(self, ids):
+        """Add the listings that copied their verdict from any of the products, transitively."""
+        selected, frontier = set(ids), set(ids)
+        while frontier:
+            members = self.products_depending_on(f"listing:{item_id}" for item_id in frontier)
+            frontier = members - selected
+            selected |= frontier
+        return selected
+
+    def known(self):
+        """pc_item_id of every product in the ledger."""
+        with self._lock:
+            return {item_id for (item_id,) in self._conn.execute("SELECT pc_item_id FROM products")}
+
+    def affected_by(self, diff):
+        """
+        Products to re-classify after a banned list change.
+
+        Parameters:
+        - diff: dict returned by diff_banned_lists
+
+        Returns:
+        - set of str, pc_item_id values
+        """
+        old_entries = diff["removed"] + [old for old, _ in diff["edited"]]
+        new_entries = diff["added"] + [new for _, new in diff["edited"]]
+        changed = old_entries + new_entries
+        ids = self.products_depending_on(entry_key(entry) for entry in old_entries)
+        for slots in entry_slots(changed):
+            ids |= self.products_covering(slots)
+        ids |= self.products_matching_names(entry.get("drug_name") for entry in changed)
+        return self.with_cluster_members(ids)
+
+    def stats(self):
+        with self._lock:
+            products = self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+            versions = dict(self._conn.execute(
+                "SELECT COALESCE(banned_version, ''), COUNT(*) FROM products GROUP BY banned_version"))
+        return {"products": products, "banned_versions": versions}
+
+    def close(self):
+        self._conn.close()
+
+
+def load_entries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)["banned_drugs"]
+
+
+def summarize_diff(diff):
+    return {
+        "added": [entry_key(entry) for entry in diff["added"]],
+        "removed": [entry_key(entry) for entry in diff["removed"]],
+        "edited": [entry_key(new) for _, new in diff["edited"]],
+        "unchanged": diff["unchanged"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the products a banned list change affects.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    diff_parser = sub.add_parser("diff", help="list added, removed and edited entries")
+    diff_parser.add_argument("old", help="previous banned_drug.json")
+    diff_parser.add_argument("new", help="current banned_drug.json")
+    select = sub.add_parser("select", help="write the catalog records to re-classify")
+    select.add_argument("old", help="previous banned_drug.json")
+    select.add_argument("new", help="current banned_drug.json")
+    select.add_argument("catalog", help="catalog JSONL the products come from")
+    select.add_argument("output", help="JSONL of the records to re-classify")
+    select.add_argument("--ledger", default="ledger.db", help="dependency ledger written by batch.py")
+    select.add_argument("--corpus", help="also select products whose corpus sources changed since they were "
+                                         "classified")
+    select.add_argument("--skip-unknown", action="store_true",
+                        help="leave out catalog records the ledger has no entry for")
+    sub.add_parser("status", help="print ledger counters").add_argument("--ledger", default="ledger.db")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print(json.dumps(DependencyLedger(args.ledger).stats(), indent=2))
+        return
+    diff = diff_banned_lists(load_entries(args.old), load_entries(args.new))
+    if args.command == "diff":
+        print(json.dumps(summarize_diff(diff), indent=2))
+        return
+
+    ledger = DependencyLedger(args.ledger)
+    affected = ledger.affected_by(diff)
+    if args.corpus:
+        from corpus import SourceCorpus
+        changed_since = {url: entry.get('changed_at', 0) for url, entry in SourceCorpus(args.corpus).status().items()}
+        affected |= ledger.with_cluster_members(ledger.products_using_sources(changed_since))
+    known = ledger.known()
+
+    # Imported here: batch pulls in the whole pipeline
+    from batch import iter_records
+    counts = {"selected": 0, "unknown": 0, "unaffected": 0}
+    with open(args.output, 'w', encoding='utf-8') as out:
+        for record in iter_records(args.catalog):
+            item_id = str(record['pc_item_id'])
+            if item_id not in known:
+                counts["unknown"] += 1
+                if args.skip_unknown:
+                    continue
+            elif item_id not in affected:
+                counts["unaffected"] += 1
+                continue
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            counts["selected"] += 1
+    print(json.dumps(dict(summarize_diff(diff), **counts)))
+
+
+if __name__ == "__main__":
+    main()
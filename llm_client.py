@@ -0,0 +1,379 @@
+"""
+One client for every LLM call in the pipeline.
+
+The classifier, the cascade's small model tier and image analysis all send
+Anthropic messages through an LLMClient instead of building Bedrock request
+bodies themselves. Two implementations:
+
+- BedrockClient: a pooled boto3 bedrock-runtime client with a concurrency
+  semaphore and retries with jittered exponential backoff on throttling.
+  It can also record every response to a JSONL file.
+- StubLLMClient: replays recorded responses (or a canned answer) after a
+  configurable latency. It never touches AWS, so throughput can be measured
+  offline.
+
+Both can also stream a response as text deltas (stream), so a caller can act
+on the first tags of the answer, or stop generation, before the model is done.
+
+Raw boto3 clients are still accepted everywhere: as_llm_client wraps them.
+boto3 is only imported once a Bedrock client is created, so the stub and
+library users that never call Bedrock do not pay for it.
+"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+
+
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+
+# Bedrock error codes worth retrying
+RETRYABLE_ERRORS = {
+    'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+    'ModelNotReadyException', 'ModelTimeoutException', 'InternalServerException',
+}
+
+
+def build_messages(content):
+    """Wrap a prompt string or a list of content blocks into a single user message."""
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    return [{"role": "user", "content": content}]
+
+
+def request_key(model_id, messages):
+    """Stable hash of a request, used to match recorded responses."""
+    payload = json.dumps({"model_id": model_id, "messages": messages}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def response_text(response):
+    """Text of the first content block of a messages response."""
+    return response['content'][0]['text']
+
+
+class LLMClient(ABC):
+    def __init__(self, max_concurrency=8):
+        """
+        Parameters:
+        - max_concurrency: int, calls allowed in flight at once across all threads
+        """
+        self.max_concurrency = max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "errors": 0, "wait_ms": 0.0}
+
+    def complete(self, model_id, content, max_tokens=4000, temperature=0):
+        """
+        Send one user message and return the parsed response.
+
+        Parameters:
+        - model_id: str, Bedrock model ID
+        - content: str prompt, or list of Anthropic content blocks (text and images)
+        - max_tokens: int, output token limit
+        - temperature: float, sampling temperature
+
+        Returns:
+        - dict, the Anthropic messages response (content, usage, ...)
+        """
+        messages = build_messages(content)
+        start = time.perf_counter()
+        with self._semaphore:
+            waited = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.stats["calls"] += 1
+                self.stats["wait_ms"] += waited
+            try:
+                return self._complete(model_id, messages, max_tokens, temperature)
+            except Exception:
+                with self._lock:
+                    self.stats["errors"] += 1
+                raise
+
+    def stream(self, model_id, content, max_tokens=4000, temperature=0, usage=None):
+        """
+        Send one user message and yield the response text as it is generated.
+
+        The call holds a concurrency slot until the stream is exhausted or
+        closed. Closing the generator early closes the connection, which stops
+        generation and the output tokens billed for it.
+
+        Parameters:
+        - model_id, content, max_tokens, temperature: as for complete
+        - usage: dict, filled with input_tokens and output_tokens as the
+          response reports them (optional)
+
+        Returns:
+        - generator of str, text deltas
+        """
+        messages = build_messages(content)
+        usage = {} if usage is None else usage
+        start = time.perf_counter()
+        with self._semaphore:
+            waited = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.stats["calls"] += 1
+                self.stats["wait_ms"] += waited
+            try:
+                yield from self._stream(model_id, messages, max_tokens, temperature, usage)
+            except Exception:
+                with self._lock:
+                    self.stats["errors"] += 1
+                raise
+
+    @abstractmethod
+    def _complete(self, model_id, messages, max_tokens, temperature):
+        """Make one call; return the parsed response body."""
+
+    @abstractmethod
+    def _stream(self, model_id, messages, max_tokens, temperature, usage):
+        """Make one streamed call; yield its text deltas and fill usage."""
+
+
+class BedrockClient(LLMClient):
+    def __init__(self, client, max_concurrency=8, max_retries=5, base_delay=0.5, max_delay=20.0, record_path=None):
+        """
+        Wrap a boto3 bedrock-runtime client.
+
+        Parameters:
+        - client: boto3 bedrock-runtime client
+        - max_concurrency: int, calls allowed in flight at once
+        - max_retries: int, retries after a throttled or failed call
+        - base_delay: float, seconds of the first backoff step
+        - max_delay: float, cap on a single backoff in seconds
+        - record_path: str, append every response to this JSONL file for
+          StubLLMClient to replay (optional)
+        """
+        super().__init__(max_concurrency)
+        self.client = client
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.record_path = record_path
+
+    def _complete(self, model_id, messages, max_tokens, temperature):
+        body = self._body(messages, max_tokens, temperature)
+        response = self._with_retries(lambda: self.client.invoke_model(
+            modelId=model_id, body=body, accept='application/json', contentType='application/json'))
+        result = json.loads(response['body'].read())
+        if self.record_path:
+            self._record(model_id, messages, result)
+        return result
+
+    def _stream(self, model_id, messages, max_tokens, temperature, usage):
+        body = self._body(messages, max_tokens, temperature)
+        # Only opening the stream is retried: once text was yielded a retry would repeat it
+        response = self._with_retries(lambda: self.client.invoke_model_with_response_stream(
+            modelId=model_id, body=body, accept='application/json', contentType='application/json'))
+        events = response['body']
+        parts = []
+        try:
+            for event in events:
+                if 'chunk' not in event:
+                    continue
+                data = json.loads(event['chunk']['bytes'])
+                if data['type'] == 'message_start':
+                    usage['input_tokens'] = data['message'].get('usage', {}).get('input_tokens', 0)
+                elif data['type'] == 'message_delta':
+                    usage['output_tokens'] = data.get('usage', {}).get('output_tokens', 0)
+                elif data['type'] == 'content_block_delta' and data['delta'].get('type') == 'text_delta':
+                    parts.append(data['delta']['text'])
+                    yield data['delta']['text']
+        finally:
+            events.close()
+        # Streams closed early are not recorded: replaying them would return a truncated answer
+        if self.record_path:
+            self._record(model_id, messages, {"content": [{"type": "text", "text": "".join(parts)}],
+                                              "usage": dict(usage)})
+
+    @staticmethod
+    def _body(messages, max_tokens, temperature):
+        return json.dumps({
+            "anthropic_version": ANTHROPIC_VERSION,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": messages,
+        })
+
+    def _with_retries(self, call):
+        from botocore.exceptions import ClientError, ConnectionClosedError, EndpointConnectionError, ReadTimeoutError
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call()
+            except (ClientError, ConnectionClosedError, EndpointConnectionError, ReadTimeoutError) as e:
+                code = e.response.get('Error', {}).get('Code') if isinstance(e, ClientError) else 'Connection'
+                if attempt == self.max_retries or (code != 'Connection' and code not in RETRYABLE_ERRORS):
+                    raise
+                with self._lock:
+                    self.stats["retries"] += 1
+                # Full jitter keeps throttled workers from retrying in lockstep
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def _record(self, model_id, messages, result):
+        line = json.dumps({"key": request_key(model_id, messages), "model_id": model_id, "response": result})
+        with self._lock:
+            with open(self.record_path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+
+class StubLLMClient(LLMClient):
+    def __init__(self, recordings=None, latency_ms=0, jitter_ms=0, max_concurrency=8, seed=0, stream_chunk_chars=16):
+        """
+        Answer from recorded responses without calling AWS.
+
+        Requests that were not recorded get a canned answer of the right shape:
+        label details for image prompts, one low-confidence classification per
+        item for classification prompts. The latency of each call is fixed per
+        request so repeated runs behave the same. A streamed answer spreads
+        that latency evenly over its chunks, like a model generating tokens, so
+        a caller that stops early also waits less.
+
+        Parameters:
+        - recordings: str, JSONL file written by BedrockClient(record_path=...) (optional)
+        - latency_ms: float, simulated latency of every call
+        - jitter_ms: float, extra latency up to this much, derived from the request
+        - max_concurrency: int, calls allowed in flight at once
+        - seed: int, changes the per-request jitter
+        - stream_chunk_chars: int, characters per streamed text delta
+        """
+        super().__init__(max_concurrency)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.seed = seed
+        self.stream_chunk_chars = stream_chunk_chars
+        self.responses = {}
+        if recordings:
+            with open(recordings, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses[entry["key"]] = entry["response"]
+
+    def _delay_ms(self, key):
+        return self.latency_ms + random.Random(f"{self.seed}:{key}").uniform(0, self.jitter_ms)
+
+    def _complete(self, model_id, messages, max_tokens, temperature):
+        key = request_key(model_id, messages)
+        time.sleep(self._delay_ms(key) / 1000)
+        return self._respond(key, messages)
+
+    def _stream(self, model_id, messages, max_tokens, temperature, usage):
+        key = request_key(model_id, messages)
+        response = self._respond(key, messages)
+        text = response_text(response)
+        usage['input_tokens'] = response.get('usage', {}).get('input_tokens', 0)
+        chunks = [text[i:i + self.stream_chunk_chars] for i in range(0, len(text), self.stream_chunk_chars)]
+        delay = self._delay_ms(key) / 1000 / max(len(chunks), 1)
+        for chunk in chunks:
+            time.sleep(delay)
+            yield chunk
+        usage['output_tokens'] = response.get('usage', {}).get('output_tokens', 0)
+
+    def _respond(self, key, messages):
+        if key in self.responses:
+            return self.responses[key]
+        text = "".join(block.get("text", "") for block in messages[0]["content"])
+        has_image = any(block.get("type") == "image" for block in messages[0]["content"])
+        answer = canned_answer(text, has_image)
+        return {
+            "content": [{"type": "text", "text": answer}],
+            "usage": {"input_tokens": len(text) // 4, "output_tokens": len(answer) // 4},
+            "stub": True,
+        }
+
+
+def canned_answer(prompt, has_image=False):
+    """Placeholder answer with the structure the pipeline parses."""
+    if has_image:
+        return json.dumps({"Product Name": "NA", "Salt Composition": "NA", "Dosage Strength": "NA",
+                           "Formulation Type": "NA", "Quantity": "NA", "Prescription Status": "NA",
+                           "Manufacturer": "NA"})
+    output = """<classification> Not Banned </classification>
+<detailed_classification> PRESCRIPTION-BASED DRUG (Not Banned) </detailed_classification>
+<confidence_level> LOW </confidence_level>
+<justification> Stub response </justification>
+<alternative_status> NA </alternative_status>
+<relevant_regulations> NA </relevant_regulations>"""
+    # One block per item of a batched classification prompt
+    item_ids = list(dict.fromkeys(re.findall(r'<item id="([^"]+)">', prompt)))
+    if item_ids:
+        return "\n".join(f'<output item_id="{item_id}">\n{output}\n</output>' for item_id in item_ids)
+    return f"<output>\n{output}\n</output>"
+
+
+def create_bedrock_client(credentials_path='access_key.json', region_name='us-east-1', max_pool_connections=10):
+    """
+    Create a Bedrock runtime client.
+
+    Parameters:
+    - credentials_path: str, JSON file with Access_key_ID and Secret_access_key.
+      If the file does not exist the default boto3 credential chain is used.
+    - region_name: str, AWS region where Bedrock is available
+    - max_pool_connections: int, HTTP connections kept open to Bedrock
+
+    Returns:
+    - boto3 bedrock-runtime client
+    """
+    import boto3
+    from botocore.config import Config
+
+    # Retries are done by BedrockClient, with jitter shared across threads
+    config = Config(max_pool_connections=max_pool_connections, retries={"total_max_attempts": 1})
+    if credentials_path and os.path.exists(credentials_path):
+        with open(credentials_path, 'r') as f:
+            credentials = json.load(f)
+        return boto3.client(
+            "bedrock-runtime",
+            region_name=region_name,
+            aws_access_key_id=credentials['Access_key_ID'],
+            aws_secret_access_key=credentials['Secret_access_key'],
+            config=config
+        )
+    return boto3.client("bedrock-runtime", region_name=region_name, config=config)
+
+
+def create_llm_client(credentials_path='access_key.json', region_name='us-east-1', max_concurrency=8, stub=None,
+                      stub_latency_ms=0, record_path=None):
+    """
+    Create the LLM client for a run.
+
+    Parameters:
+    - credentials_path: str, AWS credentials JSON (see create_bedrock_client)
+    - region_name: str, AWS region where Bedrock is available
+    - max_concurrency: int, LLM calls allowed in flight at once
+    - stub: str, replay this recordings file instead of calling Bedrock; ""
+      answers every call with canned responses (optional)
+    - stub_latency_ms: float, simulated latency of stubbed calls
+    - record_path: str, record Bedrock responses to this JSONL file (optional)
+
+    Returns:
+    - LLMClient
+    """
+    if stub is not None:
+        return StubLLMClient(stub or None, latency_ms=stub_latency_ms, max_concurrency=max_concurrency)
+    client = create_bedrock_client(credentials_path, region_name, max_pool_connections=max_concurrency)
+    return BedrockClient(client, max_concurrency=max_concurrency, record_path=record_path)
+
+
+_wrapped = {}
+_wrapped_lock = threading.Lock()
+
+
+def as_llm_client(client):
+    """
+    Return client as an LLMClient, wrapping a raw boto3 client once.
+
+    The wrapper is reused for the same boto3 client so its semaphore is shared.
+    """
+    if isinstance(client, LLMClient):
+        return client
+    with _wrapped_lock:
+        wrapped = _wrapped.get(id(client))
+        if wrapped is None or wrapped.client is not client:
+            wrapped = _wrapped[id(client)] = BedrockClient(client)
+        return wrapped
@@ -1,25 +1,153 @@
 import os
+import sys
+import hashlib
 import requests
 import random
-import json
-import boto3
 from urllib.parse import quote_plus
-from bs4 import BeautifulSoup
 import time
-from multiprocessing import Pool, cpu_count
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from requests.exceptions import SSLError
-import streamlit as st
+
+from extractors import get_extractor, is_html_content_type
+from fetcher import get_default_fetcher, read_capped, ByteMeter, DEFAULT_MAX_BYTES
+from llm_client import as_llm_client, response_text
+from rate_limit import get_default_limiter
+from retrieval import select_passages, source_window, estimate_tokens
+from search_cache import normalize_query, molecule_vocabulary
+from searcher import SearchOrchestrator, url_key
+from tracing import get_default_tracer
+
+
+# Definitions and decision rules shared by the single and batched prompts
+CLASSIFICATION_GUIDELINES = """    DEFINITIONS:
+    - BANNED: The drug is completely illegal for all uses (medical, commercial, or otherwise) and cannot be legally manufactured, sold, prescribed, or possessed in India.
+    - CONTROLLED DRUG (Not Banned): The drug is regulated, meaning it has restrictions on its usage/dosage but is not entirely prohibited.
+    - PRESCRIPTION-BASED DRUG: The drug is legal but only available with a valid prescription.
+    - OPEN FOR SALE (Not Banned): The drug is legally available for purchase without restrictions.
+    
+    ANALYSIS INSTRUCTIONS:
+    1. Carefully review all provided source contents.
+    2. Look for explicit mentions of the drug being banned, prohibited, or withdrawn in India.
+    3. Consider alternative names or formulations of the drug.
+    4. Note the recency and reliability of the information.
+    5. Identify if the drug appears on any official banned substance lists in India.
+    6. If a drug is classified as illegal under acts like the NDPS Act or has strict penalties for possession, it must be classified as "BANNED."
+    7. If a drug is allowed for specific medical purposes under regulation, classify it as "CONTROLLED DRUG (Not Banned)."
+    8. Do not assume a drug is banned unless there is explicit evidence.
+    
+    CLASSIFICATION DECISION:
+    Based on the evidence, provide:
+    1. Classification: "BANNED" or "CONTROLLED DRUG (Not Banned)" or "PRESCRIPTION-BASED DRUG (Not Banned)" or "OPEN FOR SALE (Not Banned)"
+    2. Confidence level: LOW, MEDIUM, or HIGH
+    3. Justification: Key evidence supporting your classification (cite specific sources)
+    4. Alternative status: If not banned, specify if it's restricted, prescription-only, or over-the-counter
+    5. Relevant regulations: Mention any specific Indian regulatory acts or notifications.
+    
+    INSTRUCTIONS:
+    1. Strictly use the specified classification categories only.
+    2. If a drug is declared completely illegal (e.g., per NDPS Act), classify it as "BANNED."
+    3. Only give classification as '"BANNED" or "CONTROLLED DRUG (Not Banned)" or "PRESCRIPTION-BASED DRUG" or "OPEN FOR SALE (Not Banned)"' not include classification analysis in the result.
+
+"""
+
+# Search engines queried by search_for_sources, with the host their requests go to;
+# each is a search_<name> method
+SEARCH_ENGINES = {
+    'bing': 'www.bing.com',
+    'duckduckgo': 'html.duckduckgo.com',
+}
+
+# Output tokens reserved per product in a batched call, and the model's output ceiling
+BATCH_OUTPUT_TOKENS_PER_ITEM = 1000
+MAX_OUTPUT_TOKENS = 8192
+
+# Tags of the answer that make up the verdict; the prompts ask for them before the justification
+VERDICT_TAGS = ('classification', 'detailed_classification', 'confidence_level')
+
+
+def plan_batches(item_tokens, token_budget, max_batch_size, overhead_tokens=0):
+    """
+    Group items into batches whose estimated prompt fits the token budget.
+
+    Items are packed greedily in order; an item larger than the budget on its
+    own still gets a batch of one.
+
+    Parameters:
+    - item_tokens: list of int, estimated prompt tokens of each item
+    - token_budget: int, prompt tokens allowed per batch
+    - max_batch_size: int, items allowed per batch
+    - overhead_tokens: int, tokens of the shared instructions sent with every batch
+
+    Returns:
+    - list of list of int, item indices per batch
+    """
+    batches, current, used = [], [], overhead_tokens
+    for i, tokens in enumerate(item_tokens):
+        if current and (used + tokens > token_budget or len(current) >= max_batch_size):
+            batches.append(current)
+            current, used = [], overhead_tokens
+        current.append(i)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
 
 
 class DrugBanClassifier:
-    def __init__(self, region_name='us-east-1'):
+    def __init__(self, region_name='us-east-1', cache=None, fetcher=None, min_sources=6, corpus=None,
+                 passage_token_budget=6000, passage_top_k=12, tracer=None, limiter=None, search_cache=None,
+                 shared_sources_ttl=900, max_shared_sources=32, max_source_words=2000, streaming=False,
+                 verdict_only=False, search_deadlines=None):
         """
         Initialize the DrugBanClassifier with AWS Bedrock for Claude 3.5 Sonnet.
         Designed to work in a SageMaker environment with built-in credentials.
 
         Parameters:
         - region_name: str, AWS region where Bedrock is available (optional)
+        - cache: ClassificationCache, reuses earlier results for the same drug (optional)
+        - fetcher: SourceFetcher, shared fetch engine (optional, process default otherwise)
+        - min_sources: int, good sources after which the remaining fetches are cancelled
+        - corpus: SourceCorpus, offline copy of the reliable sources (optional)
+        - passage_token_budget: int, approximate prompt tokens spent on source passages
+        - passage_top_k: int, maximum number of source passages in the prompt
+        - tracer: Tracer, records per-stage spans (optional, process default otherwise)
+        - limiter: HostLimiter, paces search engine requests and skips engines
+          whose circuit is open (optional, process default otherwise)
+        - search_cache: SearchCache, reuses the URLs found for a normalized query (optional)
+        - shared_sources_ttl: int, seconds the fetched pages of a query are
+          shared with later products normalizing to the same query
+        - max_shared_sources: int, queries whose fetched pages are kept in memory
+        - max_source_words: int, words of each source kept for the prompt
+          builder; the rest of the page is dropped as soon as it is extracted
+        - streaming: bool, stream the analysis response instead of waiting for
+          the whole answer, recording time to first token and to the verdict
+        - verdict_only: bool, stream and stop generation once the verdict tags
+          are closed; the justification and later tags are left out of the result
+        - search_deadlines: dict, search engine -> seconds its results are
+          waited for (searcher.DEFAULT_DEADLINES otherwise)
         """
+        self.streaming = streaming or verdict_only
+        self.verdict_only = verdict_only
+        self.max_source_words = max_source_words
+        self.search_cache = search_cache
+        self.shared_sources_ttl = shared_sources_ttl
+        self.max_shared_sources = max_shared_sources
+        self._shared_sources = OrderedDict()
+        self._shared_lock = threading.Lock()
+        self.tracer = tracer or get_default_tracer()
+        self.limiter = limiter or get_default_limiter()
+        self.searcher = SearchOrchestrator({engine: getattr(self, f'search_{engine}') for engine in SEARCH_ENGINES},
+                                           deadlines=search_deadlines, limiter=self.limiter, tracer=self.tracer)
+        self.corpus = corpus
+        self.passage_token_budget = passage_token_budget
+        self.passage_top_k = passage_top_k
+        self.cache = cache
+        self.fetcher = fetcher or get_default_fetcher()
+        self.min_sources = min_sources
+
         # Model ID for Claude 3.5 Sonnet
         self.model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"
         
@@ -46,13 +174,14 @@ class DrugBanClassifier:
             "https://www.ncbi.nlm.nih.gov/pmc/articles/PMC3401704/"
         ]
     
-    def search_duckduckgo(self, query, num_results=10):
+    def search_duckduckgo(self, query, num_results=10, timeout=20):
         """
         Perform a search using DuckDuckGo for the given query.
 
         Parameters:
         - query: str, the search query
         - num_results: int, number of results to return
+        - timeout: float, seconds allowed for the rate limiter and the request
 
         Returns:
         - list of search result URLs
@@ -61,9 +190,17 @@ class DrugBanClassifier:
         encoded_query = quote_plus(enhanced_query)
         search_url = f"https://html.duckduckgo.com/html/?q={encoded_query}"
         
+        start = time.monotonic()
+        if not self.limiter.acquire(search_url, timeout=min(10, timeout)):
+            return []
         headers = {'User-Agent': random.choice(self.user_agents)}
-        response = requests.get(search_url, headers=headers)
+        try:
+            response = requests.get(search_url, headers=headers, timeout=max(0.1, timeout - (time.monotonic() - start)))
+        except requests.exceptions.RequestException:
+            self.limiter.record(search_url, False)
+            return []
         
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(response.text, 'html.parser')
         urls = []
         results = soup.find_all('a', class_='result__url')
@@ -85,15 +222,18 @@ class DrugBanClassifier:
                 if href and 'duckduckgo.com' not in href:
                     urls.append(href)
         
+        # CAPTCHA and rate limit pages come back without results
+        self.limiter.record(search_url, response.ok and bool(urls))
         return urls
     
-    def search_bing(self, query, num_results=10):
+    def search_bing(self, query, num_results=10, timeout=20):
         """
         Alternative method to search using Bing.
 
         Parameters:
         - query: str, the search query
         - num_results: int, number of results to return
+        - timeout: float, seconds allowed for the rate limiter and the request
 
         Returns:
         - list of search result URLs
@@ -102,6 +242,9 @@ class DrugBanClassifier:
             enhanced_query = f'"{query}" banned drugs in "India"'
             encoded_query = quote_plus(enhanced_query)
             search_url = f"https://www.bing.com/search?q={encoded_query}"
+            start = time.monotonic()
+            if not self.limiter.acquire(search_url, timeout=min(10, timeout)):
+                return []
             
             headers = {
                 'User-Agent': random.choice(self.user_agents),
@@ -113,7 +256,9 @@ class DrugBanClassifier:
                 'Upgrade-Insecure-Requests': '1',
             }
             
-            response = requests.get(search_url, headers=headers, timeout=20)
+            response = requests.get(search_url, headers=headers,
+                                    timeout=max(0.1, timeout - (time.monotonic() - start)))
+            from bs4 import BeautifulSoup
             soup = BeautifulSoup(response.text, 'html.parser')
             
             urls = []
@@ -127,14 +272,16 @@ class DrugBanClassifier:
                     if href not in urls:
                         urls.append(href)
             
+            self.limiter.record(search_url, response.ok and bool(urls))
             return urls
         except Exception as e:
             # print(f"Error in Bing search: {str(e)}")
+            self.limiter.record(search_url, False)
             return []
     
     def search_for_sources(self, query, num_results=10):
         """
-        Try multiple search engines to get the best results.
+        Query the search engines concurrently and merge their results.
 
         Parameters:
         - query: str, the search query
@@ -143,7 +290,19 @@ class DrugBanClassifier:
         Returns:
         - list of search result URLs
         """
-        urls = self.search_bing(query, num_results)
+        if self.search_cache is not None:
+            with self.tracer.span('search_cache') as span:
+                cached = self.search_cache.get(query)
+                span.set(cache_hit=cached is not None)
+            if cached is not None:
+                return cached[:num_results]
+
+        # Every engine at once; the stragglers are dropped once half the URLs are in
+        urls = self.searcher.search(query, num_results, min_results=num_results // 2, hosts=SEARCH_ENGINES)
+
+        # Only real search results are cached, not the backup list below
+        if self.search_cache is not None and len(urls) >= num_results // 2:
+            self.search_cache.put(query, urls[:num_results])
         
         if len(urls) < num_results // 2:
             enhanced_query = f"{query} banned drugs in India"
@@ -154,56 +313,101 @@ class DrugBanClassifier:
                 "https://www.medindia.net/doctors/drug_information/home.asp",
                 "https://www.mohfw.gov.in/"
             ]
+            seen = {url_key(url) for url in urls}
             for url in backup_urls:
-                if url not in urls:
+                if url_key(url) not in seen:
                     urls.append(url)
         
         return urls[:num_results]
 
     @staticmethod
-    def fetch_webpage_content(url, user_agents):
+    def extract_text(html, backend='auto'):
+        """
+        Extract the readable text of an HTML page.
+
+        Parameters:
+        - html: bytes or str, the page markup
+        - backend: str, extractor backend ('auto', 'lxml', 'selectolax' or 'bs4')
+
+        Returns:
+        - str, the extracted text content
+        """
+        return get_extractor(backend)(html)
+
+    @staticmethod
+    def fetch_webpage_content(url, user_agents, session=None, timeout=15, max_bytes=DEFAULT_MAX_BYTES,
+                              backend='auto', window=None, meter=None, raise_errors=False):
         """
         Fetch and parse the content of a webpage.
         
         Parameters:
         - url: str, the URL to fetch
         - user_agents: list, user agents for rotation
+        - session: requests.Session, reuses pooled connections (optional)
+        - timeout: float, request timeout in seconds
+        - max_bytes: int, stop reading the body after this many bytes
+        - backend: str, extractor backend passed to extract_text
+        - window: callable(text) returning the part of the text to keep, applied
+          before the raw page is released (optional)
+        - meter: ByteMeter, accounts the raw page while it is held and the kept text (optional)
+        - raise_errors: bool, raise request errors and HTTP error statuses
+          instead of returning "", so the caller can tell a failing host from
+          a page without text
         
         Returns:
-        - str, the extracted text content
+        - str, the extracted text content ("" for non-HTML pages such as PDFs)
         """
         try:
             headers = {'User-Agent': random.choice(user_agents)}
-            response = requests.get(url, headers=headers, timeout=15)
-            response.encoding = 'utf-8'  # Set encoding to handle decoding issues
-            soup = BeautifulSoup(response.content, 'html.parser')
-            for element in soup(["script", "style", "header", "footer", "nav", "aside"]):
-                element.extract()
-            main_content = soup.find(['main', 'article', 'div', 'body'])
-            text_content = main_content.get_text(separator=' ', strip=True) if main_content else soup.get_text(separator=' ', strip=True)
-            lines = [line.strip() for line in text_content.splitlines() if line.strip()]
-            return ' '.join(lines)
+            with (session or requests).get(url, headers=headers, timeout=timeout, stream=True) as response:
+                if raise_errors:
+                    response.raise_for_status()
+                # PDFs, images and other binaries carry no extractable HTML
+                if not is_html_content_type(response.headers.get('Content-Type')):
+                    return ""
+                content = read_capped(response, max_bytes)
+            raw_size = len(content)
+            if meter is not None:
+                meter.add(raw_size)
+            try:
+                text = DrugBanClassifier.extract_text(content, backend)
+                # Drop the raw page before the window is computed
+                del content
+                if window is not None:
+                    text = window(text)
+            finally:
+                if meter is not None:
+                    meter.release(raw_size)
+            if meter is not None:
+                meter.add(len(text))
+            return text
         except SSLError as e:
             # print(f"SSL error for {url}: {e}")
+            if raise_errors:
+                raise
             return ""  # Return empty string on SSL error
+        except requests.RequestException:
+            if raise_errors:
+                raise
+            return ""
         except Exception as e:
             # print(f"Error fetching content from {url}: {e}")
             return ""
 
-    def analyze_sources(self,bedrock, drug_info, source_contents,additonal_info):
+    def analyze_sources(self,bedrock, drug_info, source_contents,additonal_info, on_text=None):
         """
         Analyze the sources to determine if the drug is banned in India.
 
         Parameters:
         - drug_info: str, name and/or description of the drug
         - source_contents: list of str, text content from each source
+        - on_text: callable, called with every text delta as the answer is
+          streamed (optional, streams the call)
 
         Returns:
         - str, classification results
         """
-        formatted_sources = "\n\n---SOURCE---\n\n".join(
-            [f"Source {i+1}:\n{content[:3000]}" for i, content in enumerate(source_contents) if content]
-        )
+        formatted_sources = self.format_sources(drug_info, source_contents)
         
         prompt = f"""You are a pharmaceutical regulatory expert specialized in Indian drug regulations
 
@@ -219,36 +423,7 @@ class DrugBanClassifier:
         SOURCE CONTENTS:
         {formatted_sources}
       
-    DEFINITIONS:
-    - BANNED: The drug is completely illegal for all uses (medical, commercial, or otherwise) and cannot be legally manufactured, sold, prescribed, or possessed in India.
-    - CONTROLLED DRUG (Not Banned): The drug is regulated, meaning it has restrictions on its usage/dosage but is not entirely prohibited.
-    - PRESCRIPTION-BASED DRUG: The drug is legal but only available with a valid prescription.
-    - OPEN FOR SALE (Not Banned): The drug is legally available for purchase without restrictions.
-    
-    ANALYSIS INSTRUCTIONS:
-    1. Carefully review all provided source contents.
-    2. Look for explicit mentions of the drug being banned, prohibited, or withdrawn in India.
-    3. Consider alternative names or formulations of the drug.
-    4. Note the recency and reliability of the information.
-    5. Identify if the drug appears on any official banned substance lists in India.
-    6. If a drug is classified as illegal under acts like the NDPS Act or has strict penalties for possession, it must be classified as "BANNED."
-    7. If a drug is allowed for specific medical purposes under regulation, classify it as "CONTROLLED DRUG (Not Banned)."
-    8. Do not assume a drug is banned unless there is explicit evidence.
-    
-    CLASSIFICATION DECISION:
-    Based on the evidence, provide:
-    1. Classification: "BANNED" or "CONTROLLED DRUG (Not Banned)" or "PRESCRIPTION-BASED DRUG (Not Banned)" or "OPEN FOR SALE (Not Banned)"
-    2. Confidence level: LOW, MEDIUM, or HIGH
-    3. Justification: Key evidence supporting your classification (cite specific sources)
-    4. Alternative status: If not banned, specify if it's restricted, prescription-only, or over-the-counter
-    5. Relevant regulations: Mention any specific Indian regulatory acts or notifications.
-    
-    INSTRUCTIONS:
-    1. Strictly use the specified classification categories only.
-    2. If a drug is declared completely illegal (e.g., per NDPS Act), classify it as "BANNED."
-    3. Only give classification as '"BANNED" or "CONTROLLED DRUG (Not Banned)" or "PRESCRIPTION-BASED DRUG" or "OPEN FOR SALE (Not Banned)"' not include classification analysis in the result.
-
-    OUTPUT STRUCTURE:
+{CLASSIFICATION_GUIDELINES}    OUTPUT STRUCTURE:
     <output>
     <classification> Banned or Not Banned </classification>
     <detailed_classification> "BANNED" or "CONTROLLED DRUG (Not Banned)" or "PRESCRIPTION-BASED DRUG (Not Banned)" or "OPEN FOR SALE (Not Banned)"</detailed_classification>
@@ -258,36 +433,131 @@ class DrugBanClassifier:
     <relevant_regulations> Mention any specific Indian regulatory acts or notifications. </relevant_regulations>
         """
         
-        response = bedrock.invoke_model(
-            modelId=self.model_id,
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 4000,
-                "temperature": 0,
-                "messages": [{"role": "user", "content": prompt}]
-            })
+        return self._invoke(bedrock, prompt, on_text=on_text)
+
+    def format_sources(self, drug_info, source_contents):
+        """Keep only the passages relevant to the drug, within the token budget."""
+        passages = select_passages(source_contents, drug_info, token_budget=self.passage_token_budget,
+                                   top_k=self.passage_top_k)
+        return "\n\n---SOURCE---\n\n".join(
+            [f"Source {i+1}:\n" + "\n...\n".join(texts) for i, texts in passages]
         )
-        
-        response_body = json.loads(response.get('body').read())
-        return response_body['content'][0]['text']
 
-    def classify_drug(self, bedrock,drug_name_or_description, drug_info):
-        # print(f"Starting classification for: {drug_name_or_description}")
-        
+    def _invoke(self, bedrock, prompt, max_tokens=4000, stage='analyze', on_text=None, stop_at_verdict=None,
+                **span_attrs):
+        if stop_at_verdict is None:
+            stop_at_verdict = self.verdict_only
+        with self.tracer.span(stage, model_id=self.model_id, prompt_chars=len(prompt), **span_attrs) as span:
+            if self.streaming or on_text is not None:
+                text, stats = stream_verdict(as_llm_client(bedrock), self.model_id, prompt, max_tokens=max_tokens,
+                                             stop_at_verdict=stop_at_verdict, on_text=on_text)
+                span.set(**stats)
+                return text
+            response_body = as_llm_client(bedrock).complete(self.model_id, prompt, max_tokens=max_tokens)
+            usage = response_body.get('usage', {})
+            span.set(tokens_in=usage.get('input_tokens', 0), tokens_out=usage.get('output_tokens', 0))
+        return response_text(response_body)
+
+    def _cached_result(self, drug_name_or_description):
+        if self.cache is None:
+            return None
+        with self.tracer.span('cache_lookup') as span:
+            cached = self.cache.get(drug_name_or_description)
+            span.set(cache_hit=cached is not None)
+        if cached is not None:
+            cached["cache_hit"] = True
+        return cached
+
+    def search_query(self, drug_name_or_description):
+        """Normalized search query of a product: its molecules, without strengths, forms or marketing words."""
+        return normalize_query(drug_name_or_description, molecule_vocabulary()) or drug_name_or_description
+
+    def gather_sources(self, drug_name_or_description):
+        """
+        Collect source text for a drug from the corpus, web search and the reliable sources.
+
+        Products whose names normalize to the same search query share one
+        search and one set of fetched pages, including concurrent ones.
+
+        Returns:
+        - tuple of (list of str source contents, list of str successfully fetched URLs)
+        """
+        query = self.search_query(drug_name_or_description)
+        now = time.monotonic()
+        with self._shared_lock:
+            entry = self._shared_sources.get(query)
+            owner = entry is None or entry[0] <= now
+            if owner:
+                entry = self._shared_sources[query] = (now + self.shared_sources_ttl, Future())
+                while len(self._shared_sources) > self.max_shared_sources:
+                    self._shared_sources.popitem(last=False)
+            else:
+                self._shared_sources.move_to_end(query)
+        future = entry[1]
+
+        if not owner:
+            with self.tracer.span('shared_sources'):
+                source_contents, successful_urls = future.result()
+            return list(source_contents), list(successful_urls)
+
+        try:
+            source_contents, successful_urls = self._gather_sources(query)
+        except BaseException as e:
+            future.set_exception(e)
+            self._drop_shared_sources(query, future)
+            raise
+        future.set_result((source_contents, successful_urls))
+        if not successful_urls:
+            # Nothing fetched: let the next product try again
+            self._drop_shared_sources(query, future)
+        return list(source_contents), list(successful_urls)
+
+    def _drop_shared_sources(self, query, future):
+        with self._shared_lock:
+            entry = self._shared_sources.get(query)
+            if entry is not None and entry[1] is future:
+                del self._shared_sources[query]
+
+    def _gather_sources(self, query):
+        # Every source is cut down to its best windows for this query as soon as it is read
+        window = partial(source_window, drug_name=query, max_words=self.max_source_words)
+        meter = ByteMeter()
+
+        # Reliable sources are read from the offline corpus when it has them
+        corpus_sources = {}
+        if self.corpus is not None:
+            with self.tracer.span('corpus') as span:
+                for reliable_source in self.reliable_sources:
+                    text = self.corpus.get(reliable_source)
+                    if text:
+                        corpus_sources[reliable_source] = window(text)
+                        meter.add(len(corpus_sources[reliable_source]))
+                span.set(pages=len(corpus_sources))
+
         # Gather URLs from search and reliable sources
-        urls = self.search_for_sources(drug_name_or_description)
+        with self.tracer.span('search') as span:
+            found = self.search_for_sources(query)
+            span.set(urls=len(found))
+        seen = {url_key(url) for url in corpus_sources}
+        urls = [url for url in found if url_key(url) not in seen]
+        seen.update(url_key(url) for url in urls)
         for reliable_source in self.reliable_sources:
-            if reliable_source not in urls:
+            if url_key(reliable_source) not in seen:
                 urls.append(reliable_source)
         
         # print(f"Found {len(urls)} sources to analyze")
         
-        # Prepare arguments for multiprocessing
-        args = [(url, self.user_agents) for url in urls]
-        
-        # Fetch content using multiprocessing
-        with Pool(processes=cpu_count()) as pool:
-            results = pool.starmap(DrugBanClassifier.fetch_webpage_content, args)
+        # Fetch content concurrently, stopping once enough good sources arrived
+        fetch_fn = partial(DrugBanClassifier.fetch_webpage_content, user_agents=self.user_agents, window=window,
+                           meter=meter, raise_errors=True)
+        with self.tracer.span('fetch', urls=len(urls)) as span:
+            results = self.fetcher.fetch_sources(urls, fetch_fn, min_sources=self.min_sources)
+            # Raw pages in flight plus kept windows, at their highest
+            span.set(pages=sum(1 for content in results if content),
+                     text_bytes=sum(len(content.encode('utf-8')) for content in results),
+                     peak_source_bytes=meter.peak)
+        urls = urls + list(corpus_sources)
+        results = results + list(corpus_sources.values())
         
         # Filter successful fetches (content length > 500)
         source_contents = [content for content in results if content and len(content) > 500]
@@ -320,31 +590,347 @@ class DrugBanClassifier:
             """
             source_contents.append(fallback_info)  # Append fallback info to source_contents
             print("Added fallback information due to insufficient sources")
-        
-        # Analyze the sources
-        result = self.analyze_sources(bedrock,drug_name_or_description, source_contents,drug_info)
-        
-        # Return the corrected dictionary
-        return {
+        return source_contents, successful_urls
+
+    def _result(self, drug_name_or_description, result, source_contents, successful_urls, parsed=None):
+        output = {
             "drug_info": drug_name_or_description,
             "classification_result": result,
             "sources_analyzed": successful_urls,  # List of successfully fetched URLs
+            # Lets the dependency ledger tell when the evidence behind a verdict changed
+            "source_hashes": [hashlib.sha256(content.encode('utf-8')).hexdigest()[:16] for content in source_contents],
             "successful_sources": len(source_contents)
         }
 
+        if self.cache is not None:
+            parsed = parsed or parse_classification_response(result)
+            # Only well-formed verdicts are worth keeping
+            if parsed:
+                self.cache.put(drug_name_or_description, output,
+                               parsed.get('classification'), parsed.get('confidence_level'))
+        return output
+
+    @staticmethod
+    def _shared_banned_list(drug_infos):
+        """The banned list every item carries, sent once per batch instead of once per item."""
+        lists = [info.get('banned_drug_list') if isinstance(info, dict) else None for info in drug_infos]
+        if lists and lists[0] is not None and all(other is lists[0] or other == lists[0] for other in lists[1:]):
+            return lists[0]
+        return None
+
+    def _batch_frame(self, item_count, banned_list=None):
+        """Instructions opening and closing a batched prompt, shared by all its items."""
+        shared_section = ""
+        if banned_list is not None:
+            shared_section = f"""
+        BANNED DRUG LIST (applies to every drug):
+        {banned_list}
+"""
+        header = f"""You are a pharmaceutical regulatory expert specialized in Indian drug regulations
+
+    TASK:
+        Below are {item_count} drugs, each in its own <item> with its own sources. For every item, analyze
+        its sources and determine if that drug is banned in India. Judge each item independently and
+        only cite the sources given inside that item.
+{shared_section}"""
+        footer = f"""      
+{CLASSIFICATION_GUIDELINES}    OUTPUT STRUCTURE:
+    Return one <output> block per item, in the same order as the items, with the item id in the item_id attribute:
+    <output item_id="ITEM ID">
+    <classification> Banned or Not Banned </classification>
+    <detailed_classification> "BANNED" or "CONTROLLED DRUG (Not Banned)" or "PRESCRIPTION-BASED DRUG (Not Banned)" or "OPEN FOR SALE (Not Banned)"</detailed_classification>
+    <confidence_level> LOW, MEDIUM, or HIGH </confidence_level>
+    <justification> Key evidence supporting your classification (cite specific sources) </justification>
+    <alternative_status> If not banned, specify if it's restricted, prescription-only, or over-the-counter </alternative_status>
+    <relevant_regulations> Mention any specific Indian regulatory acts or notifications. </relevant_regulations>
+    </output>
+        """
+        return header, footer
+
+    def _batch_item_section(self, item, banned_list=None):
+        additional_info = item['additional_info']
+        if banned_list is not None:
+            additional_info = {key: value for key, value in additional_info.items() if key != 'banned_drug_list'}
+        if 'formatted_sources' not in item:
+            item['formatted_sources'] = self.format_sources(item['drug_info'], item['source_contents'])
+        return f"""
+        <item id="{item['item_id']}">
+        DRUG INFORMATION:
+        {item['drug_info']}
+
+        ADDITIONAL INFORMATION
+        {additional_info}
+
+        SOURCE CONTENTS:
+        {item['formatted_sources']}
+        </item>
+"""
+
+    def build_batch_prompt(self, items):
+        """
+        Build one prompt classifying several products.
+
+        Parameters:
+        - items: list of dict with item_id, drug_info (name and/or description),
+          additional_info and source_contents
+
+        Returns:
+        - str, the prompt
+        """
+        banned_list = self._shared_banned_list([item['additional_info'] for item in items])
+        header, footer = self._batch_frame(len(items), banned_list)
+        return header + "".join(self._batch_item_section(item, banned_list) for item in items) + footer
+
+    def analyze_sources_batch(self, bedrock, items):
+        """
+        Classify several products with one Bedrock call.
+
+        Parameters:
+        - items: list of dict with item_id, drug_info, additional_info and source_contents
+
+        Returns:
+        - str, classification results with one <output item_id="..."> block per item
+        """
+        prompt = self.build_batch_prompt(items)
+        max_tokens = min(MAX_OUTPUT_TOKENS, BATCH_OUTPUT_TOKENS_PER_ITEM * len(items))
+        # The verdict tags close once per item, so stopping at the first ones would drop every other item
+        return self._invoke(bedrock, prompt, max_tokens=max_tokens, stage='analyze_batch', stop_at_verdict=False,
+                            items=len(items))
+
+    def classify_drugs(self, bedrock, products, batch_token_budget=80000, max_batch_size=8):
+        """
+        Classify several products, packing them into batched Bedrock calls.
+
+        Sources are gathered per product as in classify_drug, for all products
+        at once. Products are then grouped so that each prompt stays within
+        batch_token_budget, and every product whose output is missing or
+        malformed in the batched answer is classified again on its own.
+
+        Parameters:
+        - bedrock: LLMClient (or a boto3 bedrock-runtime client)
+        - products: list of (drug_name_or_description, drug_info)
+        - batch_token_budget: int, approximate prompt tokens per batched call
+        - max_batch_size: int, products per batched call
+
+        Returns:
+        - list of dict, results aligned with `products`, shaped like classify_drug's
+        """
+        max_batch_size = max(1, min(max_batch_size, MAX_OUTPUT_TOKENS // BATCH_OUTPUT_TOKENS_PER_ITEM))
+        results = [None] * len(products)
+        misses = []
+        for i, (drug_name_or_description, _) in enumerate(products):
+            results[i] = self._cached_result(drug_name_or_description)
+            if results[i] is None:
+                misses.append(i)
+
+        # Search and fetch wait on the network, so the products of a group gather their sources side by side
+        trace_id = self.tracer.current_trace_id()
+
+        def gather(i):
+            with self.tracer.trace(trace_id):
+                return self.gather_sources(products[i][0])
+
+        gathered = []
+        if misses:
+            with ThreadPoolExecutor(max_workers=len(misses), thread_name_prefix='gather') as executor:
+                gathered = list(executor.map(gather, misses))
+        pending = [
+            {
+                "index": i,
+                "item_id": str(n),
+                "drug_info": products[i][0],
+                "additional_info": products[i][1],
+                "source_contents": source_contents,
+                "successful_urls": successful_urls,
+            }
+            for n, (i, (source_contents, successful_urls)) in enumerate(zip(misses, gathered), 1)
+        ]
+
+        # The shared instructions and banned list count once per batch, the item sections per item
+        banned_list = self._shared_banned_list([item['additional_info'] for item in pending])
+        overhead_tokens = estimate_tokens("".join(self._batch_frame(max_batch_size, banned_list)))
+        item_tokens = [estimate_tokens(self._batch_item_section(item, banned_list)) for item in pending]
+
+        requeue = []
+        for batch in plan_batches(item_tokens, batch_token_budget, max_batch_size, overhead_tokens):
+            items = [pending[j] for j in batch]
+            if len(items) == 1:
+                requeue.extend(items)
+                continue
+            try:
+                blocks = split_outputs(self.analyze_sources_batch(bedrock, items))
+            except Exception as e:
+                print(f"Batched classification failed, retrying items one by one: {e}", file=sys.stderr)
+                blocks = {}
+            for item in items:
+                block = blocks.get(item['item_id'])
+                parsed = parse_classification_response(block) if block else None
+                if not parsed or not parsed.get('classification'):
+                    requeue.append(item)
+                    continue
+                results[item['index']] = self._result(item['drug_info'], block, item['source_contents'],
+                                                      item['successful_urls'], parsed)
+
+        # Missing or malformed outputs (and batches of one) go through the single-product prompt
+        for item in requeue:
+            result = self.analyze_sources(bedrock, item['drug_info'], item['source_contents'],
+                                          item['additional_info'])
+            results[item['index']] = self._result(item['drug_info'], result, item['source_contents'],
+                                                  item['successful_urls'])
+        return results
+
+    def classify_drug(self, bedrock,drug_name_or_description, drug_info, on_text=None):
+        # print(f"Starting classification for: {drug_name_or_description}")
+
+        cached = self._cached_result(drug_name_or_description)
+        if cached is not None:
+            return cached
+
+        source_contents, successful_urls = self.gather_sources(drug_name_or_description)
+        
+        # Analyze the sources
+        result = self.analyze_sources(bedrock,drug_name_or_description, source_contents,drug_info, on_text=on_text)
+        
+        # Return the corrected dictionary
+        return self._result(drug_name_or_description, result, source_contents, successful_urls)
+
 
 import re
 import xml.etree.ElementTree as ET
 
+
+class VerdictStreamParser:
+    """
+    Pick tags out of an answer while it is still being streamed.
+
+    Every fed chunk is appended to the text seen so far and each wanted tag is
+    reported once, as soon as its closing tag arrives. Scanning resumes at the
+    earliest tag still open, so the text is not rescanned from the start.
+    """
+
+    def __init__(self, tags=VERDICT_TAGS):
+        """
+        Parameters:
+        - tags: sequence of str, tags to report (the verdict tags by default)
+        """
+        self.tags = tuple(tags)
+        self.fields = {}
+        self.text = ''
+        self._pos = 0
+        self._end = 0
+        names = '|'.join(map(re.escape, self.tags))
+        self._open = re.compile(r'<(?:' + names + r')>')
+        self._element = re.compile(r'<(' + names + r')>(.*?)</\1>', re.DOTALL)
+        self._longest_open = max(len(tag) for tag in self.tags) + 2
+
+    def feed(self, chunk):
+        """
+        Add a chunk of the answer.
+
+        Returns:
+        - list of (tag, value) closed by this chunk
+        """
+        self.text += chunk
+        closed = []
+        if self.done:
+            return closed
+        for match in self._element.finditer(self.text, self._pos):
+            self._pos = self._end = match.end()
+            if match.group(1) not in self.fields:
+                self.fields[match.group(1)] = match.group(2).strip()
+                closed.append((match.group(1), self.fields[match.group(1)]))
+        pending = self._open.search(self.text, self._pos)
+        # Without an open tag, only a tag cut in half at the end can still match
+        self._pos = pending.start() if pending else max(self._pos, len(self.text) - self._longest_open)
+        return closed
+
+    @property
+    def done(self):
+        """True once every wanted tag was closed."""
+        return len(self.fields) == len(self.tags)
+
+    def verdict_output(self):
+        """
+        The answer cut right after the last wanted tag and closed again, so
+        parse_classification_response reads it like a full answer whose later
+        tags are missing.
+        """
+        if not self.done or '</output>' in self.text[self._end:]:
+            return self.text
+        return self.text[:self._end] + "\n</output>"
+
+
+def stream_verdict(client, model_id, prompt, max_tokens=4000, stop_at_verdict=True, on_text=None):
+    """
+    Stream a classification answer, optionally stopping once the verdict is in.
+
+    Parameters:
+    - client: LLMClient
+    - model_id: str, Bedrock model ID
+    - prompt: str, classification prompt asking for the verdict tags first
+    - max_tokens: int, output token limit
+    - stop_at_verdict: bool, close the stream once classification,
+      detailed_classification and confidence_level are closed
+    - on_text: callable, called with every text delta (optional)
+
+    Returns:
+    - (str, dict): the answer (cut after the verdict and closed when stopped
+      early) and tokens_in, tokens_out, first_token_ms, verdict_ms, stopped_early
+    """
+    usage = {}
+    parser = VerdictStreamParser()
+    stats = {"first_token_ms": None, "verdict_ms": None, "stopped_early": False}
+    start = time.perf_counter()
+    stream = client.stream(model_id, prompt, max_tokens=max_tokens, usage=usage)
+    try:
+        for chunk in stream:
+            if stats["first_token_ms"] is None:
+                stats["first_token_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            if on_text is not None:
+                on_text(chunk)
+            if parser.feed(chunk) and parser.done:
+                stats["verdict_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                if stop_at_verdict:
+                    stats["stopped_early"] = True
+                    break
+    finally:
+        stream.close()
+    text = parser.verdict_output() if stats["stopped_early"] else parser.text
+    stats["tokens_in"] = usage.get('input_tokens', 0)
+    # A stream closed early never reports its output tokens
+    stats["tokens_out"] = usage.get('output_tokens', estimate_tokens(parser.text))
+    return text, stats
+
+
 def extract_xml(output):
     """Extract the XML portion from the input string."""
-    match = re.search(r'<output>.*?</output>', output, re.DOTALL)
+    match = re.search(r'<output(?:\s[^>]*)?>.*?</output>', output, re.DOTALL)
     if match:
         return match.group(0)
     return None
 
-def parse_classification_response(output):
-    """Parse an XML string and return its contents as a dictionary."""
+def split_outputs(output):
+    """Map each item_id to its <output item_id="..."> block in a batched response (first block wins)."""
+    blocks = {}
+    for match in re.finditer(r'<output\s+item_id\s*=\s*["\']([^"\']+)["\'][^>]*>.*?</output>', output, re.DOTALL):
+        blocks.setdefault(match.group(1).strip(), match.group(0))
+    return blocks
+
+def parse_classification_response(output, item_ids=None):
+    """
+    Parse an XML string and return its contents as a dictionary.
+
+    With item_ids, the output of a batched call is demultiplexed instead and a
+    dict of item_id -> parsed result is returned; items whose block is missing
+    or malformed map to None.
+    """
+    if item_ids is not None:
+        blocks = split_outputs(output)
+        return {
+            item_id: parse_classification_response(blocks[item_id]) if item_id in blocks else None
+            for item_id in item_ids
+        }
+
     # Remove leading/trailing whitespace
     output = output.strip()
     
@@ -376,4 +962,4 @@ def parse_classification_response(output):
         return None
     except ValueError as e:
         print(f"Error: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,273 @@
+"""
+Per-host rate limiting and circuit breaking for search engines and scraped sites.
+
+Every outgoing search or page request first asks the HostLimiter for its host:
+
+- a token bucket spaces requests out so bursts from many workers do not trip
+  CAPTCHA pages or rate limits
+- a circuit breaker opens after repeated failures or empty results and
+  rejects requests to that host until a cool-down has passed, after which a
+  single probe request decides whether it closes again
+- a sliding window of recent outcomes gives each host a success rate, which
+  is used to order search engines so a degraded engine is tried last
+
+Their state is exported in Prometheus text format.
+"""
+import time
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+
+# Search engines get a much lower rate than ordinary sites (requests/s, burst)
+DEFAULT_HOST_LIMITS = {
+    'www.bing.com': (1.0, 3),
+    'html.duckduckgo.com': (0.5, 2),
+}
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+def host_of(url):
+    return urlparse(url).netloc.lower()
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        """
+        Parameters:
+        - rate: float, tokens added per second
+        - burst: int, bucket capacity
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout=None):
+        """
+        Take one token, waiting for it if needed.
+
+        Returns:
+        - bool, False when no token became available within timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        """
+        Parameters:
+        - failure_threshold: int, consecutive failures that open the circuit
+        - reset_timeout: float, seconds the circuit stays open before a probe
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a request may be sent now; in half-open state only one probe is let through."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release_probe(self):
+        """Hand back a half-open probe slot that was never used."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.state = CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class HostLimiter:
+    def __init__(self, rate=5.0, burst=10, host_limits=None, failure_threshold=5, reset_timeout=60, window=50):
+        """
+        Create the limiter shared by every request of the process.
+
+        Parameters:
+        - rate: float, requests per second allowed against a host without its own limit
+        - burst: int, requests a host without its own limit may receive at once
+        - host_limits: dict, host -> (rate, burst) overrides (defaults to DEFAULT_HOST_LIMITS)
+        - failure_threshold: int, consecutive failures or empty results that open a host's circuit
+        - reset_timeout: float, seconds before an open circuit lets a probe through
+        - window: int, recent outcomes kept per host for its success rate
+        """
+        self.rate = rate
+        self.burst = burst
+        self.host_limits = DEFAULT_HOST_LIMITS if host_limits is None else host_limits
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.window = window
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                rate, burst = self.host_limits.get(host, (self.rate, self.burst))
+                state = self._hosts[host] = {
+                    "bucket": TokenBucket(rate, burst),
+                    "breaker": CircuitBreaker(self.failure_threshold, self.reset_timeout),
+                    "outcomes": deque(maxlen=self.window),
+                    "requests": 0,
+                    "rejected": 0,
+                    "throttled_ms": 0.0,
+                }
+            return state
+
+    def acquire(self, url, timeout=None):
+        """
+        Ask permission to send a request to the URL's host.
+
+        Parameters:
+        - url: str, URL about to be requested
+        - timeout: float, seconds to wait for a rate limit token (None waits as long as needed)
+
+        Returns:
+        - bool, False when the host's circuit is open or no token arrived in
+          time; the request must then be skipped
+        """
+        state = self._host(host_of(url))
+        if not state["breaker"].allow():
+            with self._lock:
+                state["rejected"] += 1
+            return False
+        start = time.monotonic()
+        acquired = state["bucket"].acquire(timeout)
+        with self._lock:
+            state["throttled_ms"] += (time.monotonic() - start) * 1000
+            if acquired:
+                state["requests"] += 1
+            else:
+                state["rejected"] += 1
+        if not acquired:
+            state["breaker"].release_probe()
+        return acquired
+
+    def record(self, url, ok):
+        """
+        Report the outcome of a request allowed by acquire.
+
+        Parameters:
+        - url: str, the requested URL
+        - ok: bool, False for errors, blocked pages and empty results
+        """
+        state = self._host(host_of(url))
+        state["breaker"].record(ok)
+        with self._lock:
+            state["outcomes"].append(bool(ok))
+
+    def success_rate(self, url_or_host):
+        """Share of recent requests to the host that succeeded (1.0 when it has no history yet)."""
+        host = host_of(url_or_host) if '/' in url_or_host else url_or_host
+        state = self._host(host)
+        with self._lock:
+            outcomes = list(state["outcomes"])
+        return sum(outcomes) / len(outcomes) if outcomes else 1.0
+
+    def is_open(self, url_or_host):
+        host = host_of(url_or_host) if '/' in url_or_host else url_or_host
+        return self._host(host)["breaker"].state == OPEN
+
+    def snapshot(self):
+        """Return host -> state, success rate, tokens and counters."""
+        with self._lock:
+            hosts = dict(self._hosts)
+        snapshot = {}
+        for host, state in hosts.items():
+            breaker = state["breaker"]
+            with self._lock:
+                outcomes = list(state["outcomes"])
+                counters = {key: state[key] for key in ("requests", "rejected", "throttled_ms")}
+            snapshot[host] = dict(
+                counters,
+                state=breaker.state,
+                consecutive_failures=breaker.failures,
+                times_opened=breaker.times_opened,
+                success_rate=round(sum(outcomes) / len(outcomes), 3) if outcomes else 1.0,
+                tokens=round(state["bucket"].available(), 2),
+            )
+        return snapshot
+
+    def prometheus_text(self, prefix='pharma'):
+        """Render per-host limiter and breaker state in Prometheus text format."""
+        snapshot = self.snapshot()
+        metrics = [
+            ("host_requests_total", "counter", "Requests let through to the host.", "requests"),
+            ("host_rejected_total", "counter", "Requests skipped by the breaker or rate limit.", "rejected"),
+            ("host_throttled_seconds_total", "counter", "Time spent waiting for rate limit tokens.", "throttled_ms"),
+            ("host_circuit_opened_total", "counter", "Times the host's circuit opened.", "times_opened"),
+            ("host_success_rate", "gauge", "Share of recent requests that succeeded.", "success_rate"),
+            ("host_circuit_open", "gauge", "1 while the host's circuit is open.", "state"),
+        ]
+        lines = []
+        for name, kind, help_text, key in metrics:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for host, state in sorted(snapshot.items()):
+                value = state[key]
+                if key == "state":
+                    value = 1 if value == OPEN else 0
+                elif key == "throttled_ms":
+                    value = value / 1000
+                lines.append(f'{prefix}_{name}{{host="{host}"}} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def get_default_limiter():
+    """Return the process-wide HostLimiter, creating it on first use."""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = HostLimiter()
+        return _default_limiter
@@ -0,0 +1,441 @@
+"""
+Queryable history of every classification.
+
+Each result row (from batch.py, the service or the Streamlit app) is appended
+to a local SQLite file: the verdict columns filters run on, plus a JSON
+column with everything else (justification, reason, sources, per-stage
+timings). Indexes cover the usual filters, verdict and confidence over a time
+range, one product's history, or counts per verdict, so queries touch only the
+matching rows. Results are streamed from the database instead of loaded into
+memory.
+
+Usage:
+    python results_store.py query --classification banned --confidence low --since 7d
+    python results_store.py query --pc-item-id 12345 --latest
+    python results_store.py count --classification banned --since 2026-10-01
+    python results_store.py summary --since 30d
+    python results_store.py export banned.csv --classification banned --format csv
+    python results_store.py import results.jsonl
+"""
+import re
+import csv
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+
+COLUMNS = ("id", "classified_at", "run_id", "pc_item_id", "pname", "classification", "detailed_classification",
+           "confidence_level", "decided_by", "matched_drug", "error", "duration_ms")
+
+# Row fields kept in their own column ("source" is stored as decided_by) rather than in details
+ROW_FIELDS = ("pc_item_id", "pname", "source", "matched_drug", "error", "classification", "detailed_classification",
+              "confidence_level")
+
+CONFIDENCE_LEVELS = ("LOW", "MEDIUM", "HIGH")
+
+# Columns summary() may group by
+GROUP_COLUMNS = ("classification", "detailed_classification", "confidence_level", "decided_by", "run_id", "day")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    classified_at REAL NOT NULL,
+    run_id TEXT,
+    pc_item_id TEXT,
+    pname TEXT,
+    classification TEXT,
+    detailed_classification TEXT,
+    confidence_level TEXT,
+    decided_by TEXT,
+    matched_drug TEXT,
+    error TEXT,
+    duration_ms REAL,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_verdict ON results (classification, confidence_level, classified_at);
+CREATE INDEX IF NOT EXISTS idx_results_detailed ON results (detailed_classification, classified_at);
+CREATE INDEX IF NOT EXISTS idx_results_time ON results (classified_at, classification, confidence_level, decided_by);
+CREATE INDEX IF NOT EXISTS idx_results_item ON results (pc_item_id, id);
+CREATE INDEX IF NOT EXISTS idx_results_run ON results (run_id);
+"""
+
+_DURATION_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([smhdw])$')
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_time(value, now=None):
+    """
+    Read a point in time from the command line.
+
+    Parameters:
+    - value: str, a duration back from now ("30m", "12h", "7d", "2w"), an ISO
+      date or datetime ("2026-10-01", "2026-10-01T08:00"), or epoch seconds
+    - now: float, reference time for durations (optional, current time otherwise)
+
+    Returns:
+    - float, epoch seconds
+    """
+    value = str(value).strip().lower()
+    match = _DURATION_RE.match(value)
+    if match:
+        return (time.time() if now is None else now) - float(match.group(1)) * _UNITS[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.upper() if 't' in value else value).timestamp()
+    except ValueError:
+        raise ValueError(f"Unrecognized time {value!r}: use e.g. 7d, 12h or 2026-10-01") from None
+
+
+def normalize_label(value):
+    """Upper-case a classification label without the quotes and spaces the model sometimes adds."""
+    if value is None:
+        return None
+    label = ' '.join(str(value).strip().strip('"\'').upper().split())
+    return label or None
+
+
+def normalize_confidence(value):
+    """LOW, MEDIUM or HIGH, or None for anything else (e.g. a banned list similarity score)."""
+    label = normalize_label(value)
+    return label if label in CONFIDENCE_LEVELS else None
+
+
+class ResultsStore:
+    def __init__(self, path='results.db', flush_every=500):
+        """
+        Open (or create) the results store.
+
+        Parameters:
+        - path: str, SQLite database file
+        - flush_every: int, rows buffered by add before they are written in one
+          transaction; 1 writes every row at once
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._pending = []
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    @staticmethod
+    def to_record(row, run_id=None, classified_at=None, duration_ms=None):
+        """
+        Split an output row into the store's columns.
+
+        Returns:
+        - tuple of column values, in COLUMNS order without id, plus the JSON details
+        """
+        details = {key: value for key, value in row.items() if key not in ROW_FIELDS and key not in COLUMNS}
+        # A confidence that is not a level (the banned list tier's similarity score) is kept as written
+        if row.get("confidence_level") is not None and normalize_confidence(row["confidence_level"]) is None:
+            details["confidence_level_raw"] = row["confidence_level"]
+        if duration_ms is None:
+            duration_ms = row.get("duration_ms") or (row.get("timings_ms") or {}).get("record")
+        return (
+            row.get("classified_at") or classified_at or time.time(),
+            row.get("run_id") or run_id,
+            None if row.get("pc_item_id") is None else str(row["pc_item_id"]),
+            row.get("pname"),
+            normalize_label(row.get("classification")),
+            normalize_label(row.get("detailed_classification")),
+            normalize_confidence(row.get("confidence_level")),
+            row.get("source"),
+            row.get("matched_drug"),
+            row.get("error"),
+            duration_ms,
+            json.dumps(details, default=str) if details else None,
+        )
+
+    def add(self, row, run_id=None, duration_ms=None):
+        """
+        Append an output row; it is written once flush_every rows are buffered.
+
+        Parameters:
+        - row: dict, output row (pc_item_id, pname, classification, ...)
+        - run_id: str, id shared by the rows of one run (optional)
+        - duration_ms: float, time the product took to classify (optional)
+        """
+        record = self.to_record(row, run_id, duration_ms=duration_ms)
+        with self._lock:
+            self._pending.append(record)
+            if len(self._pending) >= self.flush_every:
+                self._flush_locked()
+
+    def add_many(self, rows, run_id=None):
+        """Append several rows in one transaction."""
+        records = [self.to_record(row, run_id) for row in rows]
+        with self._lock:
+            self._pending.extend(records)
+            self._flush_locked()
+        return len(records)
+
+    def flush(self):
+        """Write the buffered rows."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO results (classified_at, run_id, pc_item_id, pname, classification, "
+                "detailed_classification, confidence_level, decided_by, matched_drug, error, duration_ms, details) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+        self._pending = []
+
+    @staticmethod
+    def _where(classification=None, detailed_classification=None, confidence_level=None, decided_by=None,
+               pc_item_id=None, pname=None, run_id=None, since=None, until=None, errors=None, latest=False):
+        clauses, params = [], []
+
+        def match(column, value, normalize=normalize_label):
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            values = [normalize(v) if normalize else v for v in values]
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+
+        if classification is not None:
+            match("classification", classification)
+        if detailed_classification is not None:
+            match("detailed_classification", detailed_classification)
+        if confidence_level is not None:
+            match("confidence_level", confidence_level)
+        if decided_by is not None:
+            match("decided_by", decided_by, normalize=None)
+        if pc_item_id is not None:
+            match("pc_item_id", [str(v) for v in pc_item_id] if isinstance(pc_item_id, (list, tuple, set))
+                  else str(pc_item_id), normalize=None)
+        if run_id is not None:
+            match("run_id", run_id, normalize=None)
+        if pname is not None:
+            clauses.append("pname LIKE ?")
+            params.append(f"%{pname}%")
+        if since is not None:
+            clauses.append("classified_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("classified_at < ?")
+            params.append(until)
+        if errors is not None:
+            clauses.append("error IS NOT NULL" if errors else "error IS NULL")
+        if latest:
+            # Only each product's most recent result
+            clauses.append("NOT EXISTS (SELECT 1 FROM results newer WHERE newer.pc_item_id = results.pc_item_id "
+                           "AND newer.id > results.id)")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _read(self):
+        # Readers get their own connection, so a long export never blocks writers
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def query(self, limit=None, order='desc', **filters):
+        """
+        Stream the results matching the filters.
+
+        Parameters:
+        - limit: int, maximum number of rows (optional)
+        - order: str, 'desc' for newest first, 'asc' for oldest first
+        - filters: classification, detailed_classification, confidence_level,
+          decided_by, pc_item_id, run_id (a value or a list of values; labels
+          are compared case-insensitively), pname (substring), since and until
+          (epoch seconds), errors (True for failed rows only, False to leave
+          them out), latest (True for each product's most recent result only)
+
+        Yields:
+        - dict, the row's columns merged with its details
+        """
+        where, params = self._where(**filters)
+        sql = f"SELECT * FROM results{where} ORDER BY classified_at {'ASC' if order == 'asc' else 'DESC'}, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        self.flush()
+        conn = self._read()
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    result = {key: row[key] for key in COLUMNS}
+                    if row["details"]:
+                        for key, value in json.loads(row["details"]).items():
+                            result.setdefault(key, value)
+                    yield result
+        finally:
+            conn.close()
+
+    def count(self, **filters):
+        """Number of results matching the filters (see query)."""
+        where, params = self._where(**filters)
+        self.flush()
+        conn = self._read()
+        try:
+            return conn.execute(f"SELECT COUNT(*) FROM results{where}", params).fetchone()[0]
+        finally:
+            conn.close()
+
+    def summary(self, group_by=("classification", "confidence_level"), **filters):
+        """
+        Count the results matching the filters per group.
+
+        Parameters:
+        - group_by: sequence of column names from GROUP_COLUMNS ('day' groups by calendar day)
+        - filters: as for query
+
+        Returns:
+        - list of dict, the group's values and its count, largest first
+        """
+        unknown = set(group_by) - set(GROUP_COLUMNS)
+        if unknown:
+            raise ValueError(f"Cannot group by {', '.join(sorted(unknown))}")
+        expressions = ["date(classified_at, 'unixepoch') AS day" if column == 'day' else column
+                       for column in group_by]
+        where, params = self._where(**filters)
+        self.flush()
+        conn = self._read()
+        try:
+            rows = conn.execute(f"SELECT {', '.join(expressions)}, COUNT(*) AS count FROM results{where} "
+                                f"GROUP BY {', '.join(group_by)} ORDER BY count DESC", params).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def export(self, out, fmt='jsonl', **filters):
+        """
+        Write the matching results to a file object, one row at a time.
+
+        Parameters:
+        - out: text file object
+        - fmt: str, 'jsonl' (every field) or 'csv' (the columns plus justification and reason)
+        - filters: as for query, including limit and order
+
+        Returns:
+        - int, rows written
+        """
+        written = 0
+        if fmt == 'csv':
+            fields = list(COLUMNS) + ["justification", "reason"]
+            writer = csv.DictWriter(out, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            for row in self.query(**filters):
+                writer.writerow(row)
+                written += 1
+        elif fmt == 'jsonl':
+            for row in self.query(**filters):
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                written += 1
+        else:
+            raise ValueError(f"Unknown export format {fmt!r}")
+        return written
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+
+def new_run_id():
+    """Id shared by the results of one run."""
+    return uuid.uuid4().hex[:12]
+
+
+def _filters(args):
+    return {
+        "classification": args.classification,
+        "detailed_classification": args.detailed,
+        "confidence_level": args.confidence,
+        "decided_by": args.decided_by,
+        "pc_item_id": args.pc_item_id,
+        "pname": args.pname,
+        "run_id": args.run_id,
+        "since": parse_time(args.since) if args.since else None,
+        "until": parse_time(args.until) if args.until else None,
+        "errors": {"only": True, "none": False}.get(args.errors),
+        "latest": args.latest,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and export stored classification results.")
+    parser.add_argument("--db", default="results.db", help="results database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    filter_parser = argparse.ArgumentParser(add_help=False)
+    filter_parser.add_argument("--classification", nargs="+", help="e.g. banned, 'not banned'")
+    filter_parser.add_argument("--detailed", nargs="+", help="detailed classification, e.g. 'controlled drug (not banned)'")
+    filter_parser.add_argument("--confidence", nargs="+", help="low, medium or high")
+    filter_parser.add_argument("--decided-by", nargs="+", help="deciding tier: banned_list, allowlist, llm, cluster, ...")
+    filter_parser.add_argument("--pc-item-id", nargs="+")
+    filter_parser.add_argument("--pname", help="substring of the product name")
+    filter_parser.add_argument("--run-id", nargs="+")
+    filter_parser.add_argument("--since", help="start time: 7d, 12h, 2026-10-01, ...")
+    filter_parser.add_argument("--until", help="end time, same formats as --since")
+    filter_parser.add_argument("--errors", choices=["only", "none"], help="only failed rows, or no failed rows")
+    filter_parser.add_argument("--latest", action="store_true", help="only each product's most recent result")
+
+    query_parser = commands.add_parser("query", parents=[filter_parser], help="print matching results as JSONL")
+    query_parser.add_argument("--limit", type=int, default=100, help="rows printed at most (0 for all)")
+    query_parser.add_argument("--oldest-first", action="store_true")
+    commands.add_parser("count", parents=[filter_parser], help="count matching results")
+    summary_parser = commands.add_parser("summary", parents=[filter_parser], help="count matching results per group")
+    summary_parser.add_argument("--group-by", nargs="+", default=["classification", "confidence_level"],
+                                choices=GROUP_COLUMNS)
+    export_parser = commands.add_parser("export", parents=[filter_parser], help="write matching results to a file")
+    export_parser.add_argument("output", help="output file ('-' for stdout)")
+    export_parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    import_parser = commands.add_parser("import", help="add the rows of a batch.py results file")
+    import_parser.add_argument("input", help="results JSONL written by batch.py")
+    import_parser.add_argument("--run-id", help="run id for the imported rows (a new one otherwise)")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    try:
+        if args.command == "import":
+            run_id = args.run_id or new_run_id()
+            added, batch = 0, []
+            with open(args.input, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        batch.append(json.loads(line))
+                    if len(batch) >= 5000:
+                        added += store.add_many(batch, run_id)
+                        batch = []
+            added += store.add_many(batch, run_id)
+            print(json.dumps({"imported": added, "run_id": run_id}))
+        elif args.command == "query":
+            for row in store.query(limit=args.limit or None, order='asc' if args.oldest_first else 'desc',
+                                   **_filters(args)):
+                print(json.dumps(row, ensure_ascii=False))
+        elif args.command == "count":
+            print(store.count(**_filters(args)))
+        elif args.command == "summary":
+            for row in store.summary(group_by=args.group_by, **_filters(args)):
+                print(json.dumps(row))
+        elif args.command == "export":
+            if args.output == '-':
+                written = store.export(sys.stdout, args.format, **_filters(args))
+            else:
+                with open(args.output, 'w', encoding='utf-8', newline='') as f:
+                    written = store.export(f, args.format, **_filters(args))
+            print(f"Exported {written} results", file=sys.stderr)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
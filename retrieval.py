@@ -0,0 +1,221 @@
+"""
+In-memory BM25 retrieval over scraped source text.
+
+Each source page is cut into overlapping word windows, the windows are
+indexed with BM25 and only the passages most relevant to the drug are kept
+for the Bedrock prompt, within a token budget. This replaces taking the
+first 3000 characters of every page, which mostly carried boilerplate.
+
+source_window trims each page as soon as it is extracted, streaming over its
+words and keeping only the best windows, so a multi-MB page never has to be
+held while the other sources are fetched.
+"""
+import re
+import heapq
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from classification_cache import drug_signature
+
+
+_TOKEN_RE = re.compile(r'\w+')
+_WORD_RE = re.compile(r'\S+')
+
+# Regulatory vocabulary that marks a passage as relevant evidence
+CONTEXT_TERMS = ("banned", "ban", "prohibited", "withdrawn", "suspended", "notification", "schedule", "ndps")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def chunk_text(text, chunk_words=120, overlap_words=20):
+    """
+    Split text into overlapping windows of words.
+
+    Returns:
+    - list of str, the passages in document order
+    """
+    words = text.split()
+    if len(words) <= chunk_words:
+        return [' '.join(words)] if words else []
+    step = max(chunk_words - overlap_words, 1)
+    return [' '.join(words[start:start + chunk_words]) for start in range(0, len(words) - overlap_words, step)]
+
+
+def iter_chunks(text, chunk_words=120):
+    """
+    Yield consecutive, non-overlapping windows of words.
+
+    Words are read lazily, so the text is never split into one big list.
+    """
+    words = []
+    for match in _WORD_RE.finditer(text):
+        words.append(match.group())
+        if len(words) == chunk_words:
+            yield ' '.join(words)
+            words = []
+    if words:
+        yield ' '.join(words)
+
+
+def source_window(text, drug_name, salts=None, max_words=2000, chunk_words=120, k1=1.5):
+    """
+    Keep only the part of one source that the prompt builder can use.
+
+    Chunks are scored against the drug query as they stream by (saturated
+    term frequency; document frequencies are not known yet at this point) and
+    only the best max_words worth are held. Pages without any match keep
+    their opening chunks.
+
+    Parameters:
+    - text: str, extracted text of one source
+    - drug_name: str, product name or normalized search query
+    - salts: list of str, salt composition if known (optional)
+    - max_words: int, words kept per source
+    - chunk_words: int, words per chunk
+
+    Returns:
+    - str, the kept chunks in document order joined by " ... ", or the text
+      itself when it is short enough
+    """
+    max_chunks = max(max_words // chunk_words, 1)
+    weights = build_query(drug_name, salts)
+    # Min-heap of (score, -position, chunk): ties keep the earlier chunk
+    heap = []
+    count = 0
+    for position, chunk in enumerate(iter_chunks(text, chunk_words)):
+        count += 1
+        tfs = Counter(term for term in tokenize(chunk) if term in weights)
+        score = sum(weights[term] * tf * (k1 + 1) / (tf + k1) for term, tf in tfs.items())
+        item = (score, -position, chunk)
+        if len(heap) < max_chunks:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    if count <= max_chunks:
+        return text
+    return ' ... '.join(chunk for _, _, chunk in sorted(heap, key=lambda item: -item[1]))
+
+
+def estimate_tokens(text):
+    """Rough token count used for budgeting (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+class BM25Index:
+    def __init__(self, passages, k1=1.5, b=0.75):
+        """
+        Index passages for BM25 scoring.
+
+        Parameters:
+        - passages: list of str, the passages to index
+        - k1: float, term frequency saturation
+        - b: float, length normalization
+        """
+        self.k1 = k1
+        self.b = b
+        self.passages = passages
+        doc_tokens = [tokenize(passage) for passage in passages]
+        self._lengths = np.array([len(tokens) for tokens in doc_tokens], dtype=np.float64)
+        self._avg_length = self._lengths.mean() if len(passages) else 0.0
+
+        # term -> (passage ids, term frequencies)
+        postings = defaultdict(lambda: ([], []))
+        for doc_id, tokens in enumerate(doc_tokens):
+            for term, tf in Counter(tokens).items():
+                ids, tfs = postings[term]
+                ids.append(doc_id)
+                tfs.append(tf)
+        self._postings = {
+            term: (np.array(ids, dtype=np.int64), np.array(tfs, dtype=np.float64))
+            for term, (ids, tfs) in postings.items()
+        }
+
+    def scores(self, query_weights):
+        """
+        Score every passage against weighted query terms.
+
+        Parameters:
+        - query_weights: dict, term -> weight
+
+        Returns:
+        - numpy array of BM25 scores, one per passage
+        """
+        n = len(self.passages)
+        scores = np.zeros(n, dtype=np.float64)
+        if not n:
+            return scores
+        norm = self.k1 * (1 - self.b + self.b * self._lengths / (self._avg_length or 1.0))
+        for term, weight in query_weights.items():
+            if term not in self._postings:
+                continue
+            ids, tfs = self._postings[term]
+            idf = np.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += weight * idf * tfs * (self.k1 + 1) / (tfs + norm[ids])
+        return scores
+
+
+def build_query(drug_name, salts=None, context_weight=0.3):
+    """
+    Turn a drug name and its salts into weighted BM25 query terms.
+
+    Drug identity terms get full weight, regulatory context terms a reduced
+    weight so they only break ties between passages about the drug.
+    """
+    weights = {term: context_weight for term in CONTEXT_TERMS}
+    for term in tokenize(drug_signature(drug_name, salts)):
+        weights[term] = 1.0
+    return weights
+
+
+def select_passages(source_contents, drug_name, salts=None, token_budget=6000, top_k=12,
+                    chunk_words=120, overlap_words=20):
+    """
+    Pick the passages most relevant to a drug across all sources.
+
+    Parameters:
+    - source_contents: list of str, extracted text of each source
+    - drug_name: str, product name or description
+    - salts: list of str, salt composition if known (optional)
+    - token_budget: int, approximate prompt tokens the passages may use
+    - top_k: int, maximum number of passages kept
+    - chunk_words: int, words per passage
+    - overlap_words: int, words shared by consecutive passages
+
+    Returns:
+    - list of (source index, list of str) pairs, in source order, holding
+      each source's selected passages in document order
+    """
+    passages, owners = [], []
+    for source_idx, content in enumerate(source_contents):
+        if not content:
+            continue
+        for position, passage in enumerate(chunk_text(content, chunk_words, overlap_words)):
+            passages.append(passage)
+            owners.append((source_idx, position))
+    if not passages:
+        return []
+
+    scores = BM25Index(passages).scores(build_query(drug_name, salts))
+    if scores.max() > 0:
+        ranked = [i for i in np.argsort(-scores, kind='stable') if scores[i] > 0]
+    else:
+        # Nothing matched: fall back to the opening passage of each source
+        ranked = [i for i, (_, position) in enumerate(owners) if position == 0]
+
+    chosen, used = [], 0
+    for i in ranked:
+        if len(chosen) >= top_k:
+            break
+        cost = estimate_tokens(passages[i])
+        if used + cost > token_budget:
+            continue
+        chosen.append(i)
+        used += cost
+
+    by_source = defaultdict(list)
+    for i in sorted(chosen, key=lambda i: owners[i]):
+        by_source[owners[i][0]].append(passages[i])
+    return sorted(by_source.items())
@@ -0,0 +1,151 @@
+"""
+Search query normalization and a persistent cache of search result URLs.
+
+Catalog listings name the same drug in many ways ("Semaglutide Tablets
+3mg 7mg 14mg", "Semaglutide 14mg Tab"). normalize_query strips strengths,
+pack sizes and marketing words and, where it can, reduces the name to the
+molecules it mentions plus its dosage form and release profile, so such
+listings share one search query while a semaglutide injection or an SR
+tablet is still searched for on its own. SearchCache keeps the URLs found
+for each normalized query in a local SQLite file with a TTL and LRU
+eviction.
+"""
+import re
+import json
+from functools import lru_cache
+
+from banned_index import normalize_name
+from classification_cache import FORM_WORDS, VARIANT_WORDS, _STRENGTH_RE, DAY, SqliteLRUCache, variant_words
+
+
+# Words sellers add to listings that say nothing about the drug
+MARKETING_WORDS = {
+    "new", "best", "buy", "online", "original", "genuine", "premium", "quality", "brand", "branded", "imported",
+    "offer", "combo", "free", "delivery", "price", "cheap", "discount", "pharma", "pharmaceutical",
+    "pharmaceuticals", "medicine", "medicines", "generic", "india", "indian", "wholesale", "supplier",
+    "suppliers", "manufacturer", "manufacturers", "exporter", "exporters", "dealer", "trader", "pcs", "pieces",
+    "units", "packs", "packet", "weekly", "daily", "once", "dose", "doses", "kit", "bottles", "tube", "dosage",
+    "formulation", "effective", "fast", "relief", "certified", "export", "use", "used", "treatment", "s",
+}
+
+# Pack sizes such as "10x10", "1 x 15" or "3*10"
+_PACK_RE = re.compile(r'\b\d+\s*[x×*]\s*\d+\b')
+
+# Longest molecule name, in words, looked up in the vocabulary
+_MAX_NAME_WORDS = 3
+
+
+@lru_cache(maxsize=4)
+def molecule_vocabulary(banned_path='banned_drug.json', allowlist_path='known_molecules.json'):
+    """
+    Molecule names known to the pipeline.
+
+    Collected from the drug classes of fdc_matcher, the ingredients of the
+    parsed banned list and the local allowlist.
+
+    Returns:
+    - frozenset of str, normalized molecule names
+    """
+    # Imported here: building the matcher parses the whole banned list
+    from fdc_matcher import FdcMatcher, MOLECULE_CLASSES, normalize_salt
+
+    names = set(MOLECULE_CLASSES)
+    try:
+        for rule in FdcMatcher.from_file(banned_path).rules:
+            names.update(key for slot in rule["slots"] for key in slot if not key.startswith("class:"))
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        with open(allowlist_path, 'r', encoding='utf-8') as f:
+            allowlist = json.load(f)
+        names.update(normalize_salt(name) for group in allowlist.values() for name in group)
+    except (OSError, ValueError, AttributeError):
+        pass
+    # Stray fragments of the parsed list ("w", "v" from "w/v") are not molecules
+    return frozenset(name for name in names if len(name) > 3)
+
+
+def find_molecules(tokens, vocabulary):
+    """
+    Molecule names of the vocabulary that occur in a token list, longest first.
+
+    Parameters:
+    - tokens: list of str, normalized words
+    - vocabulary: set of str, known molecule names
+
+    Returns:
+    - set of str
+    """
+    molecules, i = set(), 0
+    while i < len(tokens):
+        for size in range(min(_MAX_NAME_WORDS, len(tokens) - i), 0, -1):
+            name = ' '.join(tokens[i:i + size])
+            if name in vocabulary:
+                molecules.add(name)
+                i += size
+                break
+        else:
+            i += 1
+    return molecules
+
+
+def query_tokens(text):
+    """Words of a product name left after dropping strengths, pack sizes, forms and marketing words."""
+    stripped = normalize_name(_STRENGTH_RE.sub(' ', _PACK_RE.sub(' ', (text or '').lower())))
+    return [t for t in stripped.split()
+            if t not in FORM_WORDS and t not in VARIANT_WORDS and t not in MARKETING_WORDS and not t.isdigit()]
+
+
+def normalize_query(text, vocabulary=None):
+    """
+    Reduce a product name to the query used for web search.
+
+    Parameters:
+    - text: str, product name or description
+    - vocabulary: set of str, known molecule names; when any of them occur
+      the query is just those molecules (optional)
+
+    Returns:
+    - str, normalized query ("semaglutide tablet", "caffeine paracetamol sr
+      tablet", or the remaining words sorted when no molecule is
+      recognized), followed by the dosage form and release words
+    """
+    tokens = query_tokens(text)
+    # The form stays in the query: bans and sources differ between an SR tablet, a syrup and an injection
+    variant = sorted(variant_words(text))
+    if vocabulary:
+        molecules = find_molecules(tokens, vocabulary)
+        if molecules:
+            return ' '.join(sorted(molecules) + variant)
+    return ' '.join(sorted(set(tokens)) + variant)
+
+
+class SearchCache(SqliteLRUCache):
+    table = "search_results"
+    key_column = "query"
+
+    def __init__(self, path='search_cache.db', ttl=3 * DAY, max_entries=50000):
+        """
+        Open (or create) the cache database.
+
+        Parameters:
+        - path: str, SQLite file path, ':memory:' for a throwaway cache
+        - ttl: int, seconds a URL list stays valid
+        - max_entries: int, size bound enforced by LRU eviction
+        """
+        super().__init__(path, max_entries, "urls TEXT NOT NULL")
+        self.ttl = ttl
+
+    def get(self, query):
+        """
+        Look up the URLs found for a normalized query.
+
+        Returns:
+        - list of str, or None on a miss or expired entry
+        """
+        row = self._lookup(query, "urls")
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, query, urls):
+        """Store the URLs found for a normalized query."""
+        self._store(query, (json.dumps(urls),), self.ttl)
@@ -0,0 +1,179 @@
+"""
+Concurrent web search across several engines.
+
+Every engine is queried at once on a shared thread pool, each under its own
+deadline. Result URLs are unwrapped from engine redirects, stripped of
+tracking parameters and deduplicated by their canonical form; engine, social
+media and other blocklisted hosts are dropped. As soon as enough unique URLs
+are in, the search returns and the engines still running are discarded, so
+a slow or blocked engine no longer sets the latency of the search stage.
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from rate_limit import get_default_limiter
+from tracing import get_default_tracer
+
+
+# Result links pointing here are navigation, ads or pages the extractor cannot read
+DEFAULT_BLOCKLIST = (
+    'bing.com', 'microsoft.com', 'duckduckgo.com', 'google.com', 'youtube.com', 'facebook.com', 'instagram.com',
+    'twitter.com', 'x.com', 'linkedin.com', 'pinterest.com',
+)
+
+# Query parameters that only track the click
+TRACKING_PARAMS = {'gclid', 'fbclid', 'msclkid', 'yclid', 'ref', 'ref_src', 'mc_cid', 'mc_eid'}
+
+# Seconds each engine is given before its results are no longer waited for
+DEFAULT_DEADLINES = {'bing': 8.0, 'duckduckgo': 8.0}
+DEFAULT_DEADLINE = 8.0
+
+
+def canonical_url(url):
+    """
+    Clean a result URL: unwrap engine redirects, lowercase the host, drop the
+    fragment, default ports and tracking parameters.
+
+    Returns:
+    - str, the cleaned URL, or None when it is not an http(s) URL
+    """
+    url = (url or '').strip()
+    if url.startswith('//'):
+        url = 'https:' + url
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    # DuckDuckGo wraps results as //duckduckgo.com/l/?uddg=<target>
+    if parts.netloc.endswith('duckduckgo.com') and parts.path.startswith('/l/'):
+        target = dict(query).get('uddg')
+        return canonical_url(target) if target else None
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+        return None
+    host = parts.netloc.lower()
+    if (parts.scheme, host.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')):
+        host = host.rsplit(':', 1)[0]
+    query = [(key, value) for key, value in query
+             if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS]
+    return urlunsplit((parts.scheme, host, parts.path or '/', urlencode(query), ''))
+
+
+def url_key(url):
+    """Identity of a cleaned URL: the same page over http and https, with or without www, is one key."""
+    parts = urlsplit(url)
+    host = parts.netloc[4:] if parts.netloc.startswith('www.') else parts.netloc
+    query = '&'.join(sorted(parts.query.split('&'))) if parts.query else ''
+    return f"{host}{parts.path.rstrip('/')}?{query}"
+
+
+def is_blocked(url, blocklist=DEFAULT_BLOCKLIST):
+    """True when the URL's host is a blocklisted domain or one of its subdomains."""
+    host = urlsplit(url).netloc.split(':')[0]
+    return any(host == domain or host.endswith('.' + domain) for domain in blocklist)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_default_executor():
+    """Return the process-wide search thread pool, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='search')
+        return _executor
+
+
+class SearchOrchestrator:
+    def __init__(self, engines, deadlines=None, blocklist=DEFAULT_BLOCKLIST, limiter=None, tracer=None,
+                 executor=None):
+        """
+        Create the orchestrator.
+
+        Parameters:
+        - engines: dict, engine name -> callable(query, num_results, timeout=)
+          returning a list of result URLs
+        - deadlines: dict, engine name -> seconds its results are waited for
+          (DEFAULT_DEADLINES otherwise, DEFAULT_DEADLINE for unlisted engines)
+        - blocklist: sequence of str, domains whose URLs are dropped
+        - limiter: HostLimiter, used to skip engines whose circuit is open when
+          another engine is healthy (optional, process default otherwise)
+        - tracer: Tracer, records one span per engine call (optional, process default otherwise)
+        - executor: ThreadPoolExecutor the engines run on (optional, shared pool otherwise)
+        """
+        self.engines = dict(engines)
+        self.deadlines = dict(DEFAULT_DEADLINES if deadlines is None else deadlines)
+        self.blocklist = tuple(blocklist)
+        self.limiter = limiter or get_default_limiter()
+        self.tracer = tracer or get_default_tracer()
+        self.executor = executor or get_default_executor()
+
+    def deadline(self, engine):
+        return self.deadlines.get(engine, DEFAULT_DEADLINE)
+
+    def _run(self, engine, query, num_results, cancelled, trace_id):
+        if cancelled.is_set():
+            return []
+        with self.tracer.trace(trace_id), self.tracer.span(f'search_{engine}') as span:
+            try:
+                found = self.engines[engine](query, num_results, timeout=self.deadline(engine))
+            finally:
+                # The search already returned without this engine
+                span.set(discarded=cancelled.is_set())
+            span.set(urls=len(found))
+        return found
+
+    def search(self, query, num_results=10, min_results=None, hosts=None):
+        """
+        Query every engine concurrently and merge their results.
+
+        Parameters:
+        - query: str, the search query
+        - num_results: int, URLs requested from each engine and returned at most
+        - min_results: int, unique URLs after which the search returns without
+          waiting for the other engines (num_results by default)
+        - hosts: dict, engine name -> host; engines whose circuit is open are
+          skipped while another engine's is closed (optional)
+
+        Returns:
+        - list of str, cleaned unique URLs in the order they arrived
+        """
+        min_results = num_results if min_results is None else min_results
+        engines = list(self.engines)
+        if hosts:
+            healthy = [engine for engine in engines if engine not in hosts or not self.limiter.is_open(hosts[engine])]
+            engines = healthy or engines
+        start = time.monotonic()
+        cancelled = threading.Event()
+        trace_id = self.tracer.current_trace_id()
+        futures = {self.executor.submit(self._run, engine, query, num_results, cancelled, trace_id): engine
+                   for engine in engines}
+        deadlines = {future: start + self.deadline(engine) for future, engine in futures.items()}
+        urls, seen = [], set()
+        pending = set(futures)
+        try:
+            while pending and len(urls) < min_results:
+                # Engines past their deadline are no longer waited for
+                pending = {future for future in pending if deadlines[future] > time.monotonic()}
+                if not pending:
+                    break
+                done, pending = wait(pending, timeout=min(deadlines[future] for future in pending) - time.monotonic(),
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        found = future.result()
+                    except Exception:
+                        found = []
+                    for url in found:
+                        url = canonical_url(url)
+                        if url is None or is_blocked(url, self.blocklist) or url_key(url) in seen:
+                            continue
+                        seen.add(url_key(url))
+                        urls.append(url)
+        finally:
+            # Queued engines never start, running ones finish on their own and are discarded
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+        return urls[:num_results]
@@ -0,0 +1,320 @@
+"""
+Long-running HTTP classification service.
+
+Keeps one LLM client, one DrugBanClassifier (with its pooled fetcher), the
+decision cascade and the image analyzer warm for the life of the process and
+exposes them over plain HTTP:
+
+    POST /classify          one product record -> one result row
+    POST /classify/batch    {"records": [...]} -> {"results": [...]}
+    GET  /health            queue depth and counters
+    GET  /metrics           per-stage latencies in Prometheus text format
+
+Concurrent requests for the same product share one in-flight computation, and
+work is admitted through a bounded queue: when it is full the service answers
+503 with Retry-After instead of piling up threads.
+
+Usage:
+    python service.py --port 8080 --workers 8 --queue-size 64
+"""
+import json
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+import prediction as pred
+from banned_index import BannedDrugIndex
+from batch import classify_record
+from cascade import DecisionCascade, TIERS
+from classification_cache import ClassificationCache
+from corpus import SourceCorpus
+from image_analysis import ImageAnalyzer
+from llm_client import create_llm_client
+from rate_limit import get_default_limiter
+from results_store import ResultsStore
+from search_cache import SearchCache
+from tracing import Tracer
+
+
+# Record fields that determine the result; pc_item_id does not
+COALESCE_FIELDS = ('pname', 'description', 'isq', 'salt_composition', 'image_urls')
+
+
+class ServiceBusy(Exception):
+    """Raised when the work queue has no room for a request."""
+
+
+def coalesce_key(record):
+    """Hash of the fields that decide a record's classification."""
+    fields = {field: record.get(field) for field in COALESCE_FIELDS}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ClassificationService:
+    def __init__(self, bedrock, banned_index, classifier, cascade=None, image_analyzer=None, workers=8,
+                 queue_size=64, tracer=None, results_store=None):
+        """
+        Create the service around warm pipeline components.
+
+        Parameters:
+        - bedrock: LLMClient (or a boto3 bedrock-runtime client)
+        - banned_index: BannedDrugIndex over the banned drug list
+        - classifier: DrugBanClassifier, shared by every request
+        - cascade: DecisionCascade, cheap tiers tried first (optional)
+        - image_analyzer: ImageAnalyzer for records with image_urls (optional)
+        - workers: int, records classified concurrently
+        - queue_size: int, records allowed to wait for a worker before
+          requests are rejected
+        - tracer: Tracer, records per-stage spans (optional)
+        - results_store: ResultsStore, every classified row is added to it (optional)
+        """
+        self.results_store = results_store
+        self.bedrock = bedrock
+        self.banned_index = banned_index
+        self.classifier = classifier
+        self.cascade = cascade
+        self.image_analyzer = image_analyzer
+        self.tracer = tracer or classifier.tracer
+        self.capacity = workers + queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='classify')
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "coalesced": 0, "rejected": 0, "failed": 0}
+
+    def _run(self, record):
+        record = dict(record, pc_item_id=record.get('pc_item_id'))
+        timings = {}
+        with self.tracer.trace(record.get('pc_item_id'), timings=timings):
+            with self.tracer.span('record') as span:
+                row = classify_record(record, self.classifier, self.bedrock, self.banned_index,
+                                      image_analyzer=self.image_analyzer, cascade=self.cascade)
+                span.set(decided_by=row.get('source'))
+        row["timings_ms"] = {stage: round(ms, 1) for stage, ms in timings.items()}
+        if self.results_store is not None:
+            self.results_store.add(row)
+        return row
+
+    def _forget(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def submit(self, records):
+        """
+        Admit records for classification, joining identical ones already in flight.
+
+        All records of a call are admitted together or not at all.
+
+        Returns:
+        - list of (future, coalesced) aligned with `records`
+
+        Raises:
+        - ServiceBusy when the queue cannot take the new records
+        """
+        keys = [coalesce_key(record) for record in records]
+        with self._lock:
+            new_keys = {key for key in keys if key not in self._in_flight}
+            if len(self._in_flight) + len(new_keys) > self.capacity:
+                self.stats["rejected"] += len(records)
+                raise ServiceBusy(f"{len(self._in_flight)} records in flight, capacity {self.capacity}")
+            submitted = []
+            for key, record in zip(keys, records):
+                future = self._in_flight.get(key)
+                coalesced = future is not None
+                if future is None:
+                    future = self._executor.submit(self._run, record)
+                    self._in_flight[key] = future
+                    future.add_done_callback(lambda _, key=key: self._forget(key))
+                submitted.append((future, coalesced))
+            self.stats["requests"] += len(records)
+            self.stats["coalesced"] += sum(1 for _, coalesced in submitted if coalesced)
+        return submitted
+
+    def classify(self, records, timeout=None):
+        """
+        Classify records and wait for the result rows.
+
+        Returns:
+        - list of dict, one row per record; a record whose computation failed
+          or timed out gets a row with an "error"
+        """
+        rows = []
+        for record, (future, coalesced) in zip(records, self.submit(records)):
+            try:
+                row = dict(future.result(timeout=timeout))
+            except FuturesTimeout:
+                row = {"pname": record.get('pname', ''), "error": "Timed out waiting for the classification"}
+            except Exception as e:
+                row = {"pname": record.get('pname', ''), "error": str(e)}
+            if row.get('error'):
+                with self._lock:
+                    self.stats["failed"] += 1
+            # A coalesced result belongs to whichever request asked
+            row["pc_item_id"] = record.get('pc_item_id')
+            row["coalesced"] = coalesced
+            rows.append(row)
+        return rows
+
+    def health(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._in_flight), capacity=self.capacity)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def make_handler(service, request_timeout=120, max_batch=256):
+    """
+    Build the HTTP request handler bound to a ClassificationService.
+
+    Batches are capped at the service's capacity: a larger one could never
+    be admitted and would only ever get 503 and a retry.
+    """
+    max_batch = min(max_batch, service.capacity)
+
+    class ClassifyHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'null')
+
+        def do_GET(self):
+            path = self.path.rstrip('/')
+            if path == '/health':
+                self._send_json(200, service.health())
+            elif path == '/metrics':
+                body = service.tracer.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._send_json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            path = self.path.rstrip('/')
+            if path not in ('/classify', '/classify/batch'):
+                self._send_json(404, {"error": "Not found"})
+                return
+            try:
+                payload = self._read_json()
+            except (ValueError, UnicodeDecodeError):
+                self._send_json(400, {"error": "Body is not valid JSON"})
+                return
+
+            records = payload.get('records') if path == '/classify/batch' and isinstance(payload, dict) else [payload]
+            if not isinstance(records, list) or not records or not all(
+                    isinstance(record, dict) and record.get('pname') for record in records):
+                self._send_json(400, {"error": "Every record needs a pname"})
+                return
+            if len(records) > max_batch:
+                self._send_json(413, {"error": f"At most {max_batch} records per batch"})
+                return
+
+            try:
+                rows = service.classify(records, timeout=request_timeout)
+            except ServiceBusy as e:
+                self._send_json(503, {"error": f"Service busy: {e}"}, headers={"Retry-After": "5"})
+                return
+            if path == '/classify':
+                self._send_json(200, rows[0])
+            else:
+                self._send_json(200, {"results": rows})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ClassifyHandler
+
+
+def serve(service, host='127.0.0.1', port=8080, request_timeout=120, max_batch=256):
+    """
+    Serve the classification API until interrupted.
+
+    Returns:
+    - ThreadingHTTPServer, already shut down when this returns
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service, request_timeout, max_batch))
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return server
+
+
+def classify_remote(base_url, record, timeout=180):
+    """
+    Classify a record through a running service.
+
+    Returns:
+    - dict, the result row
+    """
+    response = requests.post(f"{base_url.rstrip('/')}/classify", json=record, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve product classification over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="records classified concurrently")
+    parser.add_argument("--queue-size", type=int, default=64, help="records waiting before requests get 503")
+    parser.add_argument("--request-timeout", type=int, default=120, help="seconds a request waits for its result")
+    parser.add_argument("--banned", default="banned_drug.json", help="banned drug list")
+    parser.add_argument("--credentials", default="access_key.json", help="AWS credentials JSON")
+    parser.add_argument("--region", default="us-east-1", help="AWS region for Bedrock")
+    parser.add_argument("--cache", default="classification_cache.db", help="classification cache database")
+    parser.add_argument("--search-cache", default="search_cache.db", help="cache of search result URLs")
+    parser.add_argument("--corpus", default="corpus", help="offline corpus of reliable sources")
+    parser.add_argument("--image-cache", default="image_cache", help="cache of image extraction results")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="LLM calls in flight across all requests")
+    parser.add_argument("--llm-stub", nargs="?", const="",
+                        help="replay recorded responses instead of calling Bedrock (canned answers without a file)")
+    parser.add_argument("--llm-stub-latency-ms", type=float, default=0, help="simulated latency of stubbed calls")
+    parser.add_argument("--tiers", default=",".join(TIERS), help="comma-separated cascade tiers")
+    parser.add_argument("--results-db", default="results.db",
+                        help="results store every classified row is added to (see results_store.py)")
+    parser.add_argument("--no-results-db", action="store_true", help="do not keep classified rows")
+    args = parser.parse_args()
+
+    tracer = Tracer()
+    tracer.add_collector(get_default_limiter().prometheus_text)
+    bedrock = create_llm_client(args.credentials, args.region, max_concurrency=args.llm_concurrency,
+                                stub=args.llm_stub, stub_latency_ms=args.llm_stub_latency_ms)
+    banned_index = BannedDrugIndex.from_file(args.banned)
+    classifier = pred.DrugBanClassifier(cache=ClassificationCache(args.cache), corpus=SourceCorpus(args.corpus),
+                                        tracer=tracer, search_cache=SearchCache(args.search_cache))
+    cascade = DecisionCascade(banned_index, tracer=tracer,
+                              tiers=[tier.strip() for tier in args.tiers.split(',') if tier.strip()])
+    results_store = None if args.no_results_db else ResultsStore(args.results_db, flush_every=1)
+    service = ClassificationService(bedrock, banned_index, classifier, cascade,
+                                    ImageAnalyzer(bedrock, args.image_cache, tracer=tracer),
+                                    workers=args.workers, queue_size=args.queue_size, tracer=tracer,
+                                    results_store=results_store)
+    print(f"Serving on http://{args.host}:{args.port}")
+    serve(service, args.host, args.port, args.request_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+from llm_client import StubLLMClient
+from prediction import DrugBanClassifier, split_outputs, parse_classification_response
+
+
+def batch_items(count):
+    return [
+        {
+            "item_id": str(i + 1),
+            "drug_info": f"Drug {i + 1}",
+            "additional_info": {"pname": f"Drug {i + 1}"},
+            "source_contents": [f"Drug {i + 1} is sold on prescription in India."],
+        }
+        for i in range(count)
+    ]
+
+
+def test_verdict_only_batch_keeps_every_item():
+    classifier = DrugBanClassifier(verdict_only=True)
+    blocks = split_outputs(classifier.analyze_sources_batch(StubLLMClient(), batch_items(3)))
+    assert sorted(blocks) == ["1", "2", "3"]
+    for block in blocks.values():
+        assert parse_classification_response(block)["classification"]
@@ -0,0 +1,276 @@
+"""
+Stage-level tracing for the classification pipeline.
+
+Every pipeline stage (cache lookup, search, fetch, Bedrock analysis, image
+analysis) runs inside a span that records its wall-clock duration and
+attributes such as bytes fetched, Bedrock input/output tokens or cache hits.
+Spans can be exported as JSONL, exposed as Prometheus text and summarized
+into p50/p95/p99 latencies per stage.
+
+Usage:
+    python tracing.py summary trace.jsonl
+"""
+import json
+import math
+import time
+import argparse
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(durations):
+    """
+    Summarize span durations per stage.
+
+    Parameters:
+    - durations: dict, stage -> list of durations in milliseconds
+
+    Returns:
+    - dict, stage -> count, mean, p50, p95, p99 and max in milliseconds
+    """
+    summary = {}
+    for stage, values in sorted(durations.items()):
+        values = sorted(values)
+        if not values:
+            continue
+        summary[stage] = {
+            "count": len(values),
+            "mean_ms": round(sum(values) / len(values), 3),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "max_ms": round(values[-1], 3),
+        }
+    return summary
+
+
+class JsonlTraceExporter:
+    """Append finished spans to a JSONL file."""
+
+    def __init__(self, path):
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class Span:
+    def __init__(self, stage, trace_id, attrs):
+        self.stage = stage
+        self.trace_id = trace_id
+        self.attrs = dict(attrs)
+
+    def set(self, **attrs):
+        """Attach attributes (bytes, tokens, cache hits...) to the span."""
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    def __init__(self, exporter=None, max_samples=100000):
+        """
+        Create a tracer.
+
+        Parameters:
+        - exporter: object with export(record), e.g. JsonlTraceExporter (optional)
+        - max_samples: int, durations kept per stage for percentiles
+        """
+        self.exporter = exporter
+        self._durations = defaultdict(lambda: deque(maxlen=max_samples))
+        self._counts = defaultdict(int)
+        self._sums = defaultdict(float)
+        self._attr_totals = defaultdict(float)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._collectors = []
+
+    @contextmanager
+    def trace(self, trace_id, timings=None):
+        """
+        Tag every span opened in this thread with trace_id.
+
+        Parameters:
+        - trace_id: str, id of the product or request being traced
+        - timings: dict, filled with stage -> total milliseconds of the spans
+          this thread records inside the trace (optional)
+        """
+        previous = getattr(self._local, 'trace_id', None), getattr(self._local, 'timings', None)
+        self._local.trace_id = trace_id
+        self._local.timings = timings
+        try:
+            yield
+        finally:
+            self._local.trace_id, self._local.timings = previous
+
+    def current_trace_id(self):
+        """Trace id of this thread, to hand to work done on other threads."""
+        return getattr(self._local, 'trace_id', None)
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        """
+        Time a pipeline stage.
+
+        Parameters:
+        - stage: str, stage name such as 'search' or 'analyze'
+        - attrs: initial span attributes
+
+        Yields:
+        - Span, use span.set(...) to attach attributes measured inside
+        """
+        span = Span(stage, getattr(self._local, 'trace_id', None), attrs)
+        timings = getattr(self._local, 'timings', None)
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + duration_ms
+            self._record(span, started_at, duration_ms)
+
+    def _record(self, span, started_at, duration_ms):
+        with self._lock:
+            self._durations[span.stage].append(duration_ms)
+            self._counts[span.stage] += 1
+            self._sums[span.stage] += duration_ms
+            for key, value in span.attrs.items():
+                if isinstance(value, (int, float)):
+                    self._attr_totals[(span.stage, key)] += value
+        if self.exporter is not None:
+            record = {
+                "trace_id": span.trace_id,
+                "stage": span.stage,
+                "start": round(started_at, 6),
+                "duration_ms": round(duration_ms, 3),
+            }
+            record.update(span.attrs)
+            self.exporter.export(record)
+
+    def summary(self):
+        """Return p50/p95/p99 durations per stage for spans seen so far."""
+        with self._lock:
+            durations = {stage: list(values) for stage, values in self._durations.items()}
+        return summarize(durations)
+
+    def add_collector(self, collector):
+        """
+        Append another component's metrics to prometheus_text.
+
+        Parameters:
+        - collector: callable(prefix) returning Prometheus text, e.g. HostLimiter.prometheus_text
+        """
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def prometheus_text(self, prefix='pharma'):
+        """Render stage latencies, attribute totals and collector metrics in Prometheus text format."""
+        summary = self.summary()
+        lines = [
+            f"# HELP {prefix}_stage_duration_seconds Pipeline stage latency.",
+            f"# TYPE {prefix}_stage_duration_seconds summary",
+        ]
+        with self._lock:
+            counts = dict(self._counts)
+            sums = dict(self._sums)
+            attr_totals = dict(self._attr_totals)
+            collectors = list(self._collectors)
+        for stage, stats in summary.items():
+            for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'{prefix}_stage_duration_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                             f'{stats[key] / 1000:.6f}')
+            lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {sums[stage] / 1000:.6f}')
+            lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {counts[stage]}')
+        lines.append(f"# HELP {prefix}_stage_attribute_total Sum of numeric span attributes.")
+        lines.append(f"# TYPE {prefix}_stage_attribute_total counter")
+        for (stage, key), total in sorted(attr_totals.items()):
+            lines.append(f'{prefix}_stage_attribute_total{{stage="{stage}",attribute="{key}"}} {total:g}')
+        return '\n'.join(lines) + '\n' + ''.join(collector(prefix) for collector in collectors)
+
+
+def start_metrics_server(tracer, port=9108, host='127.0.0.1'):
+    """
+    Serve tracer.prometheus_text() on http://host:port/metrics from a daemon thread.
+
+    Only local scrapers can reach it by default; pass host='0.0.0.0' to
+    serve every interface.
+
+    Returns:
+    - ThreadingHTTPServer, call shutdown() to stop it
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/metrics':
+                self.send_error(404)
+                return
+            body = tracer.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def summarize_trace_file(path):
+    """Compute the per-stage latency summary of an exported JSONL trace."""
+    durations = defaultdict(list)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            durations[record["stage"]].append(record["duration_ms"])
+    return summarize(durations)
+
+
+_default_tracer = Tracer()
+
+
+def get_default_tracer():
+    """Return the process-wide tracer used when none is passed in."""
+    return _default_tracer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a JSONL pipeline trace.")
+    parser.add_argument("command", choices=["summary"])
+    parser.add_argument("trace", help="JSONL trace written by JsonlTraceExporter")
+    args = parser.parse_args()
+
+    summary = summarize_trace_file(args.trace)
+    print(f"{'stage':<20}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for stage, stats in summary.items():
+        print(f"{stage:<20}{stats['count']:>8}{stats['p50_ms']:>12}{stats['p95_ms']:>12}{stats['p99_ms']:>12}")
+
+
+if __name__ == "__main__":
+    main()